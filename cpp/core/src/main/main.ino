@@ -1,29 +1,121 @@
+// Light addressing. Pick the one matching the rig's wiring; the Python rig
+// file's "addressing" field should say the same.
+//   ADDR_DIRECT          one enable pin per light (EN[])
+//   ADDR_MULTIPLEXED     74HC4067 multiplexers: select pins S0-S3 pick one of
+//                        16 outputs, one active-low enable pin per bank
+//   ADDR_SHIFT_REGISTER  chained 74HC595s, one output bit per light
+#define ADDR_DIRECT 0
+#define ADDR_MULTIPLEXED 1
+#define ADDR_SHIFT_REGISTER 2
+#define ADDRESSING ADDR_DIRECT
+
 int PWM = 3;
+
+#if ADDRESSING == ADDR_DIRECT
 int EN1 = 8;
 int EN2 = 7;
 int EN3 = 6;
 int EN4 = 5;
 int EN[] = {EN1, EN2, EN3, EN4};
-const int numLights = 4; // Number of lights
+const int numChannels = 4;
+#elif ADDRESSING == ADDR_MULTIPLEXED
+int SEL[] = {8, 7, 6, 5}; // S0-S3, shared by every bank
+int BANK_EN[] = {4, 2};   // Active-low enable of each multiplexer
+const int numBanks = 2;
+const int numChannels = 16 * numBanks;
+#elif ADDRESSING == ADDR_SHIFT_REGISTER
+int DATA = 8;
+int CLOCK = 7;
+int LATCH = 6;
+const int numRegisters = 4;
+const int numChannels = 8 * numRegisters;
+#endif
+
+const int numLights = 4; // Lights used by the legacy 'F' and 'U' commands
+const int maxSequence = 255;
+byte sequence[maxSequence]; // Channels uploaded with 'Q'
+byte sequencePwm[maxSequence]; // Brightness of each step, uploaded with 'W'
+int sequenceLength = 0;
+bool sequenceHasPwm = false;
+int pwmLevel = 200; // Brightness set with 'P'
 int currentLight = 0; // Start with the first light
 bool imagingComplete = false;
 
+// Blocking read of the next serial byte
+char readByte() {
+    while (Serial.available() == 0) {
+    }
+    return Serial.read();
+}
+
+void allLightsOff() {
+#if ADDRESSING == ADDR_DIRECT
+    for (int j = 0; j < numChannels; j++) {
+      digitalWrite(EN[j], LOW);
+    }
+#elif ADDRESSING == ADDR_MULTIPLEXED
+    for (int j = 0; j < numBanks; j++) {
+      digitalWrite(BANK_EN[j], HIGH);
+    }
+#elif ADDRESSING == ADDR_SHIFT_REGISTER
+    digitalWrite(LATCH, LOW);
+    for (int j = 0; j < numRegisters; j++) {
+      shiftOut(DATA, CLOCK, MSBFIRST, 0);
+    }
+    digitalWrite(LATCH, HIGH);
+#endif
+}
+
 void turnOnLight(int lightIndex) {
+    if (lightIndex < 0 || lightIndex >= numChannels) {
+      return;
+    }
+#if ADDRESSING == ADDR_DIRECT
     digitalWrite(EN[lightIndex], HIGH);
+#elif ADDRESSING == ADDR_MULTIPLEXED
+    allLightsOff();
+    for (int b = 0; b < 4; b++) {
+      digitalWrite(SEL[b], (lightIndex >> b) & 1);
+    }
+    digitalWrite(BANK_EN[lightIndex / 16], LOW);
+#elif ADDRESSING == ADDR_SHIFT_REGISTER
+    // The last register in the chain is shifted out first
+    digitalWrite(LATCH, LOW);
+    for (int j = numRegisters - 1; j >= 0; j--) {
+      byte bits = (lightIndex / 8 == j) ? (1 << (lightIndex % 8)) : 0;
+      shiftOut(DATA, CLOCK, MSBFIRST, bits);
+    }
+    digitalWrite(LATCH, HIGH);
+#endif
 }
 
 void turnOffLight(int lightIndex) {
+#if ADDRESSING == ADDR_DIRECT
     digitalWrite(EN[lightIndex], LOW);
+#else
+    allLightsOff(); // Only one light is on at a time
+#endif
 }
 
 void setup() {
     Serial.begin(9600); // Start serial communication
-    for (int i = 0; i < numLights; i++) {
+#if ADDRESSING == ADDR_DIRECT
+    for (int i = 0; i < numChannels; i++) {
       pinMode(EN[i], OUTPUT); // Set each light pin to output
     }
-    for (int j = 0; j < numLights; j++) {
-      digitalWrite(EN[j], LOW); // Set PWM to 0% DC
+#elif ADDRESSING == ADDR_MULTIPLEXED
+    for (int i = 0; i < 4; i++) {
+      pinMode(SEL[i], OUTPUT);
+    }
+    for (int i = 0; i < numBanks; i++) {
+      pinMode(BANK_EN[i], OUTPUT);
     }
+#elif ADDRESSING == ADDR_SHIFT_REGISTER
+    pinMode(DATA, OUTPUT);
+    pinMode(CLOCK, OUTPUT);
+    pinMode(LATCH, OUTPUT);
+#endif
+    allLightsOff(); // Set PWM to 0% DC
     analogWrite(PWM, 200);
 }
 
@@ -34,10 +126,19 @@ void loop() {
 
         switch (command) {
             case 'C': // Connection established
-                for (int j = 0; j < numLights; j++) {
-                  digitalWrite(EN[j], LOW); // Set PWM to 0% DC
-                }
-                analogWrite(PWM, 200);
+                allLightsOff(); // Set PWM to 0% DC
+                pwmLevel = 200;
+                analogWrite(PWM, pwmLevel);
+                break;
+
+            case 'H': // Handshake: identify as this firmware and give the channel count
+                Serial.write("CHI");
+                Serial.write((byte) numChannels);
+                break;
+
+            case 'P': // Brightness of every light: 'P' <level>
+                pwmLevel = (byte) readByte();
+                analogWrite(PWM, pwmLevel);
                 break;
 
             case 'F': // Four-capture mode
@@ -63,6 +164,71 @@ void loop() {
             
             break;
 
+            case 'L': { // Single capture of one channel: 'L' <channel>
+              int channel = (byte) readByte();
+              if (channel >= numChannels) {
+                Serial.write('E');
+                break;
+              }
+              turnOnLight(channel);
+              Serial.write('A');
+              while (readByte() != 'B') {
+              }
+              turnOffLight(channel);
+              Serial.write('D');
+            }
+            break;
+
+            case 'Q': { // Sequence upload: 'Q' <count> <channel> * count
+              int count = (byte) readByte();
+              bool valid = true;
+              for (int i = 0; i < count; i++) {
+                sequence[i] = (byte) readByte();
+                if (sequence[i] >= numChannels) {
+                  valid = false;
+                }
+              }
+              sequenceLength = valid ? count : 0;
+              sequenceHasPwm = false;
+              Serial.write(valid ? 'K' : 'E');
+            }
+            break;
+
+            case 'W': { // Per-step brightness of the uploaded sequence: 'W' <count> <level> * count
+              int count = (byte) readByte();
+              for (int i = 0; i < count; i++) {
+                sequencePwm[i] = (byte) readByte();
+              }
+              sequenceHasPwm = count > 0 && count == sequenceLength;
+              Serial.write(sequenceHasPwm ? 'K' : 'E');
+            }
+            break;
+
+            case 'G': // Run the uploaded sequence; 'B' moves on, 'X' aborts
+              while (currentLight < sequenceLength) {
+                if (sequenceHasPwm) {
+                  analogWrite(PWM, sequencePwm[currentLight]);
+                }
+                turnOnLight(sequence[currentLight]);
+                Serial.write('A');
+
+                char x = readByte();
+                while (x != 'B' && x != 'X') {
+                  x = readByte();
+                }
+                turnOffLight(sequence[currentLight]);
+                if (x == 'X') {
+                  break;
+                }
+                currentLight++;
+              }
+
+              analogWrite(PWM, pwmLevel);
+              Serial.write('D');
+              imagingComplete = true;
+
+            break;
+
             case 'U': // Single capture mode
               int temp0 = 0;
               while (temp0 == 0) {
@@ -0,0 +1,76 @@
+"""
+Per-frame capture latency against the simulated camera and Arduino.
+
+Measures CameraController.capture_light end to end (serial round trip,
+acquisition, conversion and saving) so software overhead per frame is
+tracked separately from real exposure and LED settle times, and the time
+per frame of whole light sequences run one stage after another and
+pipelined (see capture.pipelined).
+"""
+
+import itertools
+import tempfile
+
+from common import peak_memory, quiet, summarize, time_calls
+
+from cultural_heritage_imaging.capture.controller import CameraController
+from cultural_heritage_imaging.capture.simulated import SimulatedRig
+from cultural_heritage_imaging.rig import LightRig
+from cultural_heritage_imaging.session import SessionSpec
+
+SIZES = [(640, 480), (2048, 1536)]
+
+
+def capture_latency(width, height, frames):
+    """
+    Time frames single-light captures at the given frame size.
+    """
+    rig = SimulatedRig(width=width, height=height)
+    with tempfile.TemporaryDirectory() as images_dir, quiet():
+        controller = CameraController(arduino=rig.arduino, spin=rig.spin)
+        lights = itertools.cycle('NESW')
+
+        def capture():
+            return controller.capture_light(next(lights), "bench", images_dir)
+
+        capture()  # warm up imports and file system
+        samples = time_calls(capture, frames)
+        _, peak = peak_memory(capture)
+        controller.cleanup()
+    stats = summarize(samples)
+    stats.update({'width': width, 'height': height, 'fps': 1.0 / stats['mean_s'],
+                  'peak_memory_bytes': peak})
+    return stats
+
+
+def sequence_latency(width, height, lights, sessions, pipelined):
+    """
+    Time per frame of sessions of one light sequence each, with a serial
+    latency and readout time like the real rig's.
+    """
+    rig = LightRig.ring(lights)
+    stand = SimulatedRig(width=width, height=height, serial_latency=0.005, readout_time=0.02, rig=rig)
+    with tempfile.TemporaryDirectory() as images_dir, quiet():
+        controller = CameraController(arduino=stand.arduino, spin=stand.spin, rig=rig)
+        controller.pipelined = pipelined
+        names = (f"bench{i}" for i in itertools.count())
+
+        def session():
+            controller.run_session(SessionSpec(next(names), rig=rig, pixel_format='Mono16',
+                                               output_dir=images_dir))
+
+        session()
+        samples = [sample / lights for sample in time_calls(session, sessions)]
+        controller.cleanup()
+    stats = summarize(samples)
+    stats.update({'width': width, 'height': height, 'lights': lights,
+                  'mode': 'pipelined' if pipelined else 'sequential', 'fps': 1.0 / stats['mean_s']})
+    return stats
+
+
+def run(quick=False):
+    frames = 5 if quick else 30
+    sessions = 2 if quick else 5
+    results = [capture_latency(width, height, frames) for width, height in SIZES]
+    results += [sequence_latency(2048, 1536, 8, sessions, pipelined) for pipelined in (False, True)]
+    return results
@@ -0,0 +1,46 @@
+"""
+Photometric stereo throughput against image size and light count.
+"""
+
+import numpy as np
+
+from common import peak_memory, summarize, time_calls
+
+from cultural_heritage_imaging.processing.photometry import solve_normals
+
+SIZES = [256, 512, 1024, 2048]
+LIGHT_COUNTS = [4, 8, 16, 32]
+
+
+def random_lights(count, rng):
+    """
+    Light directions spread over the upper hemisphere.
+    """
+    tilts = rng.uniform(0, 2 * np.pi, count)
+    slants = rng.uniform(0.3, 1.2, count)
+    return np.stack([np.sin(slants) * np.cos(tilts), np.sin(slants) * np.sin(tilts),
+                     np.cos(slants)], axis=1)
+
+
+def solve_throughput(size, light_count, repeats, rng):
+    """
+    Time solve_normals on a size x size stack lit by light_count lights.
+    """
+    images = rng.integers(0, 256, (light_count, size, size), dtype=np.uint8)
+    light_mat = random_lights(light_count, rng)
+    mask = np.ones((size, size), dtype=np.uint8)
+    samples = time_calls(lambda: solve_normals(images, light_mat, mask), repeats)
+    _, peak = peak_memory(lambda: solve_normals(images, light_mat, mask))
+    stats = summarize(samples)
+    stats.update({'size': size, 'lights': light_count,
+                  'mpix_per_s': size * size / stats['mean_s'] / 1e6,
+                  'peak_memory_bytes': peak})
+    return stats
+
+
+def run(quick=False):
+    rng = np.random.default_rng(0)
+    sizes = SIZES[:2] if quick else SIZES
+    repeats = 2 if quick else 5
+    return [solve_throughput(size, count, repeats, rng)
+            for size in sizes for count in LIGHT_COUNTS]
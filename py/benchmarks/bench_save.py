@@ -0,0 +1,75 @@
+"""
+Save throughput per output format for a single captured frame, and for
+exporting a solved normal map and albedo as image views (see
+processing.export).
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from common import peak_memory, summarize, time_calls
+
+from cultural_heritage_imaging._optional import lazy_import
+from cultural_heritage_imaging.processing.pipeline import save_results
+
+cv = lazy_import('cv2', "opencv-python")
+tifffile = lazy_import('tifffile')
+
+FORMATS = {
+    'tiff': ('.tif', lambda path, frame: tifffile.imwrite(path, frame)),
+    'tiff_zlib': ('.tif', lambda path, frame: tifffile.imwrite(path, frame, compression='zlib')),
+    'png': ('.png', lambda path, frame: cv.imwrite(path, frame)),
+    'bmp': ('.bmp', lambda path, frame: cv.imwrite(path, frame)),
+    'jpg': ('.jpg', lambda path, frame: cv.imwrite(path, frame)),
+    'npy': ('.npy', lambda path, frame: np.save(path, frame)),
+}
+
+
+def save_throughput(frame, name, repeats):
+    """
+    Time repeated saves of frame in one format.
+    """
+    ext, save = FORMATS[name]
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "frame" + ext)
+        save(path, frame)
+        samples = time_calls(lambda: save(path, frame), repeats)
+        _, peak = peak_memory(lambda: save(path, frame))
+        size = os.path.getsize(path)
+    stats = summarize(samples)
+    stats.update({'format': name, 'dtype': str(frame.dtype), 'width': frame.shape[1],
+                  'height': frame.shape[0], 'file_bytes': size,
+                  'mb_per_s': frame.nbytes / stats['mean_s'] / 1e6, 'peak_memory_bytes': peak})
+    return stats
+
+
+def export_throughput(width, height, repeats):
+    """
+    Time save_results on the normals and albedo of a sphere.
+    """
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    radius = 0.45 * min(width, height)
+    dx, dy = (x - width / 2) / radius, (height / 2 - y) / radius
+    inside = dx * dx + dy * dy < 1
+    normals = np.zeros((height, width, 3), dtype=np.float32)
+    normals[..., 0] = np.where(inside, dx, 0)
+    normals[..., 1] = np.where(inside, dy, 0)
+    normals[..., 2] = np.where(inside, np.sqrt(np.clip(1 - dx * dx - dy * dy, 0, 1)), 0)
+    albedo = inside * np.float32(0.8)
+    with tempfile.TemporaryDirectory() as folder:
+        samples = time_calls(lambda: save_results(normals, albedo, folder), repeats)
+        _, peak = peak_memory(lambda: save_results(normals, albedo, folder))
+    stats = summarize(samples)
+    stats.update({'format': 'views', 'width': width, 'height': height, 'peak_memory_bytes': peak})
+    return stats
+
+
+def run(quick=False):
+    repeats = 3 if quick else 10
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:1536, 0:2048]
+    # A smooth ramp plus noise compresses like a real frame, unlike pure noise
+    frame = np.clip((x + y) / 14 + rng.normal(0, 3, x.shape), 0, 255).astype(np.uint8)
+    return [save_throughput(frame, name, repeats) for name in FORMATS] + [export_throughput(2048, 1536, repeats)]
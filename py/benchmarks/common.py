@@ -0,0 +1,64 @@
+"""
+Shared helpers for the benchmark suite: timing statistics and peak memory.
+"""
+
+import contextlib
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+# Allow running from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def summarize(samples):
+    """
+    Return count, mean, median, p95, min and max of a list of durations in seconds.
+    """
+    ordered = sorted(samples)
+    count = len(ordered)
+    return {
+        'count': count,
+        'mean_s': sum(ordered) / count,
+        'p50_s': ordered[count // 2],
+        'p95_s': ordered[min(count - 1, int(round(0.95 * (count - 1))))],
+        'min_s': ordered[0],
+        'max_s': ordered[-1],
+    }
+
+
+def time_calls(fn, repeats):
+    """
+    Call fn repeats times and return the duration of each call.
+    """
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def peak_memory(fn):
+    """
+    Call fn once and return (result, peak traced allocation in bytes).
+    NumPy reports its buffers to tracemalloc, so this covers array memory.
+    """
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Silence the progress prints of the code under test.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
@@ -0,0 +1,72 @@
+"""
+Import-Time Budget Check
+
+Imports each entry module in a fresh interpreter, measures how long the
+import takes and which heavy modules it pulled in, and exits non-zero if any
+module is over its time budget or loads a library it should not. The
+modules are imported from this checkout. tests/test_import_time.py runs the
+same check under pytest; to print the timings:
+
+    python benchmarks/import_time.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+HARDWARE = ('PySpin', 'serial')
+IMAGING = ('cv2', 'tifffile')
+VIZ = ('matplotlib', 'vtk')
+
+# The py directory, imported from in each probe
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (module, budget in seconds, modules it must not load)
+BUDGETS = [
+    ('cultural_heritage_imaging', 0.05, HARDWARE + IMAGING + VIZ + ('numpy',)),
+    ('cultural_heritage_imaging.cli', 0.05, HARDWARE + IMAGING + VIZ + ('numpy',)),
+    ('cultural_heritage_imaging.capture.controller', 0.3, HARDWARE + IMAGING + VIZ),
+    ('cultural_heritage_imaging.processing.pipeline', 0.5, HARDWARE + IMAGING + VIZ),
+]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'modules': sorted(sys.modules)}}))
+"""
+
+
+def measure(module, repeats=3):
+    """
+    Return the best import time of module over repeats and the modules it loaded.
+    """
+    best = None
+    loaded = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, '-c', PROBE.format(module=module)],
+                             check=True, capture_output=True, text=True, cwd=ROOT).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        if best is None or result['seconds'] < best:
+            best = result['seconds']
+        loaded = result['modules']
+    return best, loaded
+
+
+def main():
+    failures = 0
+    for module, budget, forbidden in BUDGETS:
+        seconds, loaded = measure(module)
+        heavy = sorted(name for name in forbidden if name in loaded)
+        ok = seconds <= budget and not heavy
+        failures += not ok
+        status = "ok" if ok else "FAIL"
+        print(f"{status:4} {module}: {seconds * 1000:.1f} ms (budget {budget * 1000:.0f} ms)"
+              + (f", loaded {', '.join(heavy)}" if heavy else ""))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Benchmark Suite
+
+Runs the capture, save and photometric stereo benchmarks and writes the
+results as JSON. Compare against a previous run to catch regressions:
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --compare baseline.json --tolerance 0.2
+
+Capture latency is measured against the simulated camera and Arduino in
+cultural_heritage_imaging.capture.simulated, so no hardware is needed.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+import common  # noqa: F401  (puts the package on sys.path)
+import bench_capture
+import bench_photometry
+import bench_save
+import cultural_heritage_imaging
+
+SUITES = {
+    'capture': bench_capture,
+    'save': bench_save,
+    'photometry': bench_photometry,
+}
+
+# Keys that identify a case, and the metric compared between runs (median, lower is better)
+CASE_KEYS = ('width', 'height', 'format', 'size', 'lights', 'mode')
+METRIC = 'p50_s'
+
+
+def run_suites(names, quick):
+    """
+    Run the named suites and return the results document.
+    """
+    results = {}
+    for name in names:
+        print(f"Running {name} benchmarks...")
+        results[name] = SUITES[name].run(quick=quick)
+    return {
+        'meta': {
+            'package_version': cultural_heritage_imaging.__version__,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+            'quick': quick,
+        },
+        'results': results,
+    }
+
+
+def case_id(case):
+    return tuple((key, case[key]) for key in CASE_KEYS if key in case)
+
+
+def compare(current, baseline, tolerance):
+    """
+    Return a list of messages for cases slower than baseline by more than tolerance.
+    """
+    regressions = []
+    for name, cases in current['results'].items():
+        previous = {case_id(case): case for case in baseline.get('results', {}).get(name, [])}
+        for case in cases:
+            old = previous.get(case_id(case))
+            if old is None:
+                continue
+            ratio = case[METRIC] / old[METRIC]
+            if ratio > 1.0 + tolerance:
+                label = ", ".join(f"{k}={v}" for k, v in case_id(case))
+                regressions.append(f"{name} [{label}]: {old[METRIC] * 1000:.2f} ms -> "
+                                   f"{case[METRIC] * 1000:.2f} ms ({ratio:.2f}x)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the capture and processing benchmarks")
+    parser.add_argument('--suite', nargs='+', choices=sorted(SUITES), default=list(SUITES),
+                        help="Suites to run (default: all)")
+    parser.add_argument('--quick', action='store_true', help="Fewer repeats and smaller sizes")
+    parser.add_argument('--output', default="benchmark_results.json", help="Results JSON file")
+    parser.add_argument('--compare', help="Baseline results JSON to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed slowdown against the baseline (default: 0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    document = run_suites(args.suite, args.quick)
+    with open(args.output, 'w') as f:
+        json.dump(document, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(document, baseline, args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,28 @@
+"""
+Cultural Heritage Imaging
+
+Capture and processing tools for the MISHA photometric stereo rig: an Arduino
+switching the lights and a FLIR Blackfly 3 camera driven through Spinnaker.
+
+Subpackages:
+    capture     -- camera and Arduino control (loads PySpin/pyserial on first use)
+    processing  -- photometric stereo on captured stacks (NumPy; OpenCV for I/O)
+    rig         -- light rig descriptions: light directions and output channels
+    session     -- capture session specs and manifests
+    viz         -- interactive display helpers (matplotlib/OpenCV GUI)
+
+Submodules are imported on first attribute access, so ``import
+cultural_heritage_imaging`` loads nothing heavy.
+"""
+
+import importlib
+
+__version__ = '0.1'
+
+__all__ = ['capture', 'processing', 'rig', 'session', 'viz']
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
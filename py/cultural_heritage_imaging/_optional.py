@@ -0,0 +1,47 @@
+"""
+Optional Dependency Loading
+
+Hardware SDKs (PySpin, pyserial) and heavy imaging/visualization libraries
+(OpenCV, tifffile, matplotlib, vtk) are only imported by the subsystems that
+use them, and only when first used. Modules bind them with lazy_import() at
+the top, so the rest of the code reads as if they were imported normally.
+"""
+
+import importlib
+
+
+def import_optional(name, hint=None):
+    """
+    Import a module, raising an ImportError that says what to install.
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError as ex:
+        raise ImportError(f"{name} is required for this feature; install {hint or name}") from ex
+
+
+class LazyModule:
+    """
+    Module stand-in that imports the real module on first attribute access.
+    """
+
+    def __init__(self, name, hint=None):
+        self._name = name
+        self._hint = hint
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = import_optional(self._name, self._hint)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name, hint=None):
+    """
+    Return a LazyModule for name.
+    """
+    return LazyModule(name, hint)
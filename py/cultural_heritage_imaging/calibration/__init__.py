@@ -0,0 +1,6 @@
+"""
+Calibration Subsystem
+
+Sensor and rig calibration data that is captured once and reused across
+sessions, cached on disk and applied during processing.
+"""
@@ -0,0 +1,91 @@
+"""
+Dark Frame Calibration
+
+A master dark is the float32 mean of many lights-off frames at one exposure,
+gain and pixel format. It captures both the sensor offset and fixed-pattern
+noise, and the ambient light reaching the sensor with the rig lights off.
+Masters are cached on disk in a DarkLibrary keyed by those settings and
+subtracted from every frame before photometric stereo.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+from cultural_heritage_imaging._optional import lazy_import
+
+tifffile = lazy_import('tifffile')
+
+
+def dark_key(exposure, gain, pixel_format, shape):
+    """
+    Cache key for a master dark: exposure (s), gain (dB), pixel format and frame shape.
+    """
+    height, width = shape
+    return f"{pixel_format}_{width}x{height}_exp{round(exposure * 1_000_000)}us_gain{gain:.2f}dB"
+
+
+class DarkLibrary:
+    def __init__(self, root):
+        """
+        On-disk cache of master darks under root (<key>.tif plus <key>.json metadata).
+        """
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key + ".tif")
+
+    def get(self, exposure, gain, pixel_format, shape):
+        """
+        Return the cached master dark for these settings, or None.
+        """
+        path = self.path(dark_key(exposure, gain, pixel_format, shape))
+        if not os.path.exists(path):
+            return None
+        return tifffile.imread(path)
+
+    def put(self, dark, exposure, gain, pixel_format, frames):
+        """
+        Store a master dark and its metadata. Returns the path of the dark.
+        """
+        key = dark_key(exposure, gain, pixel_format, dark.shape)
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(key)
+        tifffile.imwrite(path, np.asarray(dark, dtype=np.float32))
+        metadata = {
+            'exposure': exposure,
+            'gain': gain,
+            'pixel_format': pixel_format,
+            'shape': list(dark.shape),
+            'frames': frames,
+            'mean_level': float(np.mean(dark)),
+            'created_at': time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime()),
+        }
+        with open(os.path.join(self.root, key + ".json"), 'w') as f:
+            json.dump(metadata, f, indent=2)
+        return path
+
+    def keys(self):
+        """
+        Keys of all cached masters.
+        """
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name[:-4] for name in os.listdir(self.root) if name.endswith(".tif"))
+
+
+def subtract_dark(stack, dark, out=None):
+    """
+    Subtract a master dark from a frame or (K, H, W) stack, clamping at zero.
+
+    Both must be in the same units (see pixels.to_linear_float32). Pass
+    out=stack to correct a float stack in place.
+    """
+    dark = np.asarray(dark, dtype=np.float32)
+    if stack.shape[-2:] != dark.shape:
+        raise ValueError(f"Dark of shape {dark.shape} does not match frames of shape {stack.shape[-2:]}")
+    out = np.subtract(stack, dark, out=out, dtype=np.float32)
+    np.maximum(out, 0, out=out)
+    return out
@@ -0,0 +1,48 @@
+"""
+Flat-Field Correction
+
+A session's 'flat' sequence images a flat, uniform reference target under
+each light. Any variation across one of those frames is the light's own
+spatial falloff plus lens vignetting, which photometric stereo would read as
+surface tilt. Dividing each target frame by its light's flat, normalized to
+mean 1, removes that variation while keeping the frame's overall level.
+"""
+
+import numpy as np
+
+
+def _flat_means(flats):
+    means = np.asarray(flats).mean(axis=(1, 2), dtype=np.float64)
+    if np.any(means <= 0):
+        raise ValueError("A flat frame has no signal; check the flat sequence exposure")
+    return means.astype(np.float32)
+
+
+def flat_gains(flats):
+    """
+    (K, H, W) float32 per-pixel gains of a dark-corrected flat stack: each
+    frame divided by its own mean.
+    """
+    flats = np.asarray(flats, dtype=np.float32)
+    return flats / _flat_means(flats)[:, None, None]
+
+
+def divide_flat(stack, flats, out=None):
+    """
+    Divide each frame of a (K, H, W) float stack by the normalized flat of the
+    same light. Pixels where the flat has no signal are set to zero. Pass
+    out=stack to correct in place. Gains are computed one frame at a time, so
+    only a frame of float32 is needed besides the stacks.
+    """
+    if np.shape(flats) != stack.shape:
+        raise ValueError(f"Need one flat per frame of the same size: stack {stack.shape}, "
+                         f"flats {np.shape(flats)}")
+    means = _flat_means(flats)
+    if out is None:
+        out = np.zeros_like(stack, dtype=np.float32)
+    for index, mean in enumerate(means):
+        gains = np.divide(flats[index], mean, dtype=np.float32)
+        valid = gains > 0
+        np.divide(stack[index], gains, out=out[index], where=valid)
+        out[index][~valid] = 0
+    return out
@@ -0,0 +1,125 @@
+"""
+Light Intensity Calibration
+
+LEDs of the same type differ in brightness, and the difference would be
+read as shading by photometric stereo. An intensity calibration images a
+flat reference target (e.g. a white diffuse card facing the camera) under
+each light at several PWM levels, and stores each light's response curve:
+the mean linear signal, net of the lights-off frame, at each level.
+
+The curves give two corrections:
+    scale(light, pwm)  -- factor making a frame taken at pwm comparable to
+                          the average light at the top calibrated level,
+                          applied per frame in processing
+    balanced_pwm()     -- per-light PWM levels giving every light the same
+                          response, uploaded with the light sequence so
+                          frames are balanced at acquisition time
+"""
+
+import json
+import time
+
+import numpy as np
+
+
+class IntensityCalibration:
+    def __init__(self, levels, responses, exposure=None, pixel_format=None, rig_name=None,
+                 created_at=None):
+        """
+        levels are the PWM values measured (ascending) and responses maps each
+        light index to its mean linear response at those levels.
+        """
+        self.levels = [int(level) for level in levels]
+        if len(self.levels) < 2 or self.levels != sorted(set(self.levels)):
+            raise ValueError("Intensity calibration needs at least 2 distinct ascending PWM levels")
+        self.responses = {int(light): [float(r) for r in curve] for light, curve in responses.items()}
+        for light, curve in self.responses.items():
+            if len(curve) != len(self.levels):
+                raise ValueError(f"Light {light} has {len(curve)} responses for {len(self.levels)} levels")
+        if not self.responses:
+            raise ValueError("Intensity calibration has no lights")
+        self.exposure = exposure
+        self.pixel_format = pixel_format
+        self.rig_name = rig_name
+        self.created_at = created_at or time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
+
+    @property
+    def reference(self):
+        """
+        Mean response of all lights at the top calibrated level.
+        """
+        return float(np.mean([curve[-1] for curve in self.responses.values()]))
+
+    def _curve(self, light):
+        try:
+            return self.responses[int(light)]
+        except KeyError:
+            raise ValueError(f"Light {light} is not in the intensity calibration") from None
+
+    def response(self, light, pwm):
+        """
+        Interpolated response of a light at a PWM level.
+        """
+        return float(np.interp(pwm, self.levels, self._curve(light)))
+
+    def scales(self, lights, pwms):
+        """
+        float32 per-frame factors normalizing frames of the given light indices,
+        taken at the given PWM levels (one per frame, or a single level).
+        """
+        pwms = np.broadcast_to(np.asarray(pwms, dtype=np.float64), (len(lights),))
+        responses = np.array([self.response(light, pwm) for light, pwm in zip(lights, pwms)])
+        if np.any(responses <= 0):
+            raise ValueError("Calibrated response is zero for a light and PWM level in use")
+        return (self.reference / responses).astype(np.float32)
+
+    def balanced_pwm(self, lights=None, ceiling=255):
+        """
+        PWM level per light (index to int) giving every light the response of
+        the dimmest one at ceiling, so no light has to exceed it.
+        """
+        lights = sorted(self.responses) if lights is None else [int(light) for light in lights]
+        target = min(self.response(light, ceiling) for light in lights)
+        balanced = {}
+        for light in lights:
+            # Response curves rise with PWM, so invert them by swapping the axes
+            curve = np.maximum.accumulate(np.asarray(self._curve(light)))
+            level = np.interp(target, curve, self.levels)
+            balanced[light] = int(min(max(round(float(level)), 0), ceiling))
+        return balanced
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['levels'], data['responses'], data.get('exposure'),
+                   data.get('pixel_format'), data.get('rig'), data.get('created_at'))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            return cls.from_dict(json.load(f))
+
+    def to_dict(self):
+        return {
+            'levels': self.levels,
+            'responses': {str(light): curve for light, curve in sorted(self.responses.items())},
+            'exposure': self.exposure,
+            'pixel_format': self.pixel_format,
+            'rig': self.rig_name,
+            'created_at': self.created_at,
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return path
+
+
+def normalize_intensity(stack, scales, out=None):
+    """
+    Multiply each frame of a (K, H, W) float stack by its scale in one
+    broadcast operation. Pass out=stack to normalize in place.
+    """
+    scales = np.asarray(scales, dtype=np.float32)
+    if scales.shape != stack.shape[:1]:
+        raise ValueError(f"Need one scale per frame: {stack.shape[0]} frames, {scales.shape} scales")
+    return np.multiply(stack, scales[:, None, None], out=out)
@@ -0,0 +1,8 @@
+"""
+Capture Subsystem
+
+Everything that talks to the rig hardware: the camera controller driving the
+FLIR camera through Spinnaker and the Arduino over serial. The Spinnaker SDK
+and pyserial are loaded the first time the hardware is used, not when this
+package is imported.
+"""
@@ -0,0 +1,37 @@
+"""
+Ambient Light Removal
+
+Lights-off reference frames captured alongside the lit frames, so the rig
+can run in a room that is not blacked out. The reference is subtracted on
+the capture thread and only the corrected frame is stored.
+
+Modes:
+    off       -- no reference frames (plain sequence)
+    frame     -- one lights-off frame right before every lit frame; follows
+                 changing ambient light at the cost of one extra frame per light
+    sequence  -- one lights-off frame per exposure, reused for every light;
+                 nearly the throughput of the plain sequence
+"""
+
+import numpy as np
+
+
+def subtract_ambient(lit, ambient, out=None):
+    """
+    Subtract a lights-off frame from a lit frame, clamping at zero.
+
+    Integer frames stay in their dtype (lit - min(lit, ambient), so unsigned
+    values cannot wrap); float frames are subtracted and clamped. out may be
+    lit itself for float frames, or a preallocated array of lit's dtype.
+    """
+    if lit.shape != ambient.shape:
+        raise ValueError(f"Ambient frame of shape {ambient.shape} does not match {lit.shape}")
+    if out is None:
+        out = np.empty_like(lit)
+    if lit.dtype.kind in 'ui' and ambient.dtype == lit.dtype:
+        np.minimum(lit, ambient, out=out)
+        np.subtract(lit, out, out=out)
+        return out
+    np.subtract(lit, ambient, out=out, casting='unsafe')
+    np.maximum(out, 0, out=out)
+    return out
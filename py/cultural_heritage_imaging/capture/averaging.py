@@ -0,0 +1,58 @@
+"""
+Multi-Frame Averaging
+
+Accumulates K frames of the same light into a running float32 mean (and
+optionally variance, by Welford's method) in place, so averaging costs no
+per-frame allocations and never holds more than one raw frame.
+"""
+
+import numpy as np
+
+
+class FrameAverager:
+    def __init__(self, shape, track_variance=False):
+        """
+        Preallocate the mean, optional variance and scratch buffers for frames of shape.
+        """
+        self.shape = tuple(shape)
+        self.track_variance = track_variance
+        self.mean = np.zeros(self.shape, dtype=np.float32)
+        self.m2 = np.zeros(self.shape, dtype=np.float32) if track_variance else None
+        self._delta = np.empty(self.shape, dtype=np.float32)
+        self._scratch = np.empty(self.shape, dtype=np.float32)
+        self.count = 0
+
+    def reset(self):
+        """
+        Start a new average, reusing the buffers.
+        """
+        self.mean.fill(0)
+        if self.m2 is not None:
+            self.m2.fill(0)
+        self.count = 0
+
+    def add(self, frame):
+        """
+        Fold one frame (any numeric dtype) into the running mean and variance.
+        """
+        if frame.shape != self.shape:
+            raise ValueError(f"Frame shape {frame.shape} does not match {self.shape}")
+        self.count += 1
+        np.subtract(frame, self.mean, out=self._delta, casting='unsafe')
+        np.multiply(self._delta, np.float32(1.0 / self.count), out=self._scratch)
+        self.mean += self._scratch
+        if self.m2 is not None:
+            # m2 += (x - old mean) * (x - new mean)
+            np.subtract(frame, self.mean, out=self._scratch, casting='unsafe')
+            self._scratch *= self._delta
+            self.m2 += self._scratch
+
+    def variance(self):
+        """
+        Sample variance of the frames added so far (zero for fewer than two frames).
+        """
+        if self.m2 is None:
+            raise ValueError("Variance was not tracked")
+        if self.count < 2:
+            return np.zeros(self.shape, dtype=np.float32)
+        return self.m2 / np.float32(self.count - 1)
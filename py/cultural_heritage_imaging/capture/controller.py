@@ -0,0 +1,1207 @@
+"""
+Spinnaker Camera Capture Framework
+
+This script provides a comprehensive interface for managing camera operations
+using the Spinnaker SDK. It includes features such as initialization, image
+capture, exposure control, and data processing utilities.
+
+Written by:
+    Lillian Kelley
+    Sai Keshav Sasanapuri
+    William Shuley
+
+For use in projects requiring customizable camera solutions.
+"""
+
+import sys
+import time
+import os
+
+import numpy as np
+
+from cultural_heritage_imaging import instrument, pixels
+from cultural_heritage_imaging._optional import lazy_import
+from cultural_heritage_imaging.calibration.dark import DarkLibrary, dark_key
+from cultural_heritage_imaging.calibration.intensity import IntensityCalibration
+from cultural_heritage_imaging.capture.ambient import subtract_ambient
+from cultural_heritage_imaging.capture.averaging import FrameAverager
+from cultural_heritage_imaging.capture.devices import find_arduino, select_camera
+from cultural_heritage_imaging.capture.journal import SessionJournal
+from cultural_heritage_imaging.capture.pipelined import PipelineStats, run_sequence
+from cultural_heritage_imaging.capture.qc import FrameQC
+from cultural_heritage_imaging.capture.roi import roi_from_frame, roi_from_mask
+from cultural_heritage_imaging.rig import LightRig
+from cultural_heritage_imaging.session import write_manifest
+
+# Hardware SDKs are loaded on first use so importing this module stays cheap
+PySpin = lazy_import('PySpin', "the Spinnaker Python SDK (spinnaker_python)")
+serial = lazy_import('serial', "pyserial")
+tifffile = lazy_import('tifffile')
+
+# Readout geometry nodes, in the order they can be programmed: binning and
+# decimation change the size limits, and the size limits the offsets
+FORMAT_NODES = ('BinningHorizontal', 'BinningVertical', 'DecimationHorizontal', 'DecimationVertical',
+                'Width', 'Height', 'OffsetX', 'OffsetY')
+
+class CameraController:
+    def __init__(self, serial_port=None, baud_rate=9600, arduino=None, spin=None,
+                 pixel_format='Mono8', rig=None, devices=None, camera_serial=None):
+        """
+        Constructor of the class. Initializes the camera, sets the exposure mode to manual,
+        disables auto-gain and auto exposure target gray, and sets the exposure to default.
+        pixel_format is one of pixels.PIXEL_FORMATS; Mono12p and Mono16 keep the sensor's
+        full bit depth and are saved as 16-bit TIFFs.
+
+        An already open serial-like arduino and a PySpin-compatible spin module can be
+        passed in instead of the real hardware (see capture.simulated). rig is the
+        LightRig wired to the Arduino (default: the four-light N/E/S/W stand).
+
+        Without a serial_port the Arduino is found by handshake on every port, and
+        camera_serial picks the camera by serial number (see capture.devices). With
+        devices, a DeviceManager, the pooled connections are borrowed and left open
+        by cleanup() for the next session.
+        """
+        # Initialize default exposure values
+        self.ORIGINAL_EXPOSURE = 0.7
+        self.selected_exposure_array = [self.ORIGINAL_EXPOSURE] * 16
+        self.acquisition_mode = 'SingleFrame'
+        self.spin = PySpin if spin is None else spin
+        self.pixel_format = None
+        self._unpack_buffer = None
+        self._averager = None
+        self._ambient = None
+        self._ambient_out = None
+        self._sequence_ambient = None
+        self.rig = LightRig.default() if rig is None else rig
+        self._uploaded_sequence = None
+        # Brightness the firmware starts with and restores on 'C'
+        self.pwm = 200
+        # Per-frame quality control (a FrameQC) and its results by filename
+        self.qc = None
+        self.retakes = 0
+        self.last_qc = None
+        self.qc_results = {}
+        # Seconds to wait for an Arduino reply, and resyncs before a session fails
+        self.serial_timeout = 10
+        self.serial_retries = 2
+        # Overlap light switching, acquisition and saving in sequences (see
+        # capture.pipelined), and the session's stage timings when doing so
+        self.pipelined = False
+        self.pipeline_stats = None
+
+        self.devices = devices
+
+        # Initialize serial connection
+        if arduino is not None:
+            self.arduino = arduino
+        elif devices is not None:
+            try:
+                self.arduino = devices.arduino(serial_port)
+            except ValueError as ex:
+                print(f"Serial connection failed: {ex}")
+                sys.exit()
+        else:
+            try:
+                with instrument.span('serial.connect', port=serial_port):
+                    self.arduino = self.connect_arduino(serial_port, baud_rate)
+            except (ValueError, serial.SerialException) as ex:
+                print(f"Serial connection failed: {ex}")
+                sys.exit()
+
+        # Initialize camera system
+        try:
+            if devices is not None:
+                self.camera = devices.camera(camera_serial)
+            else:
+                self.system = self.spin.System.GetInstance()
+                self.cam_list = self.system.GetCameras()
+                self.camera = select_camera(self.cam_list, camera_serial)
+            print("Camera detected")
+
+            # Initialize camera with default settings
+            self.initialize_camera()
+
+            # Configure manual settings
+            self.camera.ExposureAuto.SetValue(self.spin.ExposureAuto_Off)
+            self.camera.ExposureTime.SetValue(self.get_microseconds(self.ORIGINAL_EXPOSURE))
+            self.camera.GainAuto.SetValue(self.spin.GainAuto_Off)
+            self.camera.AutoExposureTargetGreyValueAuto.SetValue(self.spin.AutoExposureTargetGreyValueAuto_Off)
+            self.set_pixel_format(pixel_format)
+
+        except ValueError as ex:
+            print(ex)
+            self.cleanup()
+            sys.exit()
+        except self.spin.SpinnakerException as ex:
+            print(f"Camera initialization failed: {ex}")
+            self.cleanup()
+            sys.exit()
+
+    @staticmethod
+    def connect_arduino(serial_port=None, baud_rate=9600):
+        """
+        Open the serial link to the Arduino: by handshake on serial_port, or on
+        every port at once without one. A port given explicitly whose firmware
+        predates the handshake is opened the old way.
+        """
+        try:
+            port, connection, _ = find_arduino(None if serial_port is None else [serial_port], baud_rate)
+        except ValueError:
+            if serial_port is None:
+                raise
+            print(f"Warning: no handshake reply on {serial_port}; opening it without one")
+            connection = serial.Serial(serial_port, baud_rate, timeout=1)
+            connection.DTR = False
+            time.sleep(0.2)
+            connection.flushInput()
+            return connection
+        print(f"Serial connection established on {port}!")
+        return connection
+
+    @staticmethod
+    def get_microseconds(seconds):
+        """
+        Convert exposure time from seconds to microseconds.
+        """
+        return seconds * 1_000_000
+
+    @staticmethod
+    def format_filename(base_name, light=None, images_dir=None):
+        """
+        Format the image filename with timestamp and optional light direction.
+        Images go to ../images unless another directory is given.
+        """
+        if images_dir is None:
+            parent_dir = os.path.abspath(os.path.join(os.getcwd(), ".."))
+            images_dir = os.path.join(parent_dir, "images")
+        if not os.path.exists(images_dir):
+            os.makedirs(images_dir)
+        current_time = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
+        if light:
+            return os.path.join(images_dir, f"{base_name}_{light}_captured_at_{current_time}.tif")
+        return os.path.join(images_dir, f"{base_name}_captured_at_{current_time}.tif")
+
+    @staticmethod
+    def image_again():
+        """
+        Prompt user to continue imaging.
+        """
+        while True:
+            print("Image again? [Y/n]")
+            re = input(">> ").upper()
+            if re == 'Y':
+                return False
+            elif re == 'N':
+                return True
+            print("Incorrect entry. Retry.")
+
+    def initialize_camera(self, mode='SingleFrame'):
+        """
+        Initialize the camera with the specified acquisition mode.
+        """
+        try:
+            with instrument.span('camera.initialize', mode=mode):
+                # Pooled cameras stay initialized between sessions
+                if not self.camera.IsInitialized():
+                    self.camera.Init()
+                self.acquisition_mode = None
+                self.set_acquisition_mode(mode)
+        except self.spin.SpinnakerException as ex:
+            raise ValueError(f"Camera initialization failed: {ex}")
+
+    def set_acquisition_mode(self, mode):
+        """
+        Set the acquisition mode ('SingleFrame' or 'Continuous') if it differs.
+        """
+        if mode == self.acquisition_mode:
+            return
+        nodemap = self.camera.GetNodeMap()
+        node_acquisition_mode = self.spin.CEnumerationPtr(nodemap.GetNode('AcquisitionMode'))
+        node_acquisition_mode_ = node_acquisition_mode.GetEntryByName(mode)
+        acquisition_mode_ = node_acquisition_mode_.GetValue()
+        node_acquisition_mode.SetIntValue(acquisition_mode_)
+        self.acquisition_mode = mode
+
+    def set_pwm(self, pwm_value):
+        """
+        Send PWM value to Arduino.
+        """
+        if not 0 <= pwm_value <= 255:
+            print("Error: PWM value must be between 0 and 255")
+            return
+        self.arduino.write('P'.encode())
+        self.arduino.write(bytes([pwm_value]))
+        self.arduino.flush()
+        self.pwm = pwm_value
+        print(f"Set PWM to {pwm_value}")
+
+    def set_exposure(self, seconds):
+        """
+        Set a manual exposure time, given in seconds.
+        """
+        try:
+            self.camera.ExposureTime.SetValue(self.get_microseconds(seconds))
+        except self.spin.SpinnakerException as ex:
+            raise ValueError(f"Setting exposure to {seconds} s failed: {ex}")
+
+    def set_pixel_format(self, pixel_format):
+        """
+        Set the camera pixel format. Formats deeper than 8 bits also turn gamma
+        off so frames stay linear for photometric stereo, and Bayer formats turn
+        automatic white balance off so every light gets the same channel gains.
+        """
+        pixels.bit_depth(pixel_format)
+        if pixel_format == self.pixel_format:
+            return
+        try:
+            nodemap = self.camera.GetNodeMap()
+            node_pixel_format = self.spin.CEnumerationPtr(nodemap.GetNode('PixelFormat'))
+            entry = node_pixel_format.GetEntryByName(pixel_format)
+            node_pixel_format.SetIntValue(entry.GetValue())
+        except self.spin.SpinnakerException as ex:
+            raise ValueError(f"Setting pixel format {pixel_format} failed: {ex}")
+        if pixel_format != 'Mono8':
+            try:
+                gamma_enable = self.spin.CBooleanPtr(nodemap.GetNode('GammaEnable'))
+                if self.spin.IsAvailable(gamma_enable) and self.spin.IsWritable(gamma_enable):
+                    gamma_enable.SetValue(False)
+            except self.spin.SpinnakerException:
+                pass
+        if pixels.bayer_pattern(pixel_format):
+            try:
+                balance_auto = self.spin.CEnumerationPtr(nodemap.GetNode('BalanceWhiteAuto'))
+                if self.spin.IsAvailable(balance_auto) and self.spin.IsWritable(balance_auto):
+                    balance_auto.SetIntValue(balance_auto.GetEntryByName('Off').GetValue())
+            except self.spin.SpinnakerException:
+                pass
+        self.pixel_format = pixel_format
+        self._unpack_buffer = None
+        print(f"Pixel format set to {pixel_format}")
+
+    def show_help(self):
+        """
+        Display help message with available commands.
+        """
+        print("\nAvailable Commands:")
+        print("  F: Four-capture mode (captures images with all four lights: N, E, S, W)")
+        print("  U: Single-capture mode (captures one image with a specified light: N, S, E, or W)")
+        print("  P: Set PWM value for light brightness (0-255)")
+        print("  R: Reset Arduino state (turns off all lights, resets light sequence)")
+        print("  H: Show this help message")
+        print("  Q: Quit the program\n")
+
+    def capture_image(self, light=None, base_name="Image", images_dir=None, frames=1,
+                      save_variance=False, ambient=None):
+        """
+        Capture and save an image with the specified light.
+        Returns the saved filename, or None if nothing was saved.
+
+        With frames > 1 the frames are grabbed back-to-back from one armed
+        acquisition and saved as their float32 mean (plus a _var variance file
+        if save_variance is set). A lights-off ambient frame, if given, is
+        subtracted before saving and only the corrected frame is stored.
+        """
+        if frames > 1:
+            return self.capture_averaged(light, base_name, images_dir, frames, save_variance,
+                                         ambient)
+        saved = None
+        try:
+            self.set_acquisition_mode('SingleFrame')
+            with instrument.span('capture.acquire', light=light):
+                self.camera.BeginAcquisition()
+                image = self.camera.GetNextImage()
+            if image.IsIncomplete():
+                print(f'Image incomplete with status {image.GetImageStatus()}')
+            else:
+                filename = CameraController.format_filename(base_name, light, images_dir)
+                try:
+                    # Frames are written in their native bit depth; packed 12-bit data is
+                    # unpacked into a reused buffer rather than converted by the SDK
+                    with instrument.span('capture.convert', light=light):
+                        numpy_array = pixels.frame_to_array(image, self.pixel_format,
+                                                            self._unpack_buffer)
+                        if self.pixel_format in pixels.PACKED_FORMATS:
+                            self._unpack_buffer = numpy_array
+                    self._measure(numpy_array, light)
+                    if ambient is not None:
+                        with instrument.span('capture.ambient', light=light):
+                            if self._ambient_out is None or self._ambient_out.shape != numpy_array.shape \
+                                    or self._ambient_out.dtype != numpy_array.dtype:
+                                self._ambient_out = np.empty_like(numpy_array)
+                            numpy_array = subtract_ambient(numpy_array, ambient, self._ambient_out)
+                    with instrument.span('capture.save', light=light):
+                        print(f"Image array shape: {numpy_array.shape}")
+                        tifffile.imwrite(filename, numpy_array)
+                    print(f"Image saved successfully at {filename}")
+                    saved = filename
+                except Exception as ex:
+                    print(f"Failed to save image at {filename}: {ex}")
+            image.Release()
+            self.camera.EndAcquisition()
+        except self.spin.SpinnakerException as ex:
+            print(f"Spinnaker Exception: {ex}")
+        return saved
+
+    def capture_averaged(self, light, base_name, images_dir, frames, save_variance=False,
+                         ambient=None):
+        """
+        Average frames consecutive frames of a continuous acquisition into one float32 image.
+        Returns the saved filename, or None if the capture failed.
+        """
+        averager = self.grab_average(frames, save_variance, light)
+        if averager is None:
+            return None
+        self._measure(averager.mean, light)
+        if ambient is not None:
+            with instrument.span('capture.ambient', light=light):
+                subtract_ambient(averager.mean, ambient, out=averager.mean)
+        saved = None
+        filename = CameraController.format_filename(base_name, light, images_dir)
+        try:
+            with instrument.span('capture.save', light=light):
+                tifffile.imwrite(filename, averager.mean)
+                if save_variance:
+                    root, ext = os.path.splitext(filename)
+                    tifffile.imwrite(f"{root}_var{ext}", averager.variance())
+            print(f"Average of {frames} frames saved successfully at {filename}")
+            saved = filename
+        except Exception as ex:
+            print(f"Failed to save image at {filename}: {ex}")
+        return saved
+
+    def _measure(self, frame, light):
+        if self.qc is not None:
+            with instrument.span('capture.qc', light=light):
+                self.last_qc = self.qc.measure(frame)
+
+    def capture_checked(self, light, base_name="Image", images_dir=None, frames=1,
+                        save_variance=False, ambient=None):
+        """
+        capture_image with quality control: while self.qc is set and a frame
+        fails its checks, delete it and capture again (the light stays on), up
+        to self.retakes times. The last attempt is kept either way and its
+        metrics are recorded in self.qc_results.
+        """
+        attempt = 0
+        while True:
+            self.last_qc = None
+            filename = self.capture_image(light, base_name, images_dir, frames, save_variance,
+                                          ambient)
+            if filename is None or self.last_qc is None:
+                return filename
+            metrics = self.last_qc
+            metrics['retakes'] = attempt
+            if metrics['passed'] or attempt >= self.retakes:
+                break
+            attempt += 1
+            print(f"QC failed for light {light} ({', '.join(metrics['failures'])}), "
+                  f"retake {attempt} of {self.retakes}")
+            os.remove(filename)
+            root, ext = os.path.splitext(filename)
+            if os.path.exists(f"{root}_var{ext}"):
+                os.remove(f"{root}_var{ext}")
+        if not metrics['passed']:
+            print(f"Warning: keeping frame for light {light} that failed QC: "
+                  f"{', '.join(metrics['failures'])}")
+        self.qc_results[filename] = metrics
+        return filename
+
+    def grab_average(self, frames, save_variance=False, light=None):
+        """
+        Grab frames consecutive frames from one continuous acquisition into the
+        reusable FrameAverager. Incomplete frames are skipped and replaced, up to
+        frames extra attempts. Returns the averager, or None on failure.
+        """
+        averager = None
+        try:
+            self.set_acquisition_mode('Continuous')
+            with instrument.span('capture.acquire', light=light, frames=frames):
+                self.camera.BeginAcquisition()
+            try:
+                attempts = 0
+                while (averager is None or averager.count < frames) and attempts < 2 * frames:
+                    attempts += 1
+                    with instrument.span('capture.grab', light=light):
+                        image = self.camera.GetNextImage()
+                    try:
+                        if image.IsIncomplete():
+                            print(f'Image incomplete with status {image.GetImageStatus()}')
+                            continue
+                        with instrument.span('capture.accumulate', light=light):
+                            array = pixels.frame_to_array(image, self.pixel_format, self._unpack_buffer)
+                            if self.pixel_format in pixels.PACKED_FORMATS:
+                                self._unpack_buffer = array
+                            if averager is None:
+                                averager = self._reusable_averager(array.shape, save_variance)
+                            averager.add(array)
+                    finally:
+                        image.Release()
+            finally:
+                self.camera.EndAcquisition()
+        except self.spin.SpinnakerException as ex:
+            print(f"Spinnaker Exception: {ex}")
+            return None
+
+        if averager is None or averager.count < frames:
+            print(f"Only {0 if averager is None else averager.count} of {frames} frames complete for light {light}")
+            return None
+        return averager
+
+    def grab_frame(self, light=None):
+        """
+        Grab one frame and return it as an array that stays valid after release
+        (copied into a reused buffer), or None on failure.
+        """
+        try:
+            self.set_acquisition_mode('SingleFrame')
+            with instrument.span('capture.acquire', light=light):
+                self.camera.BeginAcquisition()
+                image = self.camera.GetNextImage()
+            try:
+                if image.IsIncomplete():
+                    print(f'Image incomplete with status {image.GetImageStatus()}')
+                    return None
+                array = pixels.frame_to_array(image, self.pixel_format, self._unpack_buffer)
+                if self.pixel_format in pixels.PACKED_FORMATS:
+                    self._unpack_buffer = array
+                if self._ambient is None or self._ambient.shape != array.shape \
+                        or self._ambient.dtype != array.dtype:
+                    self._ambient = np.empty_like(array)
+                np.copyto(self._ambient, array)
+                return self._ambient
+            finally:
+                image.Release()
+                self.camera.EndAcquisition()
+        except self.spin.SpinnakerException as ex:
+            print(f"Spinnaker Exception: {ex}")
+            return None
+
+    def grab_ambient(self, frames=1):
+        """
+        Grab a lights-off reference (the mean of frames frames when frames > 1).
+        Lights are off between captures, so no serial command is needed.
+        """
+        with instrument.span('capture.ambient_grab', frames=frames):
+            if frames == 1:
+                return self.grab_frame('ambient')
+            # The averager is reused for the lit frames, so keep the mean in its own buffer
+            averager = self.grab_average(frames, light='ambient')
+            if averager is None:
+                return None
+            if self._ambient is None or self._ambient.shape != averager.mean.shape \
+                    or self._ambient.dtype != averager.mean.dtype:
+                self._ambient = np.empty_like(averager.mean)
+            np.copyto(self._ambient, averager.mean)
+            return self._ambient
+
+    def get_gain(self):
+        """
+        Current camera gain in dB (0 if the camera has no readable Gain node).
+        """
+        try:
+            return float(self.camera.Gain.GetValue())
+        except (AttributeError, self.spin.SpinnakerException):
+            return 0.0
+
+    def capture_master_dark(self, frames=16):
+        """
+        Turn all lights off with 'C' and return the float32 mean of frames dark frames
+        at the current exposure, gain and pixel format, or None on failure. The
+        PWM level, which the firmware resets on 'C', is restored.
+        """
+        self.arduino.write(b'C')
+        if self.pwm != 200:
+            self.arduino.write(b'P' + bytes([self.pwm]))
+        self.arduino.flush()
+        with instrument.span('capture.dark', frames=frames):
+            averager = self.grab_average(frames, light='dark')
+        return None if averager is None else averager.mean.copy()
+
+    def ensure_master_dark(self, library, exposure, frames=16):
+        """
+        Return the path of the cached master dark for exposure, capturing it if needed.
+        """
+        self.set_exposure(exposure)
+        gain = self.get_gain()
+        cached = library.get(exposure, gain, self.pixel_format, self.frame_shape())
+        key_path = library.path(dark_key(exposure, gain, self.pixel_format, self.frame_shape()))
+        if cached is not None:
+            print(f"Using cached master dark {key_path}")
+            return key_path
+        print(f"Capturing master dark from {frames} frames at {exposure:g} s")
+        dark = self.capture_master_dark(frames)
+        if dark is None:
+            return None
+        return library.put(dark, exposure, gain, self.pixel_format, frames)
+
+    def camera_format(self):
+        """
+        Current readout geometry as {node: value} for the FORMAT_NODES this
+        camera has.
+        """
+        values = {}
+        for name in FORMAT_NODES:
+            node = getattr(self.camera, name, None)
+            if node is None:
+                continue
+            try:
+                values[name] = int(node.GetValue())
+            except self.spin.SpinnakerException:
+                continue
+        return values
+
+    def set_camera_format(self, **values):
+        """
+        Program readout geometry nodes (see FORMAT_NODES) that differ from their
+        current value. Offsets are cleared first so the size can grow, and each
+        value is rounded down to its node's increment and clamped to its range.
+        Nodes not given keep their value where it is still valid. Returns the
+        geometry now in effect.
+        """
+        unknown = set(values) - set(FORMAT_NODES)
+        if unknown:
+            raise ValueError(f"Unknown camera format nodes: {', '.join(sorted(unknown))}")
+        current = self.camera_format()
+        missing = [name for name in values if name not in current]
+        if missing:
+            raise ValueError(f"Camera has no {', '.join(missing)} node")
+        target = dict(current, **{name: int(value) for name, value in values.items()})
+        if target == current:
+            return current
+        try:
+            for name in ('OffsetX', 'OffsetY'):
+                if name in current:
+                    getattr(self.camera, name).SetValue(0)
+            for name in FORMAT_NODES:
+                if name not in target:
+                    continue
+                node = getattr(self.camera, name)
+                increment = max(int(node.GetInc()), 1)
+                low, high = int(node.GetMin()), int(node.GetMax())
+                value = min(max(target[name], low), high)
+                node.SetValue(low + (value - low) // increment * increment)
+        except self.spin.SpinnakerException as ex:
+            raise ValueError(f"Setting camera format {values} failed: {ex}")
+        self._unpack_buffer = None
+        return self.camera_format()
+
+    def set_roi(self, roi):
+        """
+        Read out only (x, y, width, height) of the full sensor. The box is
+        grown outwards to the camera's offset and size increments. Returns the
+        manifest record of the region actually read out (see capture.roi).
+        """
+        x, y, width, height = (int(value) for value in roi)
+        aligned = {}
+        for offset_name, size_name, start, size in (('OffsetX', 'Width', x, width),
+                                                     ('OffsetY', 'Height', y, height)):
+            offset_step = max(int(getattr(self.camera, offset_name).GetInc()), 1)
+            size_step = max(int(getattr(self.camera, size_name).GetInc()), 1)
+            aligned[offset_name] = start // offset_step * offset_step
+            end = start + size
+            aligned[size_name] = -(-(end - aligned[offset_name]) // size_step) * size_step
+        current = self.set_camera_format(**aligned)
+        record = {'x': current['OffsetX'], 'y': current['OffsetY'],
+                  'width': current['Width'], 'height': current['Height'],
+                  'sensor': [int(self.camera.WidthMax.GetValue()), int(self.camera.HeightMax.GetValue())]}
+        print(f"Reading out {record['width']}x{record['height']} at ({record['x']}, {record['y']}) "
+              f"of the {record['sensor'][0]}x{record['sensor'][1]} sensor")
+        return record
+
+    def find_roi(self, lights):
+        """
+        Bounding box (x, y, width, height) of the object in frames lit by up to
+        four of the given rig lights, spread over them so every side of the
+        object is lit; None if it fills nearly the whole frame or a frame
+        could not be taken.
+        """
+        lights = self.rig.resolve(lights)
+        picks = [lights[i * len(lights) // 4] for i in range(min(len(lights), 4))]
+        brightest = None
+        with instrument.span('capture.find_roi', lights=len(picks)):
+            for index in picks:
+                light = self.rig[index]
+                self.arduino.write(b'L' + bytes([light.channel]))
+                self.arduino.flush()
+                if self.wait_for((b'A',), light.name) is None:
+                    self.resync()
+                    return None
+                frame = self.grab_frame(light.name)
+                self.arduino.write(b'B')
+                self.arduino.flush()
+                if self.wait_for((b'D',), light.name) is None:
+                    self.resync()
+                if frame is None:
+                    return None
+                brightest = frame.copy() if brightest is None else np.maximum(brightest, frame)
+        return roi_from_frame(brightest)
+
+    def _session_roi(self, spec):
+        """
+        (x, y, width, height) to read out for a session's ROI setting, or
+        None for the whole sensor.
+        """
+        if spec.roi == 'auto':
+            self.set_exposure(spec.exposures[0])
+            box = self.find_roi(spec.lights)
+            if box is None:
+                print("No object bounding box found; reading out the whole sensor")
+            return box
+        if isinstance(spec.roi, str):
+            return roi_from_mask(spec.roi)
+        return spec.roi
+
+    def frame_shape(self):
+        """
+        (height, width) of the frames the camera currently delivers.
+        """
+        return int(self.camera.Height.GetValue()), int(self.camera.Width.GetValue())
+
+    def _reusable_averager(self, shape, track_variance):
+        """
+        Reset and return the cached FrameAverager, or make one for a new shape.
+        """
+        averager = self._averager
+        if averager is None or averager.shape != tuple(shape) or averager.track_variance != track_variance:
+            averager = self._averager = FrameAverager(shape, track_variance)
+        else:
+            averager.reset()
+        return averager
+
+    def serial_com(self, mode='U', light=None):
+        """
+        Handle serial communication for image capture.
+        """
+        with instrument.span('serial.com', mode=mode, light=light):
+            return self._serial_com(mode, light)
+
+    def _serial_com(self, mode, light):
+        finish = False
+        light_map = {0: 'N', 1: 'E', 2: 'S', 3: 'W'}
+        captured = False  # Track if capture occurred
+        if mode == 'F':
+            lights = ['N', 'S', 'E', 'W']
+            for light in lights:
+                self.arduino.write(light.encode())
+                self.arduino.flush()
+                start_time = time.time()
+                while True:
+                    if time.time() - start_time > self.serial_timeout:
+                        print(f"Timeout waiting for Arduino response for light {light}")
+                        return True, False
+                    x = self.arduino.read()
+                    if not x:
+                        continue
+                    print(f"DEBUG: Received from Arduino: {x}")
+                    if x == b'L':
+                        if self.arduino.in_waiting > 0:
+                            light_index = self.arduino.read()[0]
+                            print(f"Arduino confirmed light {light_map.get(light_index, 'Unknown')} (index {light_index})")
+                        continue
+                    elif x == b'A':
+                        self.capture_image(light)
+                        print(f"Capture done for light {light}")
+                        time.sleep(1.0)
+                        self.arduino.write('B'.encode())
+                        self.arduino.flush()
+                        captured = True
+                        break
+                    elif x == b'D':
+                        print(f"Warning: Received unexpected D from Arduino for light {light} before capture")
+                        return True, False
+                    elif x == b'E':
+                        print(f"Error received from Arduino for light {light}")
+                        return True, False
+        else:
+            self.arduino.write(light.encode())
+            self.arduino.flush()
+            start_time = time.time()
+            while True:
+                if time.time() - start_time > self.serial_timeout:
+                    print(f"Timeout waiting for Arduino response for light {light}")
+                    return True, False
+                x = self.arduino.read()
+                if not x:
+                    continue
+                print(f"DEBUG: Received from Arduino: {x}")
+                if x == b'L':
+                    if self.arduino.in_waiting > 0:
+                        light_index = self.arduino.read()[0]
+                        print(f"Arduino confirmed light {light_map.get(light_index, 'Unknown')} (index {light_index})")
+                    continue
+                elif x == b'A':
+                    self.capture_image(light)
+                    print(f"Capture done for light {light}")
+                    time.sleep(1.0)
+                    self.arduino.write('B'.encode())
+                    self.arduino.flush()
+                    captured = True
+                    break
+                elif x == b'D':
+                    print(f"Warning: Received unexpected D from Arduino for light {light} before capture")
+                    return True, False
+                elif x == b'E':
+                    print(f"Error received from Arduino for light {light}")
+                    return True, False
+        return finish, captured
+
+    def wait_for(self, expected, light=None):
+        """
+        Wait for one of the expected bytes from the Arduino.
+        Returns the byte received, or None on timeout or an 'E' error.
+        """
+        with instrument.span('serial.wait', expected=b''.join(expected).decode(), light=light):
+            start_time = time.time()
+            while time.time() - start_time < self.serial_timeout:
+                x = self.arduino.read()
+                if not x:
+                    continue
+                if x in expected:
+                    return x
+                if x == b'E':
+                    print(f"Error received from Arduino for light {light}")
+                    return None
+            print(f"Timeout waiting for Arduino response for light {light}")
+            return None
+
+    def capture_light(self, light, base_name="Image", images_dir=None, frames=1,
+                      save_variance=False, ambient='off', pwm=None):
+        """
+        Capture a single frame with one rig light (index or name) using the 'L'
+        command, without prompting. Returns the saved filename, or None if the
+        capture failed. frames > 1 averages that many frames while the light stays
+        on (see capture_image). ambient is a mode from capture.ambient: 'frame'
+        grabs a lights-off frame first, 'sequence' uses the one grabbed by
+        start_ambient_sequence. pwm lights this frame at another brightness
+        than the one set with set_pwm.
+        """
+        index = self.rig.index(light)
+        with instrument.span('capture.light', light=self.rig[index].name):
+            return self._capture_light(index, base_name, images_dir, frames, save_variance,
+                                       ambient, pwm)
+
+    def start_ambient_sequence(self, frames=1):
+        """
+        Grab the lights-off frame reused by every light in 'sequence' ambient mode.
+        Returns False if it could not be captured.
+        """
+        reference = self.grab_ambient(frames)
+        self._sequence_ambient = None if reference is None else reference.copy()
+        return self._sequence_ambient is not None
+
+    def _ambient_reference(self, ambient, frames):
+        if ambient == 'frame':
+            return self.grab_ambient(frames)
+        if ambient == 'sequence':
+            if self._sequence_ambient is None:
+                raise ValueError("start_ambient_sequence must be called before capturing in 'sequence' mode")
+            return self._sequence_ambient
+        return None
+
+    def _capture_light(self, index, base_name, images_dir, frames, save_variance, ambient, pwm=None):
+        light = self.rig[index].name
+        reference = self._ambient_reference(ambient, frames)
+        if ambient != 'off' and reference is None:
+            return None
+        command = b'L' + bytes([self.rig[index].channel])
+        if pwm is not None and pwm != self.pwm:
+            command = b'P' + bytes([pwm]) + command
+        self.arduino.write(command)
+        self.arduino.flush()
+        filename = None
+        if self.wait_for((b'A',), light) is not None:
+            filename = self.capture_checked(light, base_name, images_dir, frames, save_variance,
+                                            reference)
+            self.arduino.write('B'.encode())
+            self.arduino.flush()
+            # Consume the 'D' so it is not mistaken for a reply to the next command
+            self.wait_for((b'D',), light)
+        if pwm is not None and pwm != self.pwm:
+            self.arduino.write(b'P' + bytes([self.pwm]))
+            self.arduino.flush()
+        return filename
+
+    def measure_light_response(self, levels, lights=None, frames=4, roi=None):
+        """
+        Measure the response of rig lights (default: all) on a flat reference
+        target at each PWM level. The response is the mean of frames averaged
+        frames over roi (x, y, width, height; default: the whole frame), minus
+        the lights-off level, in linear [0, 1] units. Returns an
+        IntensityCalibration, or None if a capture failed.
+        """
+        levels = sorted({int(level) for level in levels})
+        indices = self.rig.resolve(lights)
+        scale = 1.0 / (2 ** pixels.bit_depth(self.pixel_format) - 1)
+        if roi is None:
+            window = (slice(None), slice(None))
+        else:
+            x, y, width, height = roi
+            window = (slice(y, y + height), slice(x, x + width))
+
+        dark = self.capture_master_dark(frames)
+        if dark is None:
+            return None
+        dark_level = float(dark[window].mean())
+        restore_pwm = self.pwm
+        responses = {}
+        try:
+            for index in indices:
+                light = self.rig[index].name
+                curve = []
+                for level in levels:
+                    with instrument.span('capture.intensity', light=light, pwm=level):
+                        self.arduino.write(b'P' + bytes([level]) + b'L' + bytes([self.rig[index].channel]))
+                        self.arduino.flush()
+                        if self.wait_for((b'A',), light) is None:
+                            return None
+                        averager = self.grab_average(frames, light=light)
+                        self.arduino.write(b'B')
+                        self.arduino.flush()
+                        self.wait_for((b'D',), light)
+                    if averager is None:
+                        return None
+                    curve.append((float(averager.mean[window].mean()) - dark_level) * scale)
+                responses[index] = curve
+                print(f"Light {light}: " + ", ".join(f"{level}={r:.4f}" for level, r in zip(levels, curve)))
+        finally:
+            self.arduino.write(b'P' + bytes([restore_pwm]))
+            self.arduino.flush()
+        exposure = self.camera.ExposureTime.GetValue() / 1_000_000
+        return IntensityCalibration(levels, responses, exposure, self.pixel_format, self.rig.name)
+
+    def upload_sequence(self, lights, pwm=None):
+        """
+        Upload the channels of a light sequence (indices or names) to the Arduino
+        with the 'Q' command, and with 'W' the PWM level of each step if pwm is
+        given (one level per light). Unchanged sequences are not sent again.
+        Returns True once the Arduino has acknowledged it.
+        """
+        channels = bytes(self.rig[index].channel for index in self.rig.resolve(lights))
+        levels = None if pwm is None else bytes(int(level) for level in pwm)
+        if levels is not None and len(levels) != len(channels):
+            raise ValueError(f"Need one PWM level per light: {len(channels)} lights, {len(levels)} levels")
+        if (channels, levels) == self._uploaded_sequence:
+            return True
+        self._uploaded_sequence = None
+        with instrument.span('serial.upload', lights=len(channels)):
+            self.arduino.write(b'Q' + bytes([len(channels)]) + channels)
+            self.arduino.flush()
+            if self.wait_for((b'K',), 'sequence') is None:
+                return False
+            if levels is not None:
+                self.arduino.write(b'W' + bytes([len(levels)]) + levels)
+                self.arduino.flush()
+                if self.wait_for((b'K',), 'sequence') is None:
+                    return False
+        self._uploaded_sequence = (channels, levels)
+        return True
+
+    def capture_sequence(self, lights, base_name="Image", images_dir=None, frames=1,
+                         save_variance=False, ambient='off', pwm=None, on_frame=None):
+        """
+        Capture one frame per light (indices or names) by running an uploaded
+        sequence with the 'G' command: the Arduino lights each channel in turn and
+        moves on when the frame is done, so there is one command per sequence
+        rather than per light. pwm optionally gives each light its own
+        brightness. Returns the saved filenames in light order, stopping at the
+        first failure. Frames failing quality control are retaken before the
+        Arduino moves to the next light (see capture_checked). on_frame(index,
+        filename) is called as each frame is saved. With self.pipelined the
+        next light is switched on while the previous frame is still being
+        written (see capture.pipelined).
+
+        'frame' ambient mode needs the lights off between frames, so it captures
+        light by light instead.
+        """
+        indices = self.rig.resolve(lights)
+        if self.qc is not None:
+            self.qc.start_sequence()
+        if ambient == 'frame':
+            filenames = []
+            for step, index in enumerate(indices):
+                filename = self.capture_light(index, base_name, images_dir, frames, save_variance,
+                                              ambient, None if pwm is None else pwm[step])
+                if filename is None:
+                    break
+                filenames.append(filename)
+                if on_frame is not None:
+                    on_frame(index, filename)
+            return filenames
+
+        reference = self._ambient_reference(ambient, frames)
+        if not self.upload_sequence(indices, pwm):
+            return []
+        if self.pipelined:
+            return run_sequence(self, indices, base_name, images_dir, frames, save_variance,
+                                reference, on_frame, self.pipeline_stats)
+        self.arduino.write(b'G')
+        self.arduino.flush()
+        filenames = []
+        for index in indices:
+            light = self.rig[index].name
+            with instrument.span('capture.light', light=light):
+                if self.wait_for((b'A',), light) is None:
+                    return filenames
+                filename = self.capture_checked(light, base_name, images_dir, frames,
+                                                save_variance, reference)
+                if filename is None:
+                    # Abort the rest of the sequence; the Arduino turns the light off and sends 'D'
+                    self.arduino.write(b'X')
+                    self.arduino.flush()
+                    self.wait_for((b'D',), light)
+                    return filenames
+                self.arduino.write(b'B')
+                self.arduino.flush()
+                filenames.append(filename)
+                if on_frame is not None:
+                    on_frame(index, filename)
+        self.wait_for((b'D',), 'sequence')
+        return filenames
+
+    def run_session(self, spec, root=None, darks=None, resume=False):
+        """
+        Capture every frame of a SessionSpec unattended and write its manifest.
+        Returns True if all frames were captured. darks is the DarkLibrary used
+        when the spec asks for dark frames.
+
+        Every saved frame is journaled (see capture.journal). A light that
+        times out or gets an 'E' is retried after resync(), up to
+        serial_retries times, and with resume an interrupted session continues
+        from its journal instead of starting over.
+        """
+        with instrument.span('capture.session', object_id=spec.object_id):
+            return self._run_session(spec, root, darks, resume)
+
+    def _run_session(self, spec, root, darks, resume=False):
+        session_dir = spec.session_dir(root)
+        journal = SessionJournal.open(session_dir, spec, resume)
+        print(f"Capturing {spec.frame_count()} frames of {spec.object_id} into {session_dir}")
+        if spec.pwm is not None:
+            self.set_pwm(spec.pwm)
+        self.set_pixel_format(spec.pixel_format)
+        # The spec's rig is the one wired to the Arduino for this session
+        self.rig = spec.rig
+        self._uploaded_sequence = None
+        self.qc = None if spec.qc is None else FrameQC(pixels.bit_depth(spec.pixel_format), spec.qc)
+        self.retakes = spec.retakes
+        self.qc_results = {}
+        self.pipeline_stats = PipelineStats() if self.pipelined else None
+        calibration = None
+        light_pwms = [self.pwm] * len(spec.lights)
+        if spec.intensity_calibration:
+            calibration = IntensityCalibration.load(spec.intensity_calibration)
+            if spec.balance_lights:
+                balanced = calibration.balanced_pwm(spec.lights, ceiling=self.pwm)
+                light_pwms = [balanced[index] for index in spec.lights]
+                print("Balanced PWM: " + ", ".join(f"{self.rig[index].name}={level}"
+                                                   for index, level in zip(spec.lights, light_pwms)))
+        pwm_of = dict(zip(spec.lights, light_pwms))
+
+        status = 'complete'
+        if spec.dark_frames:
+            if darks is None:
+                darks = DarkLibrary(os.path.join(os.path.dirname(session_dir), "darks"))
+            for dark_exposure in spec.exposures:
+                if str(dark_exposure) in journal.darks:
+                    continue
+                path = self.ensure_master_dark(darks, dark_exposure, spec.dark_frames)
+                if path is None:
+                    status = 'failed'
+                    break
+                journal.record_dark(dark_exposure, os.path.abspath(path))
+        # Darks stay full frame so every ROI can share them; processing crops them
+        saved_format = None
+        roi = journal.roi
+        if status == 'complete' and spec.roi is not None:
+            box = self._session_roi(spec) if roi is None else (roi['x'], roi['y'], roi['width'], roi['height'])
+            if box is not None:
+                saved_format = self.camera_format()
+                if roi is None:
+                    roi = self.set_roi(box)
+                    journal.record_roi(roi)
+                else:
+                    self.set_roi(box)
+        exposure = None
+        for image_type, frame_exposure, repeat in (spec.sequences() if status == 'complete' else ()):
+            done = journal.done(image_type, frame_exposure, repeat)
+            remaining = [index for index in spec.lights if index not in done]
+            if not remaining:
+                continue
+            if frame_exposure != exposure:
+                exposure = frame_exposure
+                self.set_exposure(exposure)
+                if spec.ambient == 'sequence' and not self.start_ambient_sequence(spec.frames_per_light):
+                    status = 'failed'
+                    break
+            base_name = f"{spec.object_id}_{image_type}_exp{exposure:g}s_r{repeat}"
+
+            def saved(index, filename, image_type=image_type, repeat=repeat):
+                frame = {
+                    'path': os.path.basename(filename),
+                    'image_type': image_type,
+                    'light': self.rig[index].name,
+                    'light_index': index,
+                    'exposure': exposure,
+                    'repeat': repeat,
+                    'frames_averaged': spec.frames_per_light,
+                    'ambient': spec.ambient,
+                    'pwm': pwm_of[index],
+                }
+                if spec.save_variance and spec.frames_per_light > 1:
+                    root_name, ext = os.path.splitext(frame['path'])
+                    frame['variance_path'] = f"{root_name}_var{ext}"
+                if filename in self.qc_results:
+                    frame['qc'] = self.qc_results[filename]
+                journal.record_frame(frame)
+
+            retries = 0
+            while True:
+                filenames = self.capture_sequence(remaining, base_name, session_dir,
+                                                  spec.frames_per_light, spec.save_variance,
+                                                  spec.ambient,
+                                                  [pwm_of[index] for index in remaining]
+                                                  if spec.balance_lights else None,
+                                                  on_frame=saved)
+                remaining = remaining[len(filenames):]
+                if not remaining:
+                    break
+                self.resync()
+                if retries == self.serial_retries:
+                    break
+                retries += 1
+                print(f"Retrying from light {self.rig[remaining[0]].name} after a serial resync "
+                      f"({retries}/{self.serial_retries})")
+            if remaining:
+                status = 'failed'
+                break
+
+        self.set_exposure(self.ORIGINAL_EXPOSURE)
+        if saved_format is not None:
+            self.set_camera_format(**saved_format)
+        extra = {}
+        if journal.darks:
+            extra['darks'] = dict(journal.darks)
+        if roi is not None:
+            extra['roi'] = roi
+        if calibration is not None:
+            extra['intensity'] = calibration.to_dict()
+        if self.pipeline_stats is not None and self.pipeline_stats.frames:
+            print(f"Pipelined capture: {self.pipeline_stats.format()}")
+            extra['pipeline'] = self.pipeline_stats.summary()
+        self.qc = None
+        frames = journal.frames
+        write_manifest(session_dir, spec, frames, status, journal.started_at, extra)
+        print(f"Session {spec.object_id} {status}: {len(frames)}/{spec.frame_count()} frames")
+        return status == 'complete'
+
+    def resync(self):
+        """
+        Bring the Arduino back to idle after a timeout or an 'E': end whatever
+        it may be waiting in ('X' aborts a 'G' sequence, 'B' ends an 'L'
+        capture), drop stale replies, turn every light off with 'C' and restore
+        the PWM level. The light sequence is uploaded again on next use.
+        """
+        with instrument.span('serial.resync'):
+            self.arduino.write(b'XB')
+            self.arduino.flush()
+            time.sleep(0.2)
+            self.arduino.reset_input_buffer()
+            self.arduino.write(b'C')
+            if self.pwm != 200:
+                self.arduino.write(b'P' + bytes([self.pwm]))
+            self.arduino.flush()
+        self._uploaded_sequence = None
+
+    def cleanup(self):
+        """
+        Clean up camera and serial resources. Devices borrowed from a
+        DeviceManager stay open in its pool.
+        """
+        if getattr(self, 'devices', None) is not None:
+            return
+        if hasattr(self, 'camera') and self.camera:
+            self.camera.DeInit()
+        if hasattr(self, 'cam_list'):
+            self.cam_list.Clear()
+        if hasattr(self, 'system'):
+            self.system.ReleaseInstance()
+        if hasattr(self, 'arduino'):
+            self.arduino.close()
+
+    def run(self):
+        """
+        Main loop for camera capture.
+        """
+        self.arduino.write('C'.encode())
+        self.arduino.flush()
+        print("Connect system to power now.\n")
+        done = False
+        try:
+            while not done:
+                print("Enter a command (H for help):")
+                command = input(">> ").strip().upper()
+                if command == 'F':
+                    self.arduino.write(command.encode())
+                    self.arduino.flush()
+                    finish, captured = self.serial_com(mode='F')
+                    done = finish or (CameraController.image_again() if captured else False)
+                elif command == 'U':
+                    self.arduino.write(command.encode())
+                    self.arduino.flush()
+                    print("Choose the light to turn on, N, S, E, or W:")
+                    light = input(">> ").strip().upper()
+                    if light in ['N', 'S', 'E', 'W']:
+                        finish, captured = self.serial_com(mode='U', light=light)
+                        done = finish or (CameraController.image_again() if captured else False)
+                    else:
+                        print("Incorrect entry, retry.")
+                elif command == 'P':
+                    try:
+                        pwm_value = int(input("Enter PWM value (0-255): "))
+                        self.set_pwm(pwm_value)
+                    except ValueError:
+                        print("Error: Invalid PWM value")
+                elif command == 'R':
+                    self.arduino.write('R'.encode())
+                    self.arduino.flush()
+                    print("Arduino reset")
+                elif command == 'H':
+                    self.show_help()
+                elif command == 'Q':
+                    done = True
+                else:
+                    print("Incorrect entry, retry.")
+        except KeyboardInterrupt:
+            print("\nExiting...")
+        finally:
+            self.cleanup()
+
+def confirm_power_unplugged():
+    """
+    Block until the operator confirms the power supply is unplugged.
+    """
+    while True:
+        print("Is power supply unplugged? [Y/n]")
+        a = input(">> ").strip().lower()
+        if a in ['y', 'n']:
+            if a == 'y':
+                break
+            print("Unplug power supply.")
+        else:
+            print("Invalid entry. Please enter 'Y' or 'n'.")
+
+def main():
+    confirm_power_unplugged()
+
+    # Welcome message
+    print("\nWelcome to the Camera and Light Control System!")
+    print("This program controls a camera and four lights (N, S, E, W) via an Arduino.")
+    print("Use the commands below to capture images, adjust light brightness, or reset the system.\n")
+
+    # Show help message
+    controller = CameraController()
+    controller.show_help()
+    controller.run()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
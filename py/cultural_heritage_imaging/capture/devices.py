@@ -0,0 +1,253 @@
+"""
+Device Discovery and Pooling
+
+Finds the rig hardware instead of relying on a hard-coded COM port, and keeps
+it open between sessions of a long-running process:
+
+    Arduino  every serial port is opened in parallel and sent 'H'; the one
+             running main.ino answers "CHI" and its channel count. The
+             handshake is repeated every PING_INTERVAL until it answers, so
+             a board that resets when its port opens is found as soon as
+             its bootloader hands over, not after a fixed sleep.
+    Camera   chosen by serial number from the Spinnaker camera list (or the
+             first camera without one).
+
+A DeviceManager owns one Spinnaker System instance and one open handle per
+device. CameraController(devices=...) borrows them, so a second session in
+the same process skips the serial handshake, the camera enumeration and
+camera.Init(). Pooled serial links are checked with a handshake before reuse
+and rediscovered if the board went away.
+"""
+
+import concurrent.futures
+import threading
+import time
+
+from cultural_heritage_imaging import instrument
+from cultural_heritage_imaging._optional import lazy_import
+
+PySpin = lazy_import('PySpin', "the Spinnaker Python SDK (spinnaker_python)")
+serial = lazy_import('serial', "pyserial")
+list_ports = lazy_import('serial.tools.list_ports', "pyserial")
+
+HANDSHAKE = b'H'
+IDENTITY = b'CHI'
+# Seconds to keep trying a port (covers the bootloader after a reset), and between tries
+HANDSHAKE_TIMEOUT = 3.0
+PING_INTERVAL = 0.25
+
+
+def candidate_ports():
+    """
+    Device names of the serial ports present on this machine.
+    """
+    return [port.device for port in list_ports.comports()]
+
+
+def _open_serial(port, baud_rate):
+    connection = serial.Serial()
+    connection.port = port
+    connection.baudrate = baud_rate
+    connection.timeout = 0.05
+    # Keep DTR low from the start so boards that honour it do not reset
+    connection.dtr = False
+    connection.open()
+    return connection
+
+
+def ping(connection, timeout=HANDSHAKE_TIMEOUT, cancel=None):
+    """
+    Send the handshake until the firmware answers, timeout seconds pass or
+    the cancel event is set. Returns the firmware's channel count, or None.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and not (cancel is not None and cancel.is_set()):
+        connection.reset_input_buffer()
+        connection.write(HANDSHAKE)
+        connection.flush()
+        reply = b''
+        wait_until = min(time.monotonic() + PING_INTERVAL, deadline)
+        while len(reply) < len(IDENTITY) + 1 and time.monotonic() < wait_until:
+            reply += connection.read(len(IDENTITY) + 1 - len(reply))
+        if reply[:len(IDENTITY)] == IDENTITY and len(reply) == len(IDENTITY) + 1:
+            return reply[-1]
+    return None
+
+
+def handshake(port, baud_rate=9600, timeout=HANDSHAKE_TIMEOUT, open_port=None, cancel=None):
+    """
+    Open port and check that main.ino is on the other end. Returns the open
+    connection and the firmware's channel count, or (None, None). Setting
+    the cancel event gives up early.
+    """
+    open_port = _open_serial if open_port is None else open_port
+    try:
+        connection = open_port(port, baud_rate)
+    except (OSError, serial.SerialException):
+        return None, None
+    try:
+        channels = ping(connection, timeout, cancel)
+    except (OSError, serial.SerialException):
+        channels = None
+    if channels is None:
+        connection.close()
+        return None, None
+    connection.timeout = 1
+    return connection, channels
+
+
+def find_arduino(ports=None, baud_rate=9600, timeout=HANDSHAKE_TIMEOUT, open_port=None):
+    """
+    Handshake with every port (default: all present) at once. Returns
+    (port, connection, channels) for the first one running main.ino, as soon
+    as it answers; the other ports are closed. Raises ValueError if none does.
+    """
+    ports = candidate_ports() if ports is None else list(ports)
+    if not ports:
+        raise ValueError("No serial ports found; is the Arduino plugged in?")
+    with instrument.span('serial.discover', ports=len(ports)):
+        found = None
+        answered = threading.Event()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(ports)) as pool:
+            futures = {pool.submit(handshake, port, baud_rate, timeout, open_port, answered): port
+                       for port in ports}
+            for future in concurrent.futures.as_completed(futures):
+                connection, channels = future.result()
+                if connection is None:
+                    continue
+                if found is None:
+                    found = (futures[future], connection, channels)
+                    # The ports still handshaking give up at their next try
+                    answered.set()
+                else:
+                    connection.close()
+    if found is None:
+        raise ValueError(f"No Arduino answered the handshake on {', '.join(ports)}")
+    return found
+
+
+def camera_serial(camera):
+    """
+    Serial number of a Spinnaker camera, read without initializing it.
+    """
+    return str(camera.TLDevice.DeviceSerialNumber.GetValue())
+
+
+def select_camera(cam_list, serial_number=None):
+    """
+    The camera with serial_number from a Spinnaker camera list, or the first
+    one. Raises ValueError if there is no such camera.
+    """
+    cameras = [cam_list.GetByIndex(index) for index in range(cam_list.GetSize())]
+    if not cameras:
+        raise ValueError("No cameras detected")
+    if serial_number is None:
+        return cameras[0]
+    for camera in cameras:
+        if camera_serial(camera) == str(serial_number):
+            return camera
+    found = ', '.join(camera_serial(camera) for camera in cameras)
+    raise ValueError(f"No camera with serial number {serial_number}; found {found}")
+
+
+class DeviceManager:
+    def __init__(self, spin=None, baud_rate=9600, timeout=HANDSHAKE_TIMEOUT, open_port=None,
+                 list_ports=None):
+        """
+        Pool of open rig devices. spin is a PySpin-compatible module, and
+        open_port(port, baud_rate) and list_ports() stand in for pyserial, so
+        the simulated rig (see capture.simulated) can be pooled as well.
+        """
+        self.spin = PySpin if spin is None else spin
+        self.baud_rate = baud_rate
+        self.timeout = timeout
+        self._open_port = open_port
+        self._list_ports = candidate_ports if list_ports is None else list_ports
+        self._lock = threading.Lock()
+        self._system = None
+        self._cam_list = None
+        self._arduinos = {}
+        self._cameras = {}
+
+    def arduino(self, port=None):
+        """
+        Open serial link to the Arduino on port, or on whichever port answers
+        the handshake. A pooled link is reused if it still answers.
+        """
+        with self._lock:
+            pooled = [port] if port is not None else list(self._arduinos)
+            for name in pooled:
+                connection = self._arduinos.get(name)
+                if connection is None:
+                    continue
+                if connection.is_open and ping(connection, PING_INTERVAL) is not None:
+                    return connection
+                connection.close()
+                del self._arduinos[name]
+            ports = [port] if port is not None else self._list_ports()
+            name, connection, channels = find_arduino(ports, self.baud_rate, self.timeout,
+                                                      self._open_port)
+            print(f"Arduino found on {name} ({channels} channels)")
+            self._arduinos[name] = connection
+            return connection
+
+    def camera(self, serial_number=None):
+        """
+        Camera handle by serial number (default: the first camera). Pooled
+        handles stay initialized between sessions.
+        """
+        with self._lock:
+            key = None if serial_number is None else str(serial_number)
+            if key in self._cameras:
+                return self._cameras[key]
+            if key is None and self._cameras:
+                return next(iter(self._cameras.values()))
+            with instrument.span('camera.discover'):
+                if self._system is None:
+                    self._system = self.spin.System.GetInstance()
+                if self._cam_list is not None:
+                    self._cam_list.Clear()
+                self._cam_list = self._system.GetCameras()
+                camera = select_camera(self._cam_list, key)
+            self._cameras[key] = camera
+            if key is None:
+                # Also reachable by its serial number
+                self._cameras[camera_serial(camera)] = camera
+            return camera
+
+    def cameras(self):
+        """
+        Serial numbers of the cameras the SDK sees.
+        """
+        with self._lock:
+            if self._system is None:
+                self._system = self.spin.System.GetInstance()
+            cam_list = self._system.GetCameras()
+            serials = [camera_serial(cam_list.GetByIndex(index)) for index in range(cam_list.GetSize())]
+            cam_list.Clear()
+            return serials
+
+    def close(self):
+        """
+        Release every pooled device and the Spinnaker System instance.
+        """
+        with self._lock:
+            for camera in set(self._cameras.values()):
+                if camera.IsInitialized():
+                    camera.DeInit()
+            self._cameras.clear()
+            if self._cam_list is not None:
+                self._cam_list.Clear()
+                self._cam_list = None
+            if self._system is not None:
+                self._system.ReleaseInstance()
+                self._system = None
+            for connection in self._arduinos.values():
+                connection.close()
+            self._arduinos.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
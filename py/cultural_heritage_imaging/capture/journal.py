@@ -0,0 +1,125 @@
+"""
+Session Journal
+
+An append-only record of a capture session, written next to its frames as
+journal.jsonl: one JSON object per line, flushed to disk as each frame is
+saved. The manifest is only written when a session ends, so after a crash,
+a power cut or Ctrl+C the journal is what says which lights were done.
+
+    {"event": "start", "spec": {...}, "started_at": "..."}
+    {"event": "dark", "exposure": "0.7", "path": "..."}
+    {"event": "roi", "roi": {...manifest ROI record...}}
+    {"event": "frame", "frame": {...manifest frame entry...}}
+    {"event": "resume", "at": "..."}
+
+Resuming a session replays the journal, keeps the frames whose files are
+still on disk, and captures only the rest.
+"""
+
+import json
+import os
+import time
+
+JOURNAL_NAME = "journal.jsonl"
+
+
+class JournalError(ValueError):
+    """
+    The journal on disk cannot be resumed: it was written for other session
+    settings or is damaged.
+    """
+
+
+def _comparable(spec_dict):
+    # The output directory may be given differently on resume; the session
+    # directory already pins it down
+    return {key: value for key, value in spec_dict.items() if key != 'output_dir'}
+
+
+class SessionJournal:
+    def __init__(self, session_dir):
+        self.session_dir = session_dir
+        self.path = os.path.join(session_dir, JOURNAL_NAME)
+        self.started_at = None
+        self.frames = []
+        self.darks = {}
+        self.roi = None
+
+    @classmethod
+    def open(cls, session_dir, spec, resume=False):
+        """
+        Start a new journal for spec, or with resume replay the existing one.
+        Raises JournalError if the journal was written for a different spec.
+        """
+        journal = cls(session_dir)
+        os.makedirs(session_dir, exist_ok=True)
+        if resume and os.path.exists(journal.path):
+            journal._replay(spec)
+            journal._append({'event': 'resume', 'at': time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())})
+            print(f"Resuming {spec.object_id}: {len(journal.frames)}/{spec.frame_count()} frames "
+                  f"already captured")
+        else:
+            journal.started_at = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
+            with open(journal.path, 'w'):
+                pass
+            journal._append({'event': 'start', 'spec': spec.to_dict(), 'started_at': journal.started_at})
+        return journal
+
+    def _replay(self, spec):
+        with open(self.path, 'r') as f:
+            lines = f.readlines()
+        for number, line in enumerate(lines, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash can only be the last one
+                if number == len(lines):
+                    break
+                raise JournalError(f"{self.path} line {number} is corrupt") from None
+            event = record.get('event')
+            if event == 'start':
+                if _comparable(record['spec']) != _comparable(spec.to_dict()):
+                    raise JournalError(f"{self.path} was written for different session settings; "
+                                     f"capture without resuming to start over")
+                self.started_at = record['started_at']
+            elif event == 'dark':
+                self.darks[record['exposure']] = record['path']
+            elif event == 'roi':
+                self.roi = record['roi']
+            elif event == 'frame':
+                frame = record['frame']
+                if os.path.exists(os.path.join(self.session_dir, frame['path'])):
+                    self.frames.append(frame)
+        if self.started_at is None:
+            raise JournalError(f"{self.path} has no start record")
+        if lines and not lines[-1].endswith('\n'):
+            # Terminate the partial line so the next record starts cleanly
+            with open(self.path, 'a') as f:
+                f.write('\n')
+
+    def _append(self, record):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record_dark(self, exposure, path):
+        self.darks[str(exposure)] = path
+        self._append({'event': 'dark', 'exposure': str(exposure), 'path': path})
+
+    def record_roi(self, roi):
+        # A resumed session must read out the same region as its first frames
+        self.roi = roi
+        self._append({'event': 'roi', 'roi': roi})
+
+    def record_frame(self, frame):
+        self.frames.append(frame)
+        self._append({'event': 'frame', 'frame': frame})
+
+    def done(self, image_type, exposure, repeat):
+        """
+        Light indices already captured for one sequence.
+        """
+        return {frame['light_index'] for frame in self.frames
+                if frame['image_type'] == image_type and frame['exposure'] == exposure
+                and frame['repeat'] == repeat}
@@ -0,0 +1,228 @@
+"""
+Pipelined Capture
+
+Runs a light sequence as three overlapping stages instead of one after
+the other:
+
+    switch   the Arduino moves to the next light and replies 'A'
+    acquire  the frame is exposed and read out, converted and checked by QC
+             (retakes happen here, while the light is still on)
+    write    ambient subtraction, the TIFF write and journalling
+
+The light of step i must stay on while frame i is exposed, so switching
+to light i+1 starts as soon as frame i is read out: 'B' is sent before the
+frame is written. Writing frame i then runs on a worker thread while the
+Arduino switches and frame i+1 is exposed, so a sequence costs about
+max(switch + acquire, write) per frame instead of their sum. An asyncio
+event loop drives the schedule; the blocking serial, camera and disk calls
+run on threads through asyncio.to_thread, and a bounded queue of depth
+frames between acquire and write caps the memory held by frames waiting
+to be written.
+
+Frames are written, and reported through on_frame, strictly in order. If
+a write fails, the frames after it are dropped and the sequence is
+aborted, so the filenames returned are always a prefix of the lights as
+run_session expects.
+
+PipelineStats accumulates the busy time of each stage over a session; its
+summary gives the frames per second achieved and each stage's utilization
+(busy time over wall time). A stage near 1.0 is the bottleneck.
+"""
+
+import asyncio
+import os
+import time
+
+import numpy as np
+
+from cultural_heritage_imaging import instrument
+from cultural_heritage_imaging._optional import lazy_import
+from cultural_heritage_imaging.capture.ambient import subtract_ambient
+
+tifffile = lazy_import('tifffile')
+
+STAGES = ('switch', 'acquire', 'write')
+# Frames read out but not yet written, at most
+DEPTH = 2
+
+
+class PipelineStats:
+    def __init__(self):
+        self.frames = 0
+        self.elapsed = 0.0
+        self.busy = dict.fromkeys(STAGES, 0.0)
+
+    def add(self, stage, seconds):
+        self.busy[stage] += seconds
+
+    def summary(self):
+        """
+        Frames, wall time, frames per second and per-stage busy seconds and
+        utilization, for the manifest.
+        """
+        elapsed = max(self.elapsed, 1e-9)
+        return {
+            'frames': self.frames,
+            'elapsed_s': round(self.elapsed, 4),
+            'fps': round(self.frames / elapsed, 3),
+            'stages': {stage: {'busy_s': round(busy, 4), 'utilization': round(busy / elapsed, 3)}
+                       for stage, busy in self.busy.items()},
+        }
+
+    def format(self):
+        summary = self.summary()
+        stages = ", ".join(f"{stage} {values['utilization']:.0%}"
+                           for stage, values in summary['stages'].items())
+        return (f"{summary['frames']} frames in {summary['elapsed_s']:.2f} s "
+                f"({summary['fps']:.2f} fps); stage utilization: {stages}")
+
+
+class _Timed:
+    # Adds the enclosed block's duration to one stage of a PipelineStats
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.stats.add(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def acquire_checked(controller, light, base_name, images_dir, frames=1, save_variance=False):
+    """
+    Grab a frame (the mean of frames frames) with the light on, retaking it
+    while controller.qc fails it (up to controller.retakes times). Returns
+    (filename, frame, variance) with arrays the caller owns, or None on
+    failure; the QC metrics are recorded under the filename.
+    """
+    attempt = 0
+    while True:
+        controller.last_qc = None
+        if frames > 1:
+            averager = controller.grab_average(frames, save_variance, light)
+            if averager is None:
+                return None
+            frame = averager.mean.copy()
+            variance = averager.variance().copy() if save_variance else None
+        else:
+            grabbed = controller.grab_frame(light)
+            if grabbed is None:
+                return None
+            frame = grabbed.copy()
+            variance = None
+        controller._measure(frame, light)
+        metrics = controller.last_qc
+        if metrics is None:
+            break
+        metrics['retakes'] = attempt
+        if metrics['passed'] or attempt >= controller.retakes:
+            break
+        attempt += 1
+        print(f"QC failed for light {light} ({', '.join(metrics['failures'])}), "
+              f"retake {attempt} of {controller.retakes}")
+    filename = controller.format_filename(base_name, light, images_dir)
+    if metrics is not None:
+        if not metrics['passed']:
+            print(f"Warning: keeping frame for light {light} that failed QC: "
+                  f"{', '.join(metrics['failures'])}")
+        controller.qc_results[filename] = metrics
+    return filename, frame, variance
+
+
+def write_frame(filename, frame, variance=None, ambient=None):
+    """
+    Save a frame (minus the ambient reference, if given) and its variance.
+    """
+    if ambient is not None:
+        frame = subtract_ambient(frame, ambient, np.empty_like(frame))
+    tifffile.imwrite(filename, frame)
+    if variance is not None:
+        root, ext = os.path.splitext(filename)
+        tifffile.imwrite(f"{root}_var{ext}", variance)
+
+
+async def _writer(queue, ambient, on_frame, stats, written, failed):
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        if failed:
+            # Keep the written frames a prefix of the sequence
+            continue
+        index, light, filename, frame, variance = item
+        start = time.perf_counter()
+        try:
+            with instrument.span('capture.save', light=light):
+                await asyncio.to_thread(write_frame, filename, frame, variance, ambient)
+        except Exception as ex:
+            print(f"Failed to save image at {filename}: {ex}")
+            failed.append(filename)
+            continue
+        finally:
+            stats.add('write', time.perf_counter() - start)
+        print(f"Image saved successfully at {filename}")
+        written.append(filename)
+        stats.frames += 1
+        if on_frame is not None:
+            on_frame(index, filename)
+
+
+async def _run(controller, indices, base_name, images_dir, frames, save_variance, ambient, on_frame,
+               stats, depth):
+    queue = asyncio.Queue(maxsize=depth)
+    written = []
+    failed = []
+    writer = asyncio.create_task(_writer(queue, ambient, on_frame, stats, written, failed))
+    arduino = controller.arduino
+    finished = False
+    try:
+        arduino.write(b'G')
+        arduino.flush()
+        for index in indices:
+            light = controller.rig[index].name
+            with _Timed(stats, 'switch'):
+                reply = await asyncio.to_thread(controller.wait_for, (b'A',), light)
+            if reply is None:
+                return written
+            if failed:
+                break
+            with _Timed(stats, 'acquire'), instrument.span('capture.light', light=light):
+                acquired = await asyncio.to_thread(acquire_checked, controller, light, base_name,
+                                                   images_dir, frames, save_variance)
+            if acquired is None:
+                break
+            # The next light switches on while this frame waits for the writer
+            arduino.write(b'B')
+            arduino.flush()
+            await queue.put((index, light) + acquired)
+        else:
+            finished = True
+        if not finished:
+            # Abort the rest of the sequence; the Arduino turns the light off and sends 'D'
+            arduino.write(b'X')
+            arduino.flush()
+        await asyncio.to_thread(controller.wait_for, (b'D',), 'sequence')
+        return written
+    finally:
+        await queue.put(None)
+        await writer
+
+
+def run_sequence(controller, indices, base_name, images_dir, frames=1, save_variance=False,
+                 ambient=None, on_frame=None, stats=None, depth=DEPTH):
+    """
+    Run an uploaded light sequence on controller with the stages overlapped.
+    ambient is the lights-off reference to subtract, if any. Returns the saved
+    filenames in light order, stopping at the first failure; stage times are
+    added to stats (a PipelineStats) if given.
+    """
+    stats = PipelineStats() if stats is None else stats
+    start = time.perf_counter()
+    try:
+        return asyncio.run(_run(controller, indices, base_name, images_dir, frames, save_variance,
+                                ambient, on_frame, stats, depth))
+    finally:
+        stats.elapsed += time.perf_counter() - start
@@ -0,0 +1,259 @@
+"""
+Live Preview
+
+Continuous acquisition for framing and focusing the object. The camera is
+switched to a cheap readout (on-camera binning or decimation, optionally an
+ROI) for the preview and put back to the exact geometry and exposure it had
+afterwards, so the capture that follows runs at full resolution.
+
+Frames are published as 8-bit images through a PreviewBuffer, a small
+memory-mapped file holding the latest few frames, so a viewer in another
+process (viz.show_preview) never slows the acquisition loop down: the
+writer overwrites slots in turn, and the reader copies the newest complete
+one and checks its sequence number to discard a frame overwritten mid-copy.
+Each frame carries the metrics drawn over it:
+
+    focus      sharpness of the frame (see capture.qc), and its ratio to the
+               best seen so far, to turn the lens towards
+    mean       mean level as a fraction of full scale
+    saturated  fraction of pixels at full scale
+    fps        frames per second of the acquisition loop
+"""
+
+import mmap
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from cultural_heritage_imaging import instrument, pixels
+from cultural_heritage_imaging.capture.qc import decimate, sharpness
+
+MAGIC = b'CHIP'
+HEADER = np.dtype([('magic', 'S4'), ('slots', '<u4'), ('height', '<u4'), ('width', '<u4'),
+                   ('latest', '<u8'), ('stop', 'u1'), ('closed', 'u1')])
+SLOT = np.dtype([('sequence', '<u8'), ('height', '<u4'), ('width', '<u4'), ('focus', '<f4'),
+                 ('best_focus', '<f4'), ('mean', '<f4'), ('saturated', '<f4'), ('fps', '<f4')])
+# Bytes reserved for the header and for each slot's record
+HEADER_SIZE = 64
+SLOT_SIZE = 64
+
+
+def default_path():
+    """
+    Buffer file in shared memory where the OS has it (/dev/shm), else in the
+    temporary directory.
+    """
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"chi-preview-{os.getpid()}")
+
+
+class PreviewBuffer:
+    def __init__(self, path, create=False, max_width=1280, max_height=1024, slots=3):
+        """
+        Create a buffer file at path for frames up to max_width x max_height,
+        or open an existing one (create=False) to read from it.
+        """
+        self.path = path
+        self.owner = create
+        if create:
+            size = HEADER_SIZE + slots * (SLOT_SIZE + max_width * max_height)
+            with open(path, 'wb') as f:
+                f.truncate(size)
+        with open(path, 'r+b') as f:
+            self._map = mmap.mmap(f.fileno(), 0)
+        self.header = np.ndarray((), HEADER, buffer=self._map)
+        if create:
+            self.header['magic'] = MAGIC
+            self.header['slots'] = slots
+            self.header['height'] = max_height
+            self.header['width'] = max_width
+        elif bytes(self.header['magic']) != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a preview buffer")
+        self.slots = int(self.header['slots'])
+        self.max_height = int(self.header['height'])
+        self.max_width = int(self.header['width'])
+        frame_bytes = self.max_width * self.max_height
+        self._records = []
+        self._pixels = []
+        for slot in range(self.slots):
+            offset = HEADER_SIZE + slot * (SLOT_SIZE + frame_bytes)
+            self._records.append(np.ndarray((), SLOT, buffer=self._map, offset=offset))
+            self._pixels.append(np.ndarray(frame_bytes, np.uint8, buffer=self._map, offset=offset + SLOT_SIZE))
+        self._last_read = 0
+
+    def publish(self, frame, **metrics):
+        """
+        Write an 8-bit frame (strided down to fit if it is larger than the
+        buffer) and its metrics into the next slot.
+        """
+        step = max(-(-frame.shape[0] // self.max_height), -(-frame.shape[1] // self.max_width), 1)
+        if step > 1:
+            frame = frame[::step, ::step]
+        height, width = frame.shape
+        sequence = int(self.header['latest']) + 1
+        record = self._records[sequence % self.slots]
+        # Zero marks the slot as being written until the frame is complete
+        record['sequence'] = 0
+        self._pixels[sequence % self.slots][:height * width].reshape(height, width)[...] = frame
+        record['height'] = height
+        record['width'] = width
+        for name, value in metrics.items():
+            record[name] = value
+        record['sequence'] = sequence
+        self.header['latest'] = sequence
+
+    def read(self):
+        """
+        Copy of the newest frame and its metrics as (frame, metrics), or
+        (None, None) if there is none since the last read.
+        """
+        for _ in range(self.slots):
+            sequence = int(self.header['latest'])
+            if sequence == self._last_read:
+                return None, None
+            record = self._records[sequence % self.slots]
+            height, width = int(record['height']), int(record['width'])
+            frame = self._pixels[sequence % self.slots][:height * width].reshape(height, width).copy()
+            metrics = {name: float(record[name]) for name in SLOT.names[3:]}
+            if int(record['sequence']) == sequence:
+                self._last_read = sequence
+                return frame, metrics
+        return None, None
+
+    def request_stop(self):
+        self.header['stop'] = 1
+
+    @property
+    def stop_requested(self):
+        return bool(self.header['stop'])
+
+    @property
+    def closed(self):
+        return bool(self.header['closed'])
+
+    def close(self):
+        """
+        Unmap the buffer; the creator also marks it closed for readers and
+        removes the file.
+        """
+        if self.owner:
+            self.header['closed'] = 1
+        self.header = None
+        self._records = self._pixels = None
+        self._map.close()
+        if self.owner:
+            try:
+                os.remove(self.path)
+            except OSError:
+                # Still mapped by a reader on Windows; it is a temporary file
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def to_display(frame, bits):
+    """
+    8-bit copy of a frame with bits significant bits, for display.
+    """
+    if frame.dtype == np.uint8:
+        return frame
+    return (frame >> max(bits - 8, 0)).astype(np.uint8)
+
+
+def stream(controller, buffer, binning=2, decimation=1, roi=None, exposure=None, light=None,
+           stop=None, frames=None, step=4):
+    """
+    Run continuous acquisition on controller's camera and publish every frame
+    to buffer until stop() returns True, the buffer's reader asks to stop, or
+    frames frames were sent. The camera is binned or decimated by the given
+    factors, cropped to roi (x, y, width, height in full-resolution pixels)
+    and set to exposure seconds for the preview only. light (a rig light
+    name or index) is kept on meanwhile. Metrics are measured on every
+    step-th pixel. Returns the number of frames published.
+    """
+    camera = controller.camera
+    saved_format = controller.camera_format()
+    saved_exposure = camera.ExposureTime.GetValue()
+    saved_mode = controller.acquisition_mode
+    preview_format = {}
+    for axis in ('Horizontal', 'Vertical'):
+        if binning > 1:
+            preview_format[f'Binning{axis}'] = binning
+        if decimation > 1:
+            preview_format[f'Decimation{axis}'] = decimation
+    if roi is not None:
+        scale = binning * decimation
+        x, y, width, height = roi
+        preview_format.update(OffsetX=x // scale, OffsetY=y // scale,
+                              Width=-(-width // scale), Height=-(-height // scale))
+    elif saved_format.get('Width') is not None:
+        # Whole sensor: let the size grow back to its limit
+        preview_format.update(OffsetX=0, OffsetY=0, Width=1 << 30, Height=1 << 30)
+
+    bits = pixels.bit_depth(controller.pixel_format)
+    full_scale = float(2 ** bits - 1)
+    unpack_buffer = None
+    published = 0
+    best_focus = 0.0
+    lit = False
+    try:
+        controller.set_camera_format(**preview_format)
+        if exposure is not None:
+            controller.set_exposure(exposure)
+        if light is not None:
+            light = controller.rig[controller.rig.index(light)]
+            controller.arduino.write(b'L' + bytes([light.channel]))
+            controller.arduino.flush()
+            lit = controller.wait_for((b'A',), light.name) is not None
+        controller.set_acquisition_mode('Continuous')
+        camera.BeginAcquisition()
+        try:
+            last = time.perf_counter()
+            fps = 0.0
+            while not (stop is not None and stop()) and not buffer.stop_requested \
+                    and (frames is None or published < frames):
+                with instrument.span('preview.grab'):
+                    image = camera.GetNextImage(1000)
+                try:
+                    if image.IsIncomplete():
+                        continue
+                    frame = pixels.frame_to_array(image, controller.pixel_format, unpack_buffer)
+                    if controller.pixel_format in pixels.PACKED_FORMATS:
+                        unpack_buffer = frame
+                    with instrument.span('preview.publish'):
+                        small = decimate(frame, step)
+                        focus = sharpness(small)
+                        best_focus = max(best_focus, focus)
+                        now = time.perf_counter()
+                        if published:
+                            rate = 1.0 / max(now - last, 1e-6)
+                            fps = rate if fps == 0 else 0.9 * fps + 0.1 * rate
+                        last = now
+                        buffer.publish(to_display(frame, bits), focus=focus, best_focus=best_focus,
+                                       mean=float(small.mean()) / full_scale,
+                                       saturated=float(np.count_nonzero(small >= full_scale)) / small.size,
+                                       fps=fps)
+                    published += 1
+                finally:
+                    image.Release()
+        finally:
+            camera.EndAcquisition()
+    except controller.spin.SpinnakerException as ex:
+        print(f"Spinnaker Exception: {ex}")
+    finally:
+        if lit:
+            controller.arduino.write(b'B')
+            controller.arduino.flush()
+            controller.wait_for((b'D',), light.name)
+        controller.set_camera_format(**saved_format)
+        camera.ExposureTime.SetValue(saved_exposure)
+        if saved_mode is not None:
+            controller.set_acquisition_mode(saved_mode)
+    return published
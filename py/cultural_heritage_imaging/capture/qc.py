@@ -0,0 +1,103 @@
+"""
+Per-Frame Quality Control
+
+Checks every frame on the capture thread, while its light is still on, so a
+bad frame is retaken before the sequence moves on instead of being found in
+processing. The metrics are computed with NumPy on a decimated view (every
+step-th pixel in each axis) so they cost a few milliseconds per frame:
+
+    saturated  -- fraction of pixels at the top of the pixel format's range
+    mean       -- mean level in linear [0, 1] units
+    sharpness  -- mean squared Laplacian over the squared mean level, relative
+                  to the first frame of the sequence (a blurred or moving
+                  frame drops well below 1)
+    drift      -- (dx, dy) shift in pixels from the first frame of the
+                  sequence, by phase correlation; only judged when the
+                  correlation peak ('match') shows enough shared texture,
+                  since on a smooth object the moving shading looks like drift
+
+The limits are session.QC_LIMITS unless the session spec overrides them.
+"""
+
+import numpy as np
+
+from cultural_heritage_imaging.processing.register import MIN_MATCH, phase_correlate
+from cultural_heritage_imaging.session import QC_LIMITS
+
+
+def decimate(frame, step):
+    """
+    Every step-th pixel of a frame in each axis, as float32.
+    """
+    return np.asarray(frame)[::step, ::step].astype(np.float32)
+
+
+def sharpness(small):
+    """
+    Mean squared 4-neighbour Laplacian of a frame over its squared mean, so
+    the measure does not change with the light level.
+    """
+    laplacian = (4 * small[1:-1, 1:-1] - small[:-2, 1:-1] - small[2:, 1:-1]
+                 - small[1:-1, :-2] - small[1:-1, 2:])
+    level = float(small.mean())
+    if level <= 0:
+        return 0.0
+    return float(np.mean(laplacian * laplacian)) / (level * level)
+
+
+class FrameQC:
+    def __init__(self, bits, limits=None, step=4):
+        """
+        Check frames with bits significant bits against limits (a dict
+        overriding QC_LIMITS), measuring on every step-th pixel.
+        """
+        self.full_scale = float(2 ** bits - 1)
+        self.limits = dict(QC_LIMITS)
+        self.limits.update(limits or {})
+        self.step = int(step)
+        self._reference = None
+        self._reference_sharpness = None
+
+    def start_sequence(self):
+        """
+        Forget the previous sequence's reference frame.
+        """
+        self._reference = None
+        self._reference_sharpness = None
+
+    def measure(self, frame):
+        """
+        Metrics of a raw frame (before ambient subtraction) as a JSON-ready
+        dict, with 'passed' and the list of failed checks. The first frame
+        that passes becomes the sequence's sharpness and drift reference.
+        """
+        small = decimate(frame, self.step)
+        metrics = {
+            'saturated': float(np.count_nonzero(small >= self.full_scale)) / small.size,
+            'mean': float(small.mean()) / self.full_scale,
+        }
+        focus = sharpness(small)
+        if self._reference is not None:
+            metrics['sharpness'] = focus / self._reference_sharpness if self._reference_sharpness else 1.0
+            dx, dy, peak = phase_correlate(self._reference, small)
+            metrics['drift'] = [dx * self.step, dy * self.step]
+            metrics['match'] = peak
+
+        limits = self.limits
+        failures = []
+        if metrics['saturated'] > limits['max_saturated']:
+            failures.append('saturated')
+        if metrics['mean'] < limits['min_mean']:
+            failures.append('dark')
+        if metrics['mean'] > limits['max_mean']:
+            failures.append('bright')
+        if metrics.get('sharpness', 1.0) < limits['min_sharpness']:
+            failures.append('blurred')
+        if metrics.get('match', 0.0) >= MIN_MATCH and np.hypot(*metrics['drift']) > limits['max_drift']:
+            failures.append('drift')
+        metrics['passed'] = not failures
+        metrics['failures'] = failures
+        if self._reference is None and not failures:
+            self._reference = small
+            self._reference_sharpness = focus
+        return metrics
@@ -0,0 +1,94 @@
+"""
+Region of Interest
+
+Bounding boxes for reading out only the part of the sensor the object
+covers. Readout time, USB bandwidth, disk use and processing all scale with
+the rows and columns read, so an object filling a third of the frame costs
+about a third as much per frame.
+
+The box comes from a mask image or from frames lit at the start of the
+session: the object is separated from the background by an Otsu threshold
+on a decimated copy, and its bounding box is grown by a margin so shadows
+and registration shifts stay inside. The camera rounds the box to its
+offset and size increments (see CameraController.set_camera_format); the
+box it actually reads out is recorded in the manifest as
+
+    "roi": {"x": ..., "y": ..., "width": ..., "height": ..., "sensor": [W, H]}
+
+so processing can crop full-frame darks and masks to it and keep near-field
+light positions relative to the sensor, not the crop.
+"""
+
+import numpy as np
+
+from cultural_heritage_imaging.capture.qc import decimate
+
+# Pixels added around the object on every side
+MARGIN = 32
+# A box covering more than this fraction of the frame is not worth the crop
+MAX_COVERAGE = 0.9
+
+
+def otsu_threshold(values, bins=256):
+    """
+    Level separating values into two classes with the largest between-class
+    variance.
+    """
+    counts, edges = np.histogram(values, bins=bins)
+    centers = (edges[:-1] + edges[1:]) / 2
+    weight = np.cumsum(counts).astype(np.float64)
+    total = weight[-1]
+    weighted = np.cumsum(counts * centers)
+    mean_low = weighted / np.maximum(weight, 1)
+    mean_high = (weighted[-1] - weighted) / np.maximum(total - weight, 1)
+    between = weight * (total - weight) * (mean_low - mean_high) ** 2
+    return float(centers[np.argmax(between)])
+
+
+def bounding_box(mask, margin=MARGIN):
+    """
+    (x, y, width, height) of the nonzero pixels of a mask grown by margin
+    pixels and clipped to the frame. Raises ValueError for an empty mask.
+    """
+    mask = np.asarray(mask) > 0
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if not len(rows):
+        raise ValueError("Mask is empty; cannot derive an ROI from it")
+    height, width = mask.shape
+    top, bottom = max(rows[0] - margin, 0), min(rows[-1] + 1 + margin, height)
+    left, right = max(cols[0] - margin, 0), min(cols[-1] + 1 + margin, width)
+    return int(left), int(top), int(right - left), int(bottom - top)
+
+
+def roi_from_frame(frame, margin=MARGIN, step=4):
+    """
+    Bounding box of the bright object in a lit frame, or None if it covers
+    nearly the whole frame. The object is found on every step-th pixel.
+    """
+    small = decimate(frame, step)
+    # Drop isolated bright pixels (hot pixels, specular glints on the stand)
+    foreground = small > otsu_threshold(small)
+    foreground[1:-1, 1:-1] &= (foreground[:-2, 1:-1] | foreground[2:, 1:-1]) \
+        & (foreground[1:-1, :-2] | foreground[1:-1, 2:])
+    x, y, width, height = bounding_box(foreground, 0)
+    height_full, width_full = np.asarray(frame).shape
+    left, top = max(x * step - margin, 0), max(y * step - margin, 0)
+    right = min((x + width) * step + margin, width_full)
+    bottom = min((y + height) * step + margin, height_full)
+    if (right - left) * (bottom - top) > MAX_COVERAGE * width_full * height_full:
+        return None
+    return left, top, right - left, bottom - top
+
+
+def roi_from_mask(path, margin=MARGIN):
+    """
+    Bounding box of a mask image's nonzero pixels.
+    """
+    from cultural_heritage_imaging.processing import io
+
+    mask = io.read_image(path)
+    if mask is None:
+        raise ValueError(f"ROI mask {path} cannot be read")
+    return bounding_box(mask, margin)
+
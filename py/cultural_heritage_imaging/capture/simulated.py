@@ -0,0 +1,499 @@
+"""
+Simulated Rig Backends
+
+Stand-ins for the Arduino serial port and the Spinnaker SDK, so the capture
+code can run without hardware for benchmarks and dry runs. SimulatedArduino
+speaks the main.ino serial protocol; SimulatedSpin mimics the parts of the
+PySpin module CameraController uses. Both share a SimulatedRig, so frames are
+rendered as a Lambertian sphere lit by whichever channel of its LightRig the
+Arduino has on. In a Bayer pixel format the sphere is painted, red on its
+left half and blue on its right, and frames are raw mosaics.
+
+    rig = SimulatedRig(width=640, height=480)
+    controller = CameraController(arduino=rig.arduino, spin=rig.spin)
+"""
+
+import time
+
+import numpy as np
+
+from cultural_heritage_imaging._optional import lazy_import
+from cultural_heritage_imaging.pixels import PIXEL_FORMATS, bayer_pattern, pack_mono12p
+from cultural_heritage_imaging.rig import LightRig
+
+tifffile = lazy_import('tifffile')
+
+# Legacy 'U' command letters, in firmware channel order (EN1..EN4)
+LIGHT_NAMES = ('N', 'E', 'S', 'W')
+
+# RGB reflectance of the left and right halves of the sphere in color
+PAINT = ((0.9, 0.45, 0.3), (0.35, 0.55, 0.95))
+
+
+class SimulatedSpinnakerException(Exception):
+    pass
+
+
+class SimulatedRig:
+    def __init__(self, width=640, height=480, serial_latency=0.0, readout_time=0.0,
+                 honor_exposure=False, noise=2.0, seed=0, ambient=0.02, rig=None, gains=None,
+                 serial_number='00000001'):
+        """
+        Shared state of a simulated light stand and camera.
+
+        serial_latency delays each Arduino reply, readout_time is added to every
+        full-sensor frame (less for an ROI), and honor_exposure makes frames take their exposure time as well.
+        ambient is the room light reaching the sensor with every light off, and
+        rig the LightRig whose channels the Arduino switches (default: N/E/S/W).
+        gains maps channels to a relative LED brightness (default: all 1.0).
+        serial_number is the camera's, as capture.devices reads it.
+        """
+        self.width = width
+        self.height = height
+        self.serial_latency = serial_latency
+        self.readout_time = readout_time
+        self.honor_exposure = honor_exposure
+        self.noise = noise
+        self.ambient = ambient
+        self.rng = np.random.default_rng(seed)
+        self.lit = None
+        self.pwm = 200
+        self.rig = LightRig.default() if rig is None else rig
+        # Light direction per output channel
+        self.light_dirs = {light.channel: light.direction for light in self.rig}
+        self.gains = dict(gains or {})
+        self.serial_number = serial_number
+        self._geometry = None
+        self._tint = None
+        self.arduino = SimulatedArduino(self)
+        self.spin = SimulatedSpin(self)
+
+    def render(self):
+        """
+        Render the current frame as float radiance in [0, 1].
+        """
+        if self._geometry is None or self._geometry[0].shape != (self.height, self.width):
+            y, x = np.mgrid[-1:1:self.height * 1j, -1:1:self.width * 1j]
+            scale = max(self.width, self.height) / min(self.width, self.height)
+            if self.width >= self.height:
+                x = x * scale
+            else:
+                y = y * scale
+            r2 = x * x + y * y
+            z = np.sqrt(np.clip(1.0 - r2, 0.0, None))
+            self._geometry = (x, y, z, r2)
+        x, y, z, r2 = self._geometry
+        frame = np.full((self.height, self.width), self.ambient)
+        if self.lit in self.light_dirs:
+            lx, ly, lz = self.light_dirs[self.lit]
+            shading = np.clip(x * lx - y * ly + z * lz, 0.0, None)
+            gain = self.gains.get(self.lit, 1.0)
+            frame += np.where(r2 < 1.0, 0.8 * shading, 0.1) * (gain * self.pwm / 255.0)
+        return frame
+
+    def bayer_tint(self, pattern):
+        """
+        (H, W) reflectance of each sensor pixel in the color of its filter,
+        for a Bayer pattern such as 'RGGB'; multiplies a render() frame. The
+        background is grey.
+        """
+        if self._tint is None or self._tint[0] != pattern or self._tint[1].shape != (self.height, self.width):
+            self.render()
+            x, _, _, r2 = self._geometry
+            colors = np.where((x < 0)[..., None], PAINT[0], PAINT[1])
+            colors[r2 >= 1.0] = 1.0
+            sites = np.array(['RGB'.index(color) for color in pattern]).reshape(2, 2)
+            channel = sites[np.arange(self.height)[:, None] % 2, np.arange(self.width)[None, :] % 2]
+            self._tint = (pattern, np.take_along_axis(colors, channel[..., None], axis=2)[..., 0])
+        return self._tint[1]
+
+
+class SimulatedArduino:
+    """
+    Serial-port stand-in running the main.ino command protocol.
+    """
+
+    def __init__(self, rig):
+        self.rig = rig
+        self.is_open = True
+        self.DTR = False
+        self.state = 'idle'
+        self.current = 0
+        self.pending = []
+        self.sequence = b''
+        self.sequence_pwm = None
+        self.expected = 0
+        self.base_pwm = 200
+
+    @property
+    def in_waiting(self):
+        now = time.perf_counter()
+        return sum(1 for due, _ in self.pending if due <= now)
+
+    def _reply(self, byte):
+        self.pending.append((time.perf_counter() + self.rig.serial_latency, byte))
+
+    def _handle(self, c):
+        rig = self.rig
+        if self.state == 'P':
+            rig.pwm = self.base_pwm = ord(c)
+            self.state = 'idle'
+        elif self.state == 'W':
+            self.expected = ord(c)
+            self.sequence_pwm = b''
+            self.state = 'W_data' if self.expected else 'idle'
+            if not self.expected:
+                self._reply(b'E')
+        elif self.state == 'W_data':
+            self.sequence_pwm += c.encode('latin-1')
+            if len(self.sequence_pwm) == self.expected:
+                valid = self.expected == len(self.sequence)
+                if not valid:
+                    self.sequence_pwm = None
+                self._reply(b'K' if valid else b'E')
+                self.state = 'idle'
+        elif self.state == 'L':
+            rig.lit = ord(c)
+            self._reply(b'A')
+            self.state = 'U_lit'
+        elif self.state == 'Q':
+            self.expected = ord(c)
+            self.sequence = b''
+            self.sequence_pwm = None
+            self.state = 'Q_data' if self.expected else 'idle'
+            if not self.expected:
+                self._reply(b'K')
+        elif self.state == 'Q_data':
+            self.sequence += c.encode('latin-1')
+            if len(self.sequence) == self.expected:
+                self._reply(b'K')
+                self.state = 'idle'
+        elif self.state == 'G':
+            if c in 'BX':
+                rig.lit = None
+                self.current += 1
+                if c == 'B' and self.current < len(self.sequence):
+                    self._light_step()
+                else:
+                    rig.pwm = self.base_pwm
+                    self._reply(b'D')
+                    self.state = 'idle'
+        elif self.state == 'F':
+            if c == 'B':
+                rig.lit = None
+                self.current += 1
+                if self.current < len(LIGHT_NAMES):
+                    rig.lit = self.current
+                    self._reply(b'A')
+                else:
+                    self._reply(b'D')
+                    self.state = 'idle'
+        elif self.state == 'U':
+            if c in LIGHT_NAMES:
+                rig.lit = LIGHT_NAMES.index(c)
+                self._reply(b'A')
+                self.state = 'U_lit'
+        elif self.state == 'U_lit':
+            if c == 'B':
+                rig.lit = None
+                self._reply(b'D')
+                self.state = 'idle'
+        elif c == 'C':
+            rig.lit = None
+            rig.pwm = self.base_pwm = 200
+        elif c == 'H':
+            for byte in b'CHI' + bytes([len(rig.rig)]):
+                self._reply(bytes([byte]))
+        elif c == 'F':
+            self.current = 0
+            rig.lit = 0
+            self._reply(b'A')
+            self.state = 'F'
+        elif c == 'U':
+            self.state = 'U'
+        elif c == 'P':
+            self.state = 'P'
+        elif c == 'L':
+            self.state = 'L'
+        elif c == 'W':
+            self.state = 'W'
+        elif c == 'Q':
+            self.state = 'Q'
+        elif c == 'G':
+            self.current = 0
+            if self.sequence:
+                self._light_step()
+                self.state = 'G'
+            else:
+                self._reply(b'D')
+
+    def _light_step(self):
+        if self.sequence_pwm is not None:
+            self.rig.pwm = self.sequence_pwm[self.current]
+        self.rig.lit = self.sequence[self.current]
+        self._reply(b'A')
+
+    def write(self, data):
+        for value in bytes(data):
+            self._handle(chr(value))
+        return len(data)
+
+    def read(self, size=1):
+        if not self.pending:
+            return b''
+        due, byte = self.pending[0]
+        wait = due - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        self.pending.pop(0)
+        return byte
+
+    def flush(self):
+        pass
+
+    def flushInput(self):
+        self.pending.clear()
+
+    reset_input_buffer = flushInput
+
+    def close(self):
+        self.is_open = False
+
+
+class _Node:
+    def __init__(self, value=0, minimum=0.0, maximum=float('inf'), increment=1):
+        """
+        A GenICam node; maximum may be a function for limits that depend on
+        other nodes, as Width does on OffsetX and binning.
+        """
+        self.value = value
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increment = increment
+
+    def SetValue(self, value):
+        self.value = value
+
+    def GetValue(self):
+        return self.value
+
+    def SetIntValue(self, value):
+        self.value = value
+
+    def GetIntValue(self):
+        return self.value
+
+    def GetMin(self):
+        return self.minimum
+
+    def GetMax(self):
+        return self.maximum() if callable(self.maximum) else self.maximum
+
+    def GetInc(self):
+        return self.increment
+
+    def GetEntryByName(self, name):
+        return _Node(name)
+
+
+class SimulatedImage:
+    def __init__(self, array, incomplete=False, data=None):
+        """
+        A frame as the SDK returns it; data holds the raw buffer of packed formats.
+        """
+        self.array = array
+        self.incomplete = incomplete
+        self.data = data
+
+    def IsIncomplete(self):
+        return self.incomplete
+
+    def GetImageStatus(self):
+        return 1 if self.incomplete else 0
+
+    def GetWidth(self):
+        return self.array.shape[1]
+
+    def GetHeight(self):
+        return self.array.shape[0]
+
+    def Convert(self, pixel_format, algorithm=None):
+        return SimulatedImage(self.array.copy())
+
+    def GetNDArray(self):
+        return self.array
+
+    def GetData(self):
+        if self.data is not None:
+            return self.data
+        return self.array.reshape(-1).view(np.uint8)
+
+    def Save(self, filename):
+        tifffile.imwrite(filename, self.array)
+
+    def Release(self):
+        pass
+
+
+class _DeviceInfo:
+    def __init__(self, serial_number):
+        self.DeviceSerialNumber = _Node(serial_number)
+
+
+class SimulatedCamera:
+    def __init__(self, rig):
+        self.rig = rig
+        self.initialized = False
+        self.streaming = False
+        self.ExposureAuto = _Node()
+        self.ExposureTime = _Node(700000.0, 10.0, 30_000_000.0)
+        self.GainAuto = _Node()
+        self.Gain = _Node(0.0, 0.0, 48.0)
+        self.AutoExposureTargetGreyValueAuto = _Node()
+        self.AcquisitionMode = _Node('SingleFrame')
+        # Readout geometry: sizes and offsets count binned, decimated pixels
+        self.BinningHorizontal = _Node(1, 1, 4)
+        self.BinningVertical = _Node(1, 1, 4)
+        self.DecimationHorizontal = _Node(1, 1, 4)
+        self.DecimationVertical = _Node(1, 1, 4)
+        self.Width = _Node(rig.width, 16, lambda: self._sensor_width() - self.OffsetX.value, 4)
+        self.Height = _Node(rig.height, 16, lambda: self._sensor_height() - self.OffsetY.value, 2)
+        self.OffsetX = _Node(0, 0, lambda: self._sensor_width() - self.Width.value, 4)
+        self.OffsetY = _Node(0, 0, lambda: self._sensor_height() - self.Height.value, 2)
+        self.WidthMax = _Node(rig.width)
+        self.HeightMax = _Node(rig.height)
+        self.PixelFormat = _Node('Mono8')
+        self.TLDevice = _DeviceInfo(rig.serial_number)
+
+    def _sensor_width(self):
+        return self.rig.width // self.BinningHorizontal.value // self.DecimationHorizontal.value
+
+    def _sensor_height(self):
+        return self.rig.height // self.BinningVertical.value // self.DecimationVertical.value
+
+    def _read_out(self, frame):
+        """
+        Apply binning (2 x 2 means and so on), decimation and the ROI to a
+        full-sensor frame.
+        """
+        bin_x, bin_y = self.BinningHorizontal.value, self.BinningVertical.value
+        if bin_x > 1 or bin_y > 1:
+            height, width = frame.shape[0] // bin_y, frame.shape[1] // bin_x
+            frame = frame[:height * bin_y, :width * bin_x].reshape(height, bin_y, width, bin_x).mean(axis=(1, 3))
+        frame = frame[::self.DecimationVertical.value, ::self.DecimationHorizontal.value]
+        top, left = self.OffsetY.value, self.OffsetX.value
+        return frame[top:top + self.Height.value, left:left + self.Width.value]
+
+    def Init(self):
+        self.initialized = True
+
+    def DeInit(self):
+        self.initialized = False
+
+    def IsInitialized(self):
+        return self.initialized
+
+    def GetNodeMap(self):
+        return self
+
+    def GetNode(self, name):
+        node = getattr(self, name, None)
+        if not isinstance(node, _Node):
+            raise SimulatedSpinnakerException(f"Node {name} not available")
+        return node
+
+    def BeginAcquisition(self):
+        if not self.initialized:
+            raise SimulatedSpinnakerException("Camera not initialized")
+        self.streaming = True
+
+    def EndAcquisition(self):
+        self.streaming = False
+
+    def GetNextImage(self, timeout=None):
+        if not self.streaming:
+            raise SimulatedSpinnakerException("Camera is not streaming")
+        rig = self.rig
+        # Readout time scales with the sensor rows read, as on a rolling readout
+        rows = self.Height.value * self.BinningVertical.value * self.DecimationVertical.value
+        delay = rig.readout_time * rows / rig.height
+        if rig.honor_exposure:
+            delay += self.ExposureTime.GetValue() / 1_000_000
+        if delay > 0:
+            time.sleep(delay)
+        pixel_format = self.PixelFormat.GetValue()
+        top = 2 ** PIXEL_FORMATS[pixel_format] - 1
+        radiance = rig.render()
+        pattern = bayer_pattern(pixel_format)
+        if pattern is not None:
+            radiance = radiance * rig.bayer_tint(pattern)
+        frame = self._read_out(radiance) * top
+        if rig.noise:
+            frame += rig.rng.normal(0.0, rig.noise * top / 255.0, frame.shape)
+        frame = np.clip(frame, 0, top).astype(np.uint8 if top == 255 else np.uint16)
+        if pixel_format in ('Mono12p', 'BayerRG12p'):
+            return SimulatedImage(frame, data=pack_mono12p(frame))
+        return SimulatedImage(frame)
+
+
+class _CameraList:
+    def __init__(self, cameras):
+        self.cameras = list(cameras)
+
+    def GetSize(self):
+        return len(self.cameras)
+
+    def GetByIndex(self, index):
+        return self.cameras[index]
+
+    def Clear(self):
+        self.cameras = []
+
+
+class _System:
+    def __init__(self, rig):
+        self.camera = SimulatedCamera(rig)
+
+    def GetCameras(self):
+        return _CameraList([self.camera])
+
+    def ReleaseInstance(self):
+        pass
+
+
+class SimulatedSpin:
+    """
+    Module-like stand-in for PySpin, passed to CameraController as spin.
+    """
+
+    SpinnakerException = SimulatedSpinnakerException
+    PixelFormat_Mono8 = 'Mono8'
+    HQ_LINEAR = 'HQ_LINEAR'
+    ExposureAuto_Off = 'Off'
+    GainAuto_Off = 'Off'
+    AutoExposureTargetGreyValueAuto_Off = 'Off'
+    AcquisitionMode_SingleFrame = 'SingleFrame'
+    AcquisitionMode_Continuous = 'Continuous'
+
+    def __init__(self, rig):
+        self.rig = rig
+        self._system = _System(rig)
+        self.System = self
+
+    def GetInstance(self):
+        return self._system
+
+    @staticmethod
+    def CEnumerationPtr(node):
+        return node
+
+    CFloatPtr = CEnumerationPtr
+    CIntegerPtr = CEnumerationPtr
+    CBooleanPtr = CEnumerationPtr
+
+    @staticmethod
+    def IsAvailable(node):
+        return node is not None
+
+    IsReadable = IsAvailable
+    IsWritable = IsAvailable
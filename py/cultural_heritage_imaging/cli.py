@@ -0,0 +1,727 @@
+"""
+Command Line Interface
+
+Entry point for the ``chi`` console script. ``chi capture`` runs one or more
+session specs unattended on the rig, opening the camera and serial port once
+for the whole batch; ``chi interactive`` starts the original prompt-driven
+controller; ``chi preview`` streams a live view for framing and focusing;
+``chi devices`` lists the Arduino and cameras found;
+``chi calibrate-dark`` and ``chi calibrate-intensity`` capture calibration
+data; ``chi process`` runs photometric stereo on a folder of frames, and
+``chi batch`` processes captured sessions as they complete; ``chi serve``
+processes sessions sent over HTTP with ``chi submit`` from other machines.
+
+Subsystems are imported inside the command that needs them, so ``--help``
+and processing jobs never load the camera or serial SDKs.
+"""
+
+import argparse
+import os
+import sys
+
+from cultural_heritage_imaging.pixels import PIXEL_FORMATS
+from cultural_heritage_imaging.session import (AMBIENT_MODES, IMAGE_TYPES, MANIFEST_NAME,
+                                               SessionSpec, load_session_specs)
+
+
+def build_parser():
+    """
+    Build the argument parser for all subcommands.
+    """
+    parser = argparse.ArgumentParser(
+        prog="chi", description="Cultural heritage imaging capture and processing tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    capture = subparsers.add_parser(
+        'capture', help="Capture one or more sessions unattended",
+        description="Capture sessions from spec files, or a single session described by options.")
+    capture.add_argument('specs', nargs='*', help="Session spec JSON files, captured in order")
+    capture.add_argument('--object-id', help="Object id for a session given on the command line")
+    capture.add_argument('--types', nargs='+', default=['target'], choices=IMAGE_TYPES,
+                         help="Image types to capture (default: target)")
+    capture.add_argument('--rig', help="Light rig JSON file (default: the N/E/S/W stand)")
+    capture.add_argument('--lights', nargs='+',
+                         help="Rig lights to capture with, by name or index (default: all)")
+    capture.add_argument('--exposures', nargs='+', type=float, default=[0.7],
+                         help="Exposure times in seconds (default: 0.7)")
+    capture.add_argument('--repeats', type=int, default=1, help="Repeats of each light/exposure")
+    capture.add_argument('--pwm', type=int, help="Light brightness (0-255) for the session")
+    capture.add_argument('--pixel-format', default='Mono8', choices=sorted(PIXEL_FORMATS),
+                         help="Camera pixel format; Mono12p/Mono16 keep full bit depth (default: Mono8)")
+    capture.add_argument('--frames-per-light', type=int, default=1,
+                         help="Average this many consecutive frames per light (default: 1)")
+    capture.add_argument('--variance', action='store_true',
+                         help="Also save the per-pixel variance of averaged frames")
+    capture.add_argument('--dark-frames', type=int, default=0,
+                         help="Make sure a master dark of this many frames is cached per exposure")
+    capture.add_argument('--dark-dir', help="Master dark cache (default: <output>/darks)")
+    capture.add_argument('--ambient', default='off', choices=AMBIENT_MODES,
+                         help="Subtract a lights-off frame taken before every lit frame ('frame') "
+                              "or once per exposure ('sequence') (default: off)")
+    capture.add_argument('--intensity', metavar='FILE',
+                         help="Light intensity calibration stored with the session for processing")
+    capture.add_argument('--balance', action='store_true',
+                         help="Give each light its own PWM level from --intensity so all lights match")
+    roi = capture.add_mutually_exclusive_group()
+    roi.add_argument('--roi', nargs=4, type=int, metavar=('X', 'Y', 'WIDTH', 'HEIGHT'),
+                     help="Read out only this region of the sensor (full-resolution pixels)")
+    roi.add_argument('--roi-auto', action='store_true',
+                     help="Read out only the object's bounding box, found from lit frames at the start")
+    roi.add_argument('--roi-mask', metavar='FILE',
+                     help="Read out only the bounding box of this full-frame mask image")
+    capture.add_argument('--output', help="Root directory for session folders (default: ../images)")
+    capture.add_argument('--port',
+                         help="Arduino serial port (default: whichever port answers the handshake)")
+    capture.add_argument('--camera', metavar='SERIAL',
+                         help="Camera serial number (default: the first camera)")
+    capture.add_argument('--baud', type=int, default=9600, help="Serial baud rate (default: 9600)")
+    capture.add_argument('--qc', action='store_true',
+                         help="Check every frame for saturation, exposure, focus and drift while its "
+                              "light is on, and retake failing frames")
+    capture.add_argument('--retakes', type=int, default=2,
+                         help="Retakes per light when a frame fails --qc (default: 2)")
+    capture.add_argument('--resume', action='store_true',
+                         help="Continue interrupted sessions from their journal instead of starting over")
+    capture.add_argument('--serial-retries', type=int, default=2,
+                         help="Serial resyncs per session before a failing light ends it (default: 2)")
+    capture.add_argument('--pipelined', action='store_true',
+                         help="Switch to the next light and expose while the previous frame is "
+                              "still being saved, and report frames per second and stage utilization")
+    capture.add_argument('-y', '--yes', action='store_true',
+                         help="Skip the power supply confirmation prompt")
+    capture.add_argument('--trace', metavar='FILE',
+                         help="Record per-stage timings and write them as a Chrome trace file")
+
+    subparsers.add_parser('interactive', help="Run the interactive prompt-driven controller")
+
+    preview = subparsers.add_parser(
+        'preview', help="Stream a live, binned preview for framing and focusing",
+        description="Run continuous acquisition at reduced resolution and show it with focus and "
+                    "exposure metrics. The camera's capture settings are restored afterwards.")
+    preview.add_argument('--binning', type=int, default=2, help="On-camera binning factor (default: 2)")
+    preview.add_argument('--decimation', type=int, default=1,
+                         help="On-camera decimation factor (default: 1)")
+    preview.add_argument('--roi', nargs=4, type=int, metavar=('X', 'Y', 'WIDTH', 'HEIGHT'),
+                         help="Preview only this region, in full-resolution pixels")
+    preview.add_argument('--exposure', type=float, help="Preview exposure in seconds (default: unchanged)")
+    preview.add_argument('--light', help="Keep this rig light on, by name or index (default: all off)")
+    preview.add_argument('--rig', help="Light rig JSON file (default: the N/E/S/W stand)")
+    preview.add_argument('--pixel-format', default='Mono8', choices=sorted(PIXEL_FORMATS),
+                         help="Camera pixel format (default: Mono8)")
+    preview.add_argument('--buffer', metavar='PATH',
+                         help="Shared preview buffer file (default: one in /dev/shm or the temp dir)")
+    preview.add_argument('--no-window', action='store_true',
+                         help="Only publish to the buffer, for a viewer of your own; stop with Ctrl+C")
+    preview.add_argument('--port',
+                         help="Arduino serial port (default: whichever port answers the handshake)")
+    preview.add_argument('--camera', metavar='SERIAL',
+                         help="Camera serial number (default: the first camera)")
+    preview.add_argument('--baud', type=int, default=9600, help="Serial baud rate (default: 9600)")
+    preview.add_argument('-y', '--yes', action='store_true',
+                         help="Skip the power supply confirmation prompt")
+
+    devices = subparsers.add_parser(
+        'devices', help="List the Arduino and cameras found on this machine",
+        description="Handshake with every serial port at once and list the camera serial numbers.")
+    devices.add_argument('--baud', type=int, default=9600, help="Serial baud rate (default: 9600)")
+
+    dark = subparsers.add_parser(
+        'calibrate-dark', help="Capture and cache master dark frames",
+        description="Capture lights-off master darks for each exposure at the current gain.")
+    dark.add_argument('--exposures', nargs='+', type=float, default=[0.7],
+                      help="Exposure times in seconds (default: 0.7)")
+    dark.add_argument('--frames', type=int, default=16, help="Frames averaged per master (default: 16)")
+    dark.add_argument('--pixel-format', default='Mono8', choices=sorted(PIXEL_FORMATS),
+                      help="Camera pixel format (default: Mono8)")
+    dark.add_argument('--dark-dir', default=os.path.join("..", "images", "darks"),
+                      help="Master dark cache (default: ../images/darks)")
+    dark.add_argument('--force', action='store_true', help="Recapture even if a master is cached")
+    dark.add_argument('--port',
+                      help="Arduino serial port (default: whichever port answers the handshake)")
+    dark.add_argument('--camera', metavar='SERIAL',
+                      help="Camera serial number (default: the first camera)")
+    dark.add_argument('--baud', type=int, default=9600, help="Serial baud rate (default: 9600)")
+    dark.add_argument('-y', '--yes', action='store_true',
+                      help="Skip the power supply confirmation prompt")
+
+    intensity = subparsers.add_parser(
+        'calibrate-intensity', help="Measure each light's response at several PWM levels",
+        description="Image a flat reference target under every rig light at each PWM level "
+                    "and save the per-light response curves.")
+    intensity.add_argument('--levels', nargs='+', type=int, default=[64, 128, 192, 255],
+                           help="PWM levels to measure (default: 64 128 192 255)")
+    intensity.add_argument('--frames', type=int, default=4, help="Frames averaged per level (default: 4)")
+    intensity.add_argument('--exposure', type=float, default=0.7, help="Exposure in seconds (default: 0.7)")
+    intensity.add_argument('--pixel-format', default='Mono16', choices=sorted(PIXEL_FORMATS),
+                           help="Camera pixel format (default: Mono16)")
+    intensity.add_argument('--rig', help="Light rig JSON file (default: the N/E/S/W stand)")
+    intensity.add_argument('--lights', nargs='+', help="Lights to measure, by name or index (default: all)")
+    intensity.add_argument('--roi', nargs=4, type=int, metavar=('X', 'Y', 'WIDTH', 'HEIGHT'),
+                           help="Region of the reference target (default: the whole frame)")
+    intensity.add_argument('--output', default="intensity.json",
+                           help="Calibration file to write (default: intensity.json)")
+    intensity.add_argument('--port',
+                           help="Arduino serial port (default: whichever port answers the handshake)")
+    intensity.add_argument('--camera', metavar='SERIAL',
+                           help="Camera serial number (default: the first camera)")
+    intensity.add_argument('--baud', type=int, default=9600, help="Serial baud rate (default: 9600)")
+    intensity.add_argument('-y', '--yes', action='store_true',
+                           help="Skip the power supply confirmation prompt")
+
+    process = subparsers.add_parser(
+        'process', help="Run photometric stereo on a folder of frames",
+        description="Solve normals and albedo for a captured session folder (through its "
+                    "manifest.json), or for frames named <name><index><format> in a folder.")
+    process.add_argument('folder', help="Session folder, or a folder with the frames, "
+                                        "LightMatrix.yml and mask.bmp")
+    process.add_argument('--name', help="Frame name prefix, e.g. 'clip.'")
+    process.add_argument('--count', type=int, help="Number of frames")
+    process.add_argument('--type', default='target', choices=IMAGE_TYPES,
+                         help="Image type of a session to process (default: target)")
+    process.add_argument('--exposure', type=float,
+                         help="Session exposure to process (default: the first captured)")
+    process.add_argument('--repeat', type=int, default=0, help="Session repeat to process (default: 0)")
+    process.add_argument('--rig', help="Light rig JSON for folder frames, numbered in rig light order "
+                                       "(default: LightMatrix.yml)")
+    process.add_argument('--solver', default='auto', choices=('auto', 'distant', 'near'),
+                         help="Light model: 'near' uses the rig's light positions for per-pixel "
+                              "direction and falloff; 'auto' does so when the rig has them (default: auto)")
+    process.add_argument('--field-cache', metavar='DIR',
+                         help="Directory caching near-field light fields between runs")
+    process.add_argument('--format', default=".tiff", help="Frame file extension (default: .tiff)")
+    process.add_argument('--mask', help="Mask image (default: <folder>/mask.bmp)")
+    process.add_argument('--dark', help="Master dark TIFF to subtract from every frame")
+    process.add_argument('--bit-depth', type=int,
+                         help="Significant bits of the frames, e.g. 12 for Mono12p (default: from dtype)")
+    process.add_argument('--intensity', metavar='FILE',
+                         help="Light intensity calibration (default: the one stored with a session)")
+    process.add_argument('--pwm', type=int,
+                         help="PWM level of folder frames for --intensity (default: top calibrated level)")
+    process.add_argument('--flat-name', metavar='NAME',
+                         help="Frame name prefix of flat-field frames in the folder, one per light")
+    process.add_argument('--no-flat', action='store_true',
+                         help="Do not flat-field correct with a session's flat frames")
+    process.add_argument('--height', action='store_true',
+                         help="Also integrate a height map (height.tif and height.png)")
+    process.add_argument('--register', action='store_true',
+                         help="Align the frames to the first one before solving, recording the "
+                              "shifts in registration.json")
+    process.add_argument('--cache', metavar='DIR',
+                         help="Cache stage outputs in DIR so reruns with changed parameters only "
+                              "redo the stages affected")
+    process.add_argument('--cache-size', type=int, default=2048, metavar='MB',
+                         help="Size limit of the stage cache; least recently used entries are "
+                              "evicted (default: 2048)")
+    process.add_argument('--store', action='store_true',
+                         help="Also save the float maps to maps.chs, a tiled multi-resolution store")
+    process.add_argument('--normal-bits', type=int, default=8, choices=(8, 16),
+                         help="Bits per channel of normal_map.png (default: 8)")
+    process.add_argument('--demosaic', default='bilinear', choices=('bilinear', 'superpixel'),
+                         help="How color (Bayer) frames are demosaiced: full resolution, or half "
+                              "resolution from each 2 x 2 cell (default: bilinear)")
+    process.add_argument('--bayer', choices=('RGGB', 'GRBG', 'GBRG', 'BGGR'),
+                         help="Color filter pattern of folder frames that are raw Bayer mosaics "
+                              "(sessions record their pixel format)")
+    process.add_argument('--precision', default='float32', choices=('float32', 'float16'),
+                         help="Element type the frames are held in between stages; float16 halves "
+                              "their memory (default: float32)")
+    process.add_argument('--output', default=".", help="Directory for the result images (default: .)")
+    process.add_argument('--show', action='store_true', help="Show the normal map when done")
+    process.add_argument('--trace', metavar='FILE',
+                         help="Record per-stage timings and write them as a Chrome trace file")
+    process.add_argument('--memory', action='store_true',
+                         help="Also report the peak memory of each stage (slows Python code)")
+
+    batch = subparsers.add_parser(
+        'batch', help="Process captured sessions as they complete",
+        description="Watch a capture output directory and process every complete session on a "
+                    "pool of worker processes, recording each one's status in batch.json.")
+    batch.add_argument('root', help="Capture output directory with one folder per session")
+    batch.add_argument('--output', help="Directory for results, one folder per session "
+                                        "(default: <session>/results)")
+    batch.add_argument('--workers', type=int, default=2,
+                       help="Sessions processed at once (default: 2)")
+    batch.add_argument('--poll', type=float, default=10.0,
+                       help="Seconds between scans for new sessions (default: 10)")
+    batch.add_argument('--once', action='store_true',
+                       help="Exit when no sessions are left instead of watching for new ones")
+    batch.add_argument('--retries', type=int, default=1,
+                       help="Times a failed session is retried (default: 1)")
+    batch.add_argument('--type', default='target', choices=IMAGE_TYPES,
+                       help="Image type to process (default: target)")
+    batch.add_argument('--solver', default='auto', choices=('auto', 'distant', 'near'),
+                       help="Light model (default: auto)")
+    batch.add_argument('--height', action='store_true', help="Also integrate height maps")
+    batch.add_argument('--register', action='store_true',
+                       help="Align each session's frames before solving")
+    batch.add_argument('--store', action='store_true',
+                       help="Also save the float maps to maps.chs in each result folder")
+    batch.add_argument('--normal-bits', type=int, default=8, choices=(8, 16),
+                       help="Bits per channel of normal_map.png (default: 8)")
+    batch.add_argument('--demosaic', default='bilinear', choices=('bilinear', 'superpixel'),
+                       help="How color (Bayer) sessions are demosaiced (default: bilinear)")
+    batch.add_argument('--precision', default='float32', choices=('float32', 'float16'),
+                       help="Element type the frames are held in between stages (default: float32)")
+    batch.add_argument('--field-cache', metavar='DIR',
+                       help="Directory caching near-field light fields between sessions")
+    batch.add_argument('--cache', metavar='DIR', help="Stage cache directory")
+    batch.add_argument('--cache-size', type=int, default=2048, metavar='MB',
+                       help="Size limit of the stage cache (default: 2048)")
+
+    serve = subparsers.add_parser(
+        'serve', help="Process sessions sent by capture stations over HTTP",
+        description="Run the processing service: accept sessions from chi submit, process them on a "
+                    "pool of worker processes and send the results back.")
+    serve.add_argument('root', help="Directory for received sessions and their results")
+    serve.add_argument('--host', default='127.0.0.1',
+                       help="Address to listen on; 0.0.0.0 for other machines (default: 127.0.0.1)")
+    serve.add_argument('--port', type=int, default=8753, help="Port to listen on (default: 8753)")
+    serve.add_argument('--workers', type=int, default=2,
+                       help="Sessions processed at once (default: 2)")
+    serve.add_argument('--field-cache', metavar='DIR',
+                       help="Directory caching near-field light fields between sessions")
+    serve.add_argument('--cache', metavar='DIR', help="Stage cache directory")
+    serve.add_argument('--cache-size', type=int, default=2048, metavar='MB',
+                       help="Size limit of the stage cache (default: 2048)")
+
+    submit = subparsers.add_parser(
+        'submit', help="Process sessions on a chi serve machine",
+        description="Send captured sessions to a processing service, wait for them and download "
+                    "the results.")
+    submit.add_argument('sessions', nargs='+', help="Session folders containing manifest.json")
+    submit.add_argument('--url', default='http://127.0.0.1:8753',
+                        help="Processing service (default: http://127.0.0.1:8753)")
+    submit.add_argument('--output', help="Directory for results, one folder per session "
+                                         "(default: <session>/results)")
+    submit.add_argument('--type', default='target', choices=IMAGE_TYPES,
+                        help="Image type to process (default: target)")
+    submit.add_argument('--solver', default='auto', choices=('auto', 'distant', 'near'),
+                        help="Light model (default: auto)")
+    submit.add_argument('--height', action='store_true', help="Also integrate height maps")
+    submit.add_argument('--register', action='store_true',
+                        help="Align each session's frames before solving")
+    submit.add_argument('--store', action='store_true',
+                        help="Also save the float maps to maps.chs in each result folder")
+    submit.add_argument('--normal-bits', type=int, default=8, choices=(8, 16),
+                        help="Bits per channel of normal_map.png (default: 8)")
+    submit.add_argument('--demosaic', default='bilinear', choices=('bilinear', 'superpixel'),
+                        help="How color (Bayer) sessions are demosaiced (default: bilinear)")
+    submit.add_argument('--precision', default='float32', choices=('float32', 'float16'),
+                        help="Element type the frames are held in between stages (default: float32)")
+    submit.add_argument('--keep', action='store_true',
+                        help="Leave the jobs on the service instead of removing them after download")
+    return parser
+
+
+def collect_specs(args):
+    """
+    Gather the sessions to capture from spec files and command line options.
+    """
+    specs = []
+    for path in args.specs:
+        specs.extend(load_session_specs(path))
+    if args.object_id:
+        specs.append(SessionSpec(args.object_id, image_types=args.types, lights=args.lights,
+                                 exposures=args.exposures, repeats=args.repeats, pwm=args.pwm,
+                                 pixel_format=args.pixel_format,
+                                 frames_per_light=args.frames_per_light,
+                                 save_variance=args.variance, dark_frames=args.dark_frames,
+                                 ambient=args.ambient, rig=args.rig,
+                                 intensity_calibration=args.intensity, balance_lights=args.balance,
+                                 qc=args.qc or None, retakes=args.retakes,
+                                 roi=args.roi or ('auto' if args.roi_auto else args.roi_mask)))
+    return specs
+
+
+def run_capture(args):
+    """
+    Capture all requested sessions back-to-back. Returns the process exit code.
+    """
+    from cultural_heritage_imaging.capture.controller import CameraController, confirm_power_unplugged
+    from cultural_heritage_imaging.capture.journal import JournalError
+
+    try:
+        specs = collect_specs(args)
+    except (OSError, ValueError) as ex:
+        print(f"Invalid session spec: {ex}")
+        return 2
+    if not specs:
+        print("Nothing to capture: give spec files or --object-id")
+        return 2
+
+    if not args.yes:
+        confirm_power_unplugged()
+    controller = CameraController(serial_port=args.port, baud_rate=args.baud,
+                                  camera_serial=args.camera)
+    controller.serial_retries = args.serial_retries
+    controller.pipelined = args.pipelined
+    failed = []
+    try:
+        controller.arduino.write('C'.encode())
+        controller.arduino.flush()
+        darks = None
+        if args.dark_dir:
+            from cultural_heritage_imaging.calibration.dark import DarkLibrary
+            darks = DarkLibrary(args.dark_dir)
+        for spec in specs:
+            try:
+                complete = controller.run_session(spec, root=args.output, darks=darks,
+                                                  resume=args.resume)
+            except JournalError as ex:
+                # The journal on disk belongs to other settings
+                print(f"Cannot resume {spec.object_id}: {ex}")
+                complete = False
+            except Exception as ex:
+                # Bad ROI masks, calibration files or camera settings fail
+                # this session only; the rest of the tray still runs
+                print(f"Capture of {spec.object_id} failed: {type(ex).__name__}: {ex}")
+                complete = False
+            if not complete:
+                failed.append(spec.object_id)
+    except KeyboardInterrupt:
+        print("\nExiting...")
+        return 130
+    finally:
+        controller.cleanup()
+
+    if failed:
+        print(f"Failed sessions: {', '.join(failed)}")
+        return 1
+    print(f"Captured {len(specs)} session(s)")
+    return 0
+
+
+def run_calibrate_dark(args):
+    """
+    Capture master darks for each requested exposure into the dark library.
+    """
+    from cultural_heritage_imaging.calibration.dark import DarkLibrary
+    from cultural_heritage_imaging.capture.controller import CameraController, confirm_power_unplugged
+
+    if not args.yes:
+        confirm_power_unplugged()
+    controller = CameraController(serial_port=args.port, baud_rate=args.baud,
+                                  pixel_format=args.pixel_format, camera_serial=args.camera)
+    library = DarkLibrary(args.dark_dir)
+    failed = False
+    try:
+        for exposure in args.exposures:
+            if args.force:
+                controller.set_exposure(exposure)
+                dark = controller.capture_master_dark(args.frames)
+                path = None if dark is None else library.put(
+                    dark, exposure, controller.get_gain(), controller.pixel_format, args.frames)
+            else:
+                path = controller.ensure_master_dark(library, exposure, args.frames)
+            if path is None:
+                print(f"Master dark at {exposure:g} s failed")
+                failed = True
+            else:
+                print(f"Master dark at {exposure:g} s: {path}")
+    finally:
+        controller.cleanup()
+    return 1 if failed else 0
+
+
+def run_calibrate_intensity(args):
+    """
+    Measure the rig lights' response curves and save them as a calibration file.
+    """
+    from cultural_heritage_imaging.capture.controller import CameraController, confirm_power_unplugged
+    from cultural_heritage_imaging.rig import LightRig
+
+    try:
+        rig = LightRig.load(args.rig) if args.rig else None
+    except (OSError, ValueError) as ex:
+        print(f"Invalid light rig: {ex}")
+        return 2
+    if not args.yes:
+        confirm_power_unplugged()
+    controller = CameraController(serial_port=args.port, baud_rate=args.baud,
+                                  pixel_format=args.pixel_format, rig=rig, camera_serial=args.camera)
+    try:
+        controller.set_exposure(args.exposure)
+        calibration = controller.measure_light_response(args.levels, args.lights, args.frames,
+                                                         args.roi)
+    finally:
+        controller.cleanup()
+    if calibration is None:
+        print("Intensity calibration failed")
+        return 1
+    print(f"Intensity calibration written to {calibration.save(args.output)}")
+    return 0
+
+
+def run_devices(args):
+    """
+    Print the port of the Arduino running main.ino and the cameras' serial numbers.
+    """
+    from cultural_heritage_imaging.capture.devices import DeviceManager
+
+    status = 0
+    with DeviceManager(baud_rate=args.baud) as devices:
+        try:
+            devices.arduino()
+        except ValueError as ex:
+            print(ex)
+            status = 1
+        serials = devices.cameras()
+    print("Cameras: " + (", ".join(serials) if serials else "none"))
+    return status if serials else 1
+
+
+def run_preview(args):
+    """
+    Stream the preview into a shared buffer, shown by a viewer process.
+    """
+    import multiprocessing
+
+    from cultural_heritage_imaging.capture import preview
+    from cultural_heritage_imaging.capture.controller import CameraController, confirm_power_unplugged
+    from cultural_heritage_imaging.rig import LightRig
+
+    try:
+        rig = LightRig.load(args.rig) if args.rig else None
+    except (OSError, ValueError) as ex:
+        print(f"Invalid light rig: {ex}")
+        return 2
+    if not args.yes:
+        confirm_power_unplugged()
+    controller = CameraController(serial_port=args.port, baud_rate=args.baud,
+                                  pixel_format=args.pixel_format, rig=rig, camera_serial=args.camera)
+    viewer = None
+    try:
+        with preview.PreviewBuffer(args.buffer or preview.default_path(), create=True) as buffer:
+            if args.no_window:
+                print(f"Publishing preview frames to {buffer.path}")
+                stop = None
+            else:
+                from cultural_heritage_imaging.viz import show_preview
+                viewer = multiprocessing.Process(target=show_preview, args=(buffer.path,), daemon=True)
+                viewer.start()
+
+                def stop():
+                    # Closing the window ends the preview
+                    return not viewer.is_alive()
+            count = preview.stream(controller, buffer, args.binning, args.decimation, args.roi,
+                                   args.exposure, args.light, stop)
+    except KeyboardInterrupt:
+        print("\nExiting...")
+        return 130
+    except ValueError as ex:
+        print(f"Preview failed: {ex}")
+        return 1
+    finally:
+        if viewer is not None:
+            viewer.join(timeout=2)
+        controller.cleanup()
+    print(f"Streamed {count} preview frames")
+    return 0
+
+
+def run_interactive(args):
+    """
+    Run the original interactive controller.
+    """
+    from cultural_heritage_imaging.capture.controller import main as interactive_main
+    interactive_main()
+    return 0
+
+
+def run_process(args):
+    """
+    Process one folder of frames and save the normal and albedo maps.
+    """
+    from cultural_heritage_imaging.processing.pipeline import process_folder, process_session, save_results
+
+    try:
+        dark = None
+        if args.dark:
+            from cultural_heritage_imaging.processing.io import read_image
+            dark = read_image(args.dark)
+            if dark is None:
+                raise ValueError(f"Master dark {args.dark} cannot be read")
+        intensity = None
+        if args.intensity:
+            from cultural_heritage_imaging.calibration.intensity import IntensityCalibration
+            intensity = IntensityCalibration.load(args.intensity)
+        cache = None
+        if args.cache:
+            from cultural_heritage_imaging.processing.cache import StageCache
+            cache = StageCache(args.cache, args.cache_size * 1024 * 1024)
+        if args.name is None and os.path.exists(os.path.join(args.folder, MANIFEST_NAME)):
+            results = process_session(args.folder, args.type, args.exposure, args.repeat,
+                                      mask_path=args.mask, dark=dark, intensity=intensity,
+                                      solver=args.solver, field_cache=args.field_cache,
+                                      use_flat=not args.no_flat, cache=cache, with_height=args.height,
+                                      register=args.register, precision=args.precision,
+                                      demosaic=args.demosaic)
+        elif args.name is None or args.count is None:
+            raise ValueError(f"{args.folder} has no {MANIFEST_NAME}: give --name and --count")
+        else:
+            # Folder frames are numbered in light index order
+            scales = None
+            if intensity is not None:
+                pwm = intensity.levels[-1] if args.pwm is None else args.pwm
+                scales = intensity.scales(range(args.count), pwm)
+            light_mat = model = None
+            if args.rig:
+                from cultural_heritage_imaging.rig import LightRig
+                rig = LightRig.load(args.rig)
+                indices = list(range(args.count))
+                if args.solver == 'near' or (args.solver == 'auto' and rig.near_field):
+                    from cultural_heritage_imaging.processing import io
+                    from cultural_heritage_imaging.processing.nearfield import near_field_model
+                    first = io.read_image(os.path.join(args.folder, f"{args.name}0{args.format}"))
+                    if first is None:
+                        raise ValueError(f"Cannot read {args.name}0{args.format} in {args.folder}")
+                    shape, pixel_size = first.shape, 1
+                    if args.bayer and args.demosaic == 'superpixel':
+                        shape, pixel_size = (shape[0] // 2, shape[1] // 2), 2
+                    model = near_field_model(rig, indices, shape, cache_dir=args.field_cache,
+                                             pixel_size=pixel_size)
+                else:
+                    light_mat = rig.light_matrix(indices)
+            elif args.solver == 'near':
+                raise ValueError("The near-field solver needs --rig for folder frames")
+            results = process_folder(args.folder, args.name, args.count, args.format,
+                                     light_mat=light_mat, mask_path=args.mask,
+                                     bit_depth=args.bit_depth, dark=dark, intensity_scales=scales,
+                                     model=model, flat_name=args.flat_name, cache=cache,
+                                     with_height=args.height, register=args.register,
+                                     precision=args.precision, bayer=args.bayer,
+                                     demosaic=args.demosaic)
+    except (OSError, ValueError) as ex:
+        print(f"Processing failed: {ex}")
+        return 1
+    if cache is not None:
+        print(f"Stage cache: {cache.hits} reused, {cache.misses} computed")
+    normals, albedo = results[:2]
+    height = results[2] if args.height else None
+    for path in save_results(normals, albedo, args.output, height, args.store, args.normal_bits):
+        print(f"Saved {path}")
+    if args.show:
+        from cultural_heritage_imaging.processing.export import encode_normals
+        from cultural_heritage_imaging.viz import show_image
+        show_image("normal", encode_normals(normals))
+    return 0
+
+
+def run_batch(args):
+    """
+    Process complete sessions under a capture directory until interrupted.
+    """
+    from cultural_heritage_imaging.processing.batch import BatchProcessor
+
+    if not os.path.isdir(args.root):
+        print(f"Directory {args.root} does not exist")
+        return 2
+    try:
+        processor = BatchProcessor(args.root, args.output, workers=args.workers,
+                                   poll_interval=args.poll, retries=args.retries,
+                                   image_type=args.type, solver=args.solver, with_height=args.height,
+                                   register=args.register, normal_bits=args.normal_bits,
+                                   precision=args.precision, demosaic=args.demosaic,
+                                   field_cache=args.field_cache, store=args.store, cache_dir=args.cache,
+                                   cache_bytes=args.cache_size * 1024 * 1024)
+    except ValueError as ex:
+        print(f"Invalid batch options: {ex}")
+        return 2
+    print(f"Watching {args.root} with {args.workers} worker(s)")
+    done, failed = processor.run(once=args.once)
+    print(f"Processed {done} session(s), {failed} failed")
+    return 1 if failed else 0
+
+
+def run_serve(args):
+    """
+    Serve processing requests until interrupted.
+    """
+    from cultural_heritage_imaging.processing.service import ProcessingService
+
+    try:
+        service = ProcessingService(args.root, args.host, args.port, workers=args.workers,
+                                    field_cache=args.field_cache, cache_dir=args.cache,
+                                    cache_bytes=args.cache_size * 1024 * 1024)
+    except (OSError, ValueError) as ex:
+        print(f"Cannot start the processing service: {ex}")
+        return 2
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping: waiting for running jobs")
+    finally:
+        service.close()
+    return 0
+
+
+def run_submit(args):
+    """
+    Process sessions on a processing service one after another.
+    """
+    from cultural_heritage_imaging.processing.batch import RESULTS_DIR
+    from cultural_heritage_imaging.processing.service import ProcessingClient
+
+    try:
+        client = ProcessingClient(args.url)
+    except ValueError as ex:
+        print(ex)
+        return 2
+    failed = 0
+    for session_dir in args.sessions:
+        if not os.path.isfile(os.path.join(session_dir, MANIFEST_NAME)):
+            print(f"No {MANIFEST_NAME} in {session_dir}")
+            failed += 1
+            continue
+        if args.output:
+            output_dir = os.path.join(args.output, os.path.basename(os.path.normpath(session_dir)))
+        else:
+            output_dir = os.path.join(session_dir, RESULTS_DIR)
+        try:
+            paths = client.process(session_dir, output_dir, keep=args.keep, image_type=args.type,
+                                   solver=args.solver, with_height=args.height,
+                                   register=args.register, store=args.store,
+                                   normal_bits=args.normal_bits, precision=args.precision,
+                                   demosaic=args.demosaic)
+        except (OSError, ValueError) as ex:
+            print(f"Failed {session_dir}: {ex}")
+            failed += 1
+            continue
+        print(f"Done {session_dir}: {len(paths)} file(s) in {output_dir}")
+    return 1 if failed else 0
+
+
+COMMANDS = {
+    'batch': run_batch,
+    'capture': run_capture,
+    'calibrate-dark': run_calibrate_dark,
+    'calibrate-intensity': run_calibrate_intensity,
+    'devices': run_devices,
+    'interactive': run_interactive,
+    'preview': run_preview,
+    'process': run_process,
+    'serve': run_serve,
+    'submit': run_submit,
+}
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    trace = getattr(args, 'trace', None)
+    memory = getattr(args, 'memory', False)
+    if trace is None and not memory:
+        return COMMANDS[args.command](args)
+
+    from cultural_heritage_imaging import instrument
+    instrument.enable(memory=memory)
+    try:
+        return COMMANDS[args.command](args)
+    finally:
+        print(instrument.format_summary())
+        if trace is not None:
+            instrument.write_trace(trace)
+            print(f"Trace written to {trace}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""
+Per-Stage Timing Instrumentation
+
+Lightweight spans around the capture and processing stages (camera init,
+acquisition, serial waits, conversion, saving, each processing step). Spans
+are aggregated into per-stage histograms and can be written as a Chrome
+trace file (open in chrome://tracing or https://ui.perfetto.dev).
+
+Instrumentation is off by default; a disabled span is a shared no-op
+context manager, so the cost at each call site is one attribute check.
+
+With memory tracking on, each span also records the peak traced allocation
+of the process while it was open (tracemalloc; NumPy reports its buffers to
+it, so this covers array memory), which is what a stage needs to fit in RAM
+alongside everything already held. Tracing allocations slows pure-Python
+code, so it is opt-in.
+
+    from cultural_heritage_imaging import instrument
+
+    instrument.enable(memory=True)
+    with instrument.span('capture.save', light='N'):
+        ...
+    print(instrument.format_summary())
+    instrument.write_trace('session_trace.json')
+"""
+
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# Histogram bucket upper edges in seconds
+BUCKETS = (1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2, 0.1, 0.3, 1.0, 3.0, 10.0, float('inf'))
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'attrs', 'start', 'peak')
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        if self.tracer.memory:
+            self.tracer._open_memory(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        if self.tracer.memory:
+            self.attrs['peak_bytes'] = self.tracer._close_memory(self)
+        # list.append is atomic, so spans from worker threads need no lock
+        self.tracer.events.append((self.name, self.start, end - self.start,
+                                   threading.get_ident(), self.attrs))
+        return False
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.events = []
+        self.origin = time.perf_counter()
+        # Spans open while tracking memory; tracemalloc has one peak for the
+        # process, so it is reset at every span boundary and folded into the
+        # running peak of each open span
+        self._open = []
+        self._lock = threading.Lock()
+
+    def span(self, name, **attrs):
+        """
+        Context manager timing the enclosed block as one span of stage name.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, attrs)
+
+    def reset(self):
+        self.events = []
+        self.origin = time.perf_counter()
+
+    def _fold_peak(self):
+        _, peak = tracemalloc.get_traced_memory()
+        for span in self._open:
+            span.peak = max(span.peak, peak)
+        tracemalloc.reset_peak()
+
+    def _open_memory(self, span):
+        with self._lock:
+            self._fold_peak()
+            span.peak = tracemalloc.get_traced_memory()[0]
+            self._open.append(span)
+
+    def _close_memory(self, span):
+        with self._lock:
+            self._fold_peak()
+            if span in self._open:
+                self._open.remove(span)
+            return span.peak
+
+    def start_memory(self):
+        """
+        Start tracing allocations so spans record their peak memory.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.memory = True
+
+    def stop_memory(self):
+        self.memory = False
+        self._open = []
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def peaks(self):
+        """
+        Map each stage name to the largest peak memory in bytes of its spans,
+        for stages recorded with memory tracking.
+        """
+        result = {}
+        for name, _, _, _, attrs in self.events:
+            if 'peak_bytes' in attrs:
+                result[name] = max(result.get(name, 0), attrs['peak_bytes'])
+        return result
+
+    def durations(self):
+        """
+        Map each stage name to the list of its span durations in seconds.
+        """
+        result = {}
+        for name, _, duration, _, _ in self.events:
+            result.setdefault(name, []).append(duration)
+        return result
+
+    def summary(self):
+        """
+        Per-stage histogram and statistics of the recorded spans.
+        """
+        result = {}
+        peaks = self.peaks()
+        for name, samples in self.durations().items():
+            ordered = sorted(samples)
+            count = len(ordered)
+            buckets = [0] * len(BUCKETS)
+            for duration in ordered:
+                for i, edge in enumerate(BUCKETS):
+                    if duration <= edge:
+                        buckets[i] += 1
+                        break
+            result[name] = {
+                'count': count,
+                'total_s': sum(ordered),
+                'mean_s': sum(ordered) / count,
+                'min_s': ordered[0],
+                'p50_s': ordered[count // 2],
+                'p95_s': ordered[min(count - 1, int(round(0.95 * (count - 1))))],
+                'max_s': ordered[-1],
+                'histogram': {_bucket_label(edge): n for edge, n in zip(BUCKETS, buckets) if n},
+            }
+            if name in peaks:
+                result[name]['peak_bytes'] = peaks[name]
+        return result
+
+    def trace_events(self):
+        """
+        Recorded spans as Chrome trace 'complete' events (microseconds).
+        """
+        pid = os.getpid()
+        return [{
+            'name': name,
+            'cat': name.split('.', 1)[0],
+            'ph': 'X',
+            'ts': (start - self.origin) * 1e6,
+            'dur': duration * 1e6,
+            'pid': pid,
+            'tid': tid,
+            'args': attrs,
+        } for name, start, duration, tid, attrs in self.events]
+
+    def write_trace(self, path):
+        """
+        Write the spans and per-stage histograms to a Chrome trace JSON file.
+        """
+        document = {
+            'traceEvents': self.trace_events(),
+            'displayTimeUnit': 'ms',
+            'otherData': {'histograms': self.summary()},
+        }
+        with open(path, 'w') as f:
+            json.dump(document, f, default=str)
+        return path
+
+    def format_summary(self):
+        """
+        Human-readable per-stage timing table, slowest total first, with the
+        peak memory of each stage when it was tracked.
+        """
+        summary = self.summary()
+        if not summary:
+            return "No spans recorded."
+        memory = any('peak_bytes' in stats for stats in summary.values())
+        lines = [f"{'stage':<24} {'count':>6} {'total ms':>10} {'mean ms':>9} "
+                 f"{'p95 ms':>9} {'max ms':>9}" + (f" {'peak MB':>9}" if memory else "")]
+        for name, stats in sorted(summary.items(), key=lambda item: -item[1]['total_s']):
+            line = (f"{name:<24} {stats['count']:>6} {stats['total_s'] * 1e3:>10.1f} "
+                    f"{stats['mean_s'] * 1e3:>9.2f} {stats['p95_s'] * 1e3:>9.2f} "
+                    f"{stats['max_s'] * 1e3:>9.2f}")
+            if memory:
+                peak = stats.get('peak_bytes')
+                line += f" {peak / 2 ** 20:>9.1f}" if peak is not None else f" {'-':>9}"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+def _bucket_label(edge):
+    if edge == float('inf'):
+        return f">{BUCKETS[-2]:g}s"
+    if edge < 1.0:
+        return f"<={edge * 1e3:g}ms"
+    return f"<={edge:g}s"
+
+
+# Process-wide tracer used by the capture and processing code
+tracer = Tracer()
+span = tracer.span
+summary = tracer.summary
+format_summary = tracer.format_summary
+write_trace = tracer.write_trace
+reset = tracer.reset
+
+
+def enable(memory=False):
+    """
+    Start recording spans, with memory also their peak traced allocation.
+    """
+    tracer.enabled = True
+    if memory:
+        tracer.start_memory()
+
+
+def disable():
+    tracer.enabled = False
+    tracer.stop_memory()
+
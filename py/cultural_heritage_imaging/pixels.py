@@ -0,0 +1,182 @@
+"""
+Pixel Formats and Unpacking
+
+Camera pixel formats the rig supports and the vectorized NumPy code that
+turns their buffers into arrays: Mono8 and Mono16 are used as-is, Mono12p
+(and the older Mono12Packed layout) are unpacked from 3 bytes per 2 pixels
+into uint16. Color cameras are read as raw Bayer mosaics (BayerRG8/12p/16):
+one color per pixel, stored like the mono format of the same depth and
+demosaiced only in processing (see processing.color), so capture costs the
+same as mono. Frames are carried into processing as linear float32 in [0, 1]
+(or float16, which halves the memory of a stack at about 3 significant
+digits, enough to hold 12-bit data between processing stages).
+"""
+
+from cultural_heritage_imaging._optional import lazy_import
+
+# NumPy is loaded on first use so the session and CLI modules can import the
+# format table without it
+np = lazy_import('numpy')
+
+# Element types a linear frame stack can be held in between processing stages
+STACK_DTYPES = ('float32', 'float16')
+
+# Pixel format name to significant bits per pixel
+PIXEL_FORMATS = {
+    'Mono8': 8,
+    'Mono12p': 12,
+    'Mono12Packed': 12,
+    'Mono16': 16,
+    'BayerRG8': 8,
+    'BayerRG12p': 12,
+    'BayerRG16': 16,
+}
+
+# BayerRG12p packs like Mono12p
+PACKED_FORMATS = ('Mono12p', 'Mono12Packed', 'BayerRG12p')
+
+# Color filter layout of each Bayer format, row by row from the top-left pixel
+BAYER_PATTERNS = {
+    'BayerRG': 'RGGB',
+    'BayerGR': 'GRBG',
+    'BayerGB': 'GBRG',
+    'BayerBG': 'BGGR',
+}
+
+
+def bit_depth(pixel_format):
+    """
+    Significant bits per pixel of a pixel format name.
+    """
+    try:
+        return PIXEL_FORMATS[pixel_format]
+    except KeyError:
+        raise ValueError(f"Unsupported pixel format {pixel_format!r}, "
+                         f"expected one of {sorted(PIXEL_FORMATS)}") from None
+
+
+def bayer_pattern(pixel_format, x=0, y=0):
+    """
+    Color filter layout ('RGGB', 'GRBG', 'GBRG' or 'BGGR') of a frame read out
+    from offset (x, y) of the sensor in a Bayer pixel format, or None for
+    mono formats. An odd offset moves the frame onto another phase of the
+    sensor's pattern.
+    """
+    pattern = BAYER_PATTERNS.get(pixel_format[:7]) if pixel_format.startswith('Bayer') else None
+    if pattern is None:
+        return None
+    rows = [pattern[:2], pattern[2:]]
+    return ''.join(rows[(row + y) % 2][(col + x) % 2] for row in (0, 1) for col in (0, 1))
+
+
+def _packed_triplets(raw, width, height):
+    count = width * height
+    if count % 2:
+        raise ValueError("Packed 12-bit frames need an even number of pixels")
+    raw = np.frombuffer(raw, dtype=np.uint8) if not isinstance(raw, np.ndarray) else raw.reshape(-1)
+    if raw.size < count * 3 // 2:
+        raise ValueError(f"Packed buffer of {raw.size} bytes is too short for {width}x{height}")
+    return raw[:count * 3 // 2].reshape(-1, 3)
+
+
+def _output(out, width, height):
+    if out is None:
+        return np.empty((height, width), dtype=np.uint16)
+    if out.shape != (height, width) or out.dtype != np.uint16:
+        raise ValueError("out must be a uint16 array of shape (height, width)")
+    return out
+
+
+def unpack_mono12p(raw, width, height, out=None):
+    """
+    Unpack GenICam Mono12p (LSB-first) data into a (height, width) uint16 array.
+
+    Each 3 bytes hold two pixels: p0 = b0 | (b1 & 0xF) << 8, p1 = b1 >> 4 | b2 << 4.
+    A preallocated out array can be passed to avoid allocating per frame.
+    """
+    triplets = _packed_triplets(raw, width, height)
+    out = _output(out, width, height)
+    pairs = out.reshape(-1, 2)
+    b0 = triplets[:, 0]
+    b1 = triplets[:, 1]
+    b2 = triplets[:, 2]
+    np.bitwise_and(b1, 0x0F, out=pairs[:, 0], casting='unsafe')
+    pairs[:, 0] <<= 8
+    pairs[:, 0] |= b0
+    np.left_shift(b2, 4, out=pairs[:, 1], dtype=np.uint16)
+    pairs[:, 1] |= b1 >> 4
+    return out
+
+
+def unpack_mono12packed(raw, width, height, out=None):
+    """
+    Unpack the legacy Mono12Packed layout: p0 = b0 << 4 | (b1 & 0xF), p1 = b2 << 4 | b1 >> 4.
+    """
+    triplets = _packed_triplets(raw, width, height)
+    out = _output(out, width, height)
+    pairs = out.reshape(-1, 2)
+    b0 = triplets[:, 0]
+    b1 = triplets[:, 1]
+    b2 = triplets[:, 2]
+    np.left_shift(b0, 4, out=pairs[:, 0], dtype=np.uint16)
+    pairs[:, 0] |= b1 & 0x0F
+    np.left_shift(b2, 4, out=pairs[:, 1], dtype=np.uint16)
+    pairs[:, 1] |= b1 >> 4
+    return out
+
+
+def pack_mono12p(frame):
+    """
+    Pack a uint16 frame of 12-bit values into Mono12p bytes (used by the simulator).
+    """
+    flat = np.asarray(frame, dtype=np.uint16).reshape(-1, 2)
+    p0 = flat[:, 0]
+    p1 = flat[:, 1]
+    packed = np.empty((flat.shape[0], 3), dtype=np.uint8)
+    packed[:, 0] = p0 & 0xFF
+    packed[:, 1] = ((p0 >> 8) & 0x0F) | ((p1 & 0x0F) << 4)
+    packed[:, 2] = p1 >> 4
+    return packed.reshape(-1)
+
+
+def frame_to_array(image, pixel_format, out=None):
+    """
+    Array view of a camera image buffer in its native format, without conversion.
+
+    Mono8/Mono16 return the SDK's array directly; packed formats are unpacked
+    from the raw buffer (into out if given). The result is only valid until
+    the image is released unless it was unpacked.
+    """
+    if pixel_format in ('Mono12p', 'BayerRG12p'):
+        return unpack_mono12p(image.GetData(), image.GetWidth(), image.GetHeight(), out)
+    if pixel_format == 'Mono12Packed':
+        return unpack_mono12packed(image.GetData(), image.GetWidth(), image.GetHeight(), out)
+    bit_depth(pixel_format)
+    return image.GetNDArray()
+
+
+def default_bits(dtype):
+    """
+    Bits of an integer dtype's full range, or None for float data.
+    """
+    dtype = np.dtype(dtype)
+    return dtype.itemsize * 8 if dtype.kind in 'ui' else None
+
+
+def to_linear_float32(frame, bits=None, out=None):
+    """
+    Scale an integer frame to linear float32 in [0, 1].
+
+    bits defaults to the full range of the frame's dtype; pass 12 for 12-bit
+    data stored in uint16. The scaling is computed in float32 even when out
+    is float16.
+    """
+    frame = np.asarray(frame)
+    if bits is None:
+        bits = default_bits(frame.dtype)
+    scale = np.float32(1.0 / (2 ** bits - 1)) if bits else np.float32(1.0)
+    if out is None:
+        out = np.empty(frame.shape, dtype=np.float32)
+    np.multiply(frame, scale, out=out, casting='unsafe')
+    return out
+
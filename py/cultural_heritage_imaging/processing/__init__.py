@@ -0,0 +1,8 @@
+"""
+Processing Subsystem
+
+Photometric stereo processing of captured image stacks: loading frames,
+masks and light matrices, solving for surface normals and albedo, and
+saving the results. Only NumPy is needed to solve; OpenCV and tifffile are
+loaded when images are read or written.
+"""
@@ -0,0 +1,232 @@
+"""
+Batch Processing Daemon
+
+Watches a capture output directory (the ``--output`` of ``chi capture``,
+one <object_id>/ folder per session) and processes every session whose
+manifest.json says 'complete', on a pool of worker processes with a fixed
+concurrency limit. Sessions are queued oldest first as their manifests
+appear; a session is reprocessed only when its manifest changes.
+
+Each session's results go to <session>/results/ (or <output>/<object_id>/)
+together with batch.json, its status record:
+
+    status        'running', 'done' or 'failed'
+    manifest      modification time of the manifest that was processed
+    attempts      number of runs so far; failed sessions are retried up to
+                  the retry limit, then left for a human to look at
+    error         the exception of the last failure, with its traceback
+                  under 'traceback'
+    outputs       result files written
+"""
+
+import concurrent.futures
+import json
+import os
+import signal
+import time
+import traceback
+
+from cultural_heritage_imaging.session import MANIFEST_NAME
+
+STATUS_NAME = "batch.json"
+RESULTS_DIR = "results"
+
+
+def find_sessions(root):
+    """
+    Session folders under root (root itself and its subfolders) whose
+    manifest marks the capture complete, oldest manifest first.
+    """
+    candidates = [root] + [os.path.join(root, name) for name in sorted(os.listdir(root))]
+    sessions = []
+    for path in candidates:
+        manifest_path = os.path.join(path, MANIFEST_NAME)
+        if not os.path.isfile(manifest_path):
+            continue
+        try:
+            with open(manifest_path, 'r') as f:
+                status = json.load(f).get('status')
+        except (OSError, ValueError):
+            # Being rewritten, or not a manifest; look again on the next scan
+            continue
+        if status == 'complete':
+            sessions.append((os.stat(manifest_path).st_mtime_ns, path))
+    return [path for _, path in sorted(sessions)]
+
+
+def read_status(results_dir):
+    """
+    A session's batch status record, or None.
+    """
+    try:
+        with open(os.path.join(results_dir, STATUS_NAME), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_status(results_dir, record):
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, STATUS_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _ignore_interrupt():
+    # Ctrl+C goes to the whole process group; the daemon lets running
+    # sessions finish instead of having the workers die mid-write
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def process_one(session_dir, results_dir, options):
+    """
+    Process one session and save its results. Runs in a worker process;
+    returns the list of files written.
+    """
+    from cultural_heritage_imaging.processing.cache import StageCache
+    from cultural_heritage_imaging.processing.pipeline import process_session, save_results
+
+    options = dict(options)
+    cache_dir = options.pop('cache_dir', None)
+    cache_bytes = options.pop('cache_bytes', 2 * 1024 ** 3)
+    store = options.pop('store', False)
+    normal_bits = options.pop('normal_bits', 8)
+    cache = StageCache(cache_dir, cache_bytes) if cache_dir else None
+    results = process_session(session_dir, cache=cache, **options)
+    height = results[2] if options.get('with_height') else None
+    return list(save_results(results[0], results[1], results_dir, height, store, normal_bits))
+
+
+class BatchProcessor:
+    def __init__(self, root, output_root=None, workers=2, poll_interval=10.0, retries=1,
+                 **options):
+        """
+        Process complete sessions under root with at most workers sessions at
+        once, scanning for new ones every poll_interval seconds. options are
+        passed to process_session (image_type, solver, with_height,
+        field_cache, ...) plus cache_dir and cache_bytes for a StageCache,
+        store to also write each session's maps.chs and normal_bits for
+        16-bit normal maps.
+        """
+        if workers < 1:
+            raise ValueError("Need at least one worker")
+        self.root = root
+        self.output_root = output_root
+        self.workers = int(workers)
+        self.poll_interval = float(poll_interval)
+        self.retries = int(retries)
+        self.options = options
+        self._running = {}
+        self._pool = None
+
+    def results_dir(self, session_dir):
+        if self.output_root is None:
+            return os.path.join(session_dir, RESULTS_DIR)
+        return os.path.join(self.output_root, os.path.basename(os.path.normpath(session_dir)))
+
+    def pending(self):
+        """
+        Complete sessions not yet processed (or whose manifest changed since),
+        and failed ones still within the retry limit, oldest first.
+        """
+        queue = []
+        for session_dir in find_sessions(self.root):
+            if session_dir in (running for running, _ in self._running.values()):
+                continue
+            manifest_time = os.stat(os.path.join(session_dir, MANIFEST_NAME)).st_mtime_ns
+            record = read_status(self.results_dir(session_dir))
+            if record is None or record.get('manifest') != manifest_time:
+                queue.append(session_dir)
+            elif record['status'] == 'running':
+                # Left over from a daemon that was stopped mid-session
+                queue.append(session_dir)
+            elif record['status'] == 'failed' and record.get('attempts', 0) <= self.retries:
+                queue.append(session_dir)
+        return queue
+
+    def _submit(self, session_dir):
+        results_dir = self.results_dir(session_dir)
+        manifest_time = os.stat(os.path.join(session_dir, MANIFEST_NAME)).st_mtime_ns
+        previous = read_status(results_dir) or {}
+        attempts = previous.get('attempts', 0) if previous.get('manifest') == manifest_time else 0
+        record = {
+            'session': os.path.abspath(session_dir),
+            'status': 'running',
+            'manifest': manifest_time,
+            'attempts': attempts + 1,
+            'started_at': time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime()),
+        }
+        write_status(results_dir, record)
+        print(f"Processing {session_dir}")
+        future = self._pool.submit(process_one, session_dir, results_dir, self.options)
+        self._running[future] = (session_dir, record)
+
+    def _collect(self, future):
+        session_dir, record = self._running.pop(future)
+        record['finished_at'] = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
+        try:
+            record['outputs'] = future.result()
+            record['status'] = 'done'
+            record.pop('error', None)
+            record.pop('traceback', None)
+            print(f"Done {session_dir}")
+        except Exception as ex:
+            record['status'] = 'failed'
+            record['error'] = f"{type(ex).__name__}: {ex}"
+            record['traceback'] = ''.join(traceback.format_exception(type(ex), ex, ex.__traceback__))
+            print(f"Failed {session_dir}: {ex}")
+        write_status(self.results_dir(session_dir), record)
+        return record['status'] == 'done'
+
+    def _new_pool(self):
+        return concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                                                      initializer=_ignore_interrupt)
+
+    def run(self, once=False):
+        """
+        Process sessions until interrupted, or with once until the sessions
+        present at start (and any that appear meanwhile) are drained.
+        Returns (done, failed) counts.
+        """
+        done = failed = 0
+        self._pool = self._new_pool()
+        try:
+            while True:
+                for session_dir in self.pending()[:self.workers - len(self._running)]:
+                    self._submit(session_dir)
+                if not self._running:
+                    if once:
+                        break
+                    time.sleep(self.poll_interval)
+                    continue
+                finished, _ = concurrent.futures.wait(
+                    list(self._running), timeout=None if once else self.poll_interval,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                broken = False
+                for future in finished:
+                    if self._collect(future):
+                        done += 1
+                    else:
+                        failed += 1
+                        broken |= isinstance(future.exception(),
+                                             concurrent.futures.process.BrokenProcessPool)
+                if broken:
+                    # A worker died (e.g. out of memory) and took the pool down with it
+                    for future in list(self._running):
+                        self._collect(future)
+                        failed += 1
+                    self._pool.shutdown(wait=False)
+                    self._pool = self._new_pool()
+        except KeyboardInterrupt:
+            print(f"\nStopping: waiting for {len(self._running)} running session(s)")
+            for future in concurrent.futures.as_completed(list(self._running)):
+                if self._collect(future):
+                    done += 1
+                else:
+                    failed += 1
+        finally:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        return done, failed
@@ -0,0 +1,167 @@
+"""
+Processing Stage Cache
+
+Each pipeline stage (load, correct, mask, solve, integrate) stores its
+output arrays under a key hashed from everything it depends on: the keys of
+its upstream stages and its own parameters. Raw frames enter the chain by a
+fingerprint of their path, size and modification time, in-memory arrays by
+a hash of their bytes. Changing the mask therefore reruns only the mask,
+solve and integrate stages, and changing only the export normalization
+reruns nothing.
+
+Entries are .npz files under the cache root. When the total size exceeds
+max_bytes the least recently used entries are evicted. Batch workers and
+the processing service share one root: entries are written to a unique
+temporary file and renamed into place, and an entry another process
+evicted or replaced in the meantime is simply a miss.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+
+def stage_key(stage, *parts):
+    """
+    Hash a stage name with its upstream keys and JSON-serializable parameters.
+    """
+    text = json.dumps([stage] + list(parts), sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def file_fingerprint(path):
+    """
+    Identity of a file on disk: absolute path, size and modification time.
+    """
+    if path is None or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def array_fingerprint(array):
+    """
+    Hash of an array's dtype, shape and contents, or None.
+    """
+    if array is None:
+        return None
+    array = np.ascontiguousarray(array)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{array.dtype.str}{array.shape}".encode())
+    digest.update(array.data)
+    return digest.hexdigest()
+
+
+class StageCache:
+    def __init__(self, root, max_bytes=2 * 1024 ** 3):
+        """
+        Cache stage outputs under root, keeping at most max_bytes on disk.
+        """
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.root, key + ".npz")
+
+    def get(self, key):
+        """
+        Return the cached arrays for key as a dict, or None.
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+            # Touch the entry so eviction sees it as recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays
+
+    def put(self, key, **arrays):
+        """
+        Store named arrays under key, then evict old entries over the size limit.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(key)
+        fd, tmp_path = tempfile.mkstemp(prefix=key + ".", suffix=".tmp", dir=self.root)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+        except OSError:
+            # Another process holding the same entry open (Windows cannot
+            # replace it) has already stored these arrays
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if not os.path.exists(path):
+                raise
+        self.evict()
+
+    def evict(self):
+        """
+        Delete least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    # Evicted by another process since the listing
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def size(self):
+        """
+        Bytes currently used by cache entries.
+        """
+        if not os.path.isdir(self.root):
+            return 0
+        total = 0
+        for name in os.listdir(self.root):
+            if name.endswith(".npz"):
+                try:
+                    total += os.path.getsize(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def clear(self):
+        if os.path.isdir(self.root):
+            for name in os.listdir(self.root):
+                if name.endswith(".npz"):
+                    try:
+                        os.remove(os.path.join(self.root, name))
+                    except FileNotFoundError:
+                        pass
+
+
+def cached_stage(cache, stage, key, compute):
+    """
+    Return compute()'s dict of arrays for a stage, reusing the cached entry for key.
+    """
+    if cache is None:
+        return compute()
+    arrays = cache.get(key)
+    if arrays is not None:
+        print(f"Reusing cached {stage} stage")
+        return arrays
+    arrays = compute()
+    cache.put(key, **arrays)
+    return arrays
@@ -0,0 +1,162 @@
+"""
+Color Photometric Stereo
+
+Color cameras are captured as raw Bayer mosaics (see pixels.bayer_pattern),
+one of R, G or B per pixel. Each frame is turned into luminance,
+(R + G + B) / 3, and the usual single-channel solve runs on that, so the
+three channels share one normal and the solve costs the same as mono.
+
+Per-channel albedo follows from the shared normal: under the Lambertian
+model channel c of every frame is albedo_c times the same shading, so the
+ratio of a pixel's channel sums over the whole sequence is the ratio of its
+albedos, whatever the lights, flat field or intensity normalization did to
+the shading. The mosaics are therefore only summed while the frames load,
+and that one sum is demosaiced at the end to split the luminance albedo
+into R, G and B.
+
+    bilinear    full resolution; a missing color is the mean of the nearest
+                pixels of that color (left and right, above and below, all
+                four, or the four diagonals)
+    superpixel  half resolution; each 2 x 2 cell becomes one pixel from its
+                R, B and the mean of its two G, with no interpolation. A
+                quarter of the pixels to solve, so faster than mono.
+
+Both work on the four phases of the pattern (every other row and column)
+with array slices.
+"""
+
+import numpy as np
+
+DEMOSAIC_MODES = ('bilinear', 'superpixel')
+PATTERNS = ('RGGB', 'GRBG', 'GBRG', 'BGGR')
+
+
+def _check(pattern, mode):
+    if pattern not in PATTERNS:
+        raise ValueError(f"Unknown Bayer pattern {pattern!r}, expected one of {PATTERNS}")
+    if mode not in DEMOSAIC_MODES:
+        raise ValueError(f"Unknown demosaic mode {mode!r}, expected one of {DEMOSAIC_MODES}")
+
+
+def output_shape(shape, mode='bilinear'):
+    """
+    (H, W) of the color image demosaiced from a mosaic of the given shape.
+    """
+    height, width = shape[:2]
+    if mode == 'superpixel':
+        return height // 2, width // 2
+    return height, width
+
+
+def _phases(mosaic):
+    # Views of the mosaic at one phase, shifted by (dy, dx) pixels; edges
+    # are mirrored, which keeps every pixel on its own color
+    height, width = mosaic.shape
+    padded = np.pad(mosaic, 1, mode='reflect')
+
+    def at(row, col, dy=0, dx=0):
+        return padded[1 + row + dy:1 + height + dy:2, 1 + col + dx:1 + width + dx:2]
+    return at
+
+
+def _cells(mosaic, mode):
+    # The four sites of every whole 2 x 2 cell, by (row, col) in the pattern
+    height, width = output_shape(mosaic.shape, mode)
+    return {(row, col): mosaic[row:2 * height:2, col:2 * width:2] for row in (0, 1) for col in (0, 1)}
+
+
+def demosaic(mosaic, pattern, mode='bilinear'):
+    """
+    (H, W, 3) float32 RGB image of a linear mosaic with the given pattern
+    ('RGGB', ...), at half resolution with mode='superpixel'.
+    """
+    _check(pattern, mode)
+    mosaic = np.asarray(mosaic, dtype=np.float32)
+    out = np.empty(output_shape(mosaic.shape, mode) + (3,), dtype=np.float32)
+    if mode == 'superpixel':
+        cells = _cells(mosaic, mode)
+        for channel, color in enumerate('RGB'):
+            sites = [cells[site] for site in cells if pattern[2 * site[0] + site[1]] == color]
+            if len(sites) == 2:
+                np.add(sites[0], sites[1], out=out[..., channel])
+                out[..., channel] *= np.float32(0.5)
+            else:
+                out[..., channel] = sites[0]
+        return out
+    at = _phases(mosaic)
+    for row in (0, 1):
+        for col in (0, 1):
+            for channel, color in enumerate('RGB'):
+                sites = [(r, c) for r in (0, 1) for c in (0, 1) if pattern[2 * r + c] == color]
+                if (row, col) in sites:
+                    out[row::2, col::2, channel] = at(row, col)
+                    continue
+                offsets = []
+                for r, c in sites:
+                    if r == row:
+                        offsets += [(0, -1), (0, 1)]
+                    elif c == col:
+                        offsets += [(-1, 0), (1, 0)]
+                    else:
+                        offsets += [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+                total = at(row, col, *offsets[0]) + at(row, col, *offsets[1])
+                for offset in offsets[2:]:
+                    total += at(row, col, *offset)
+                total *= np.float32(1.0 / len(offsets))
+                out[row::2, col::2, channel] = total
+    return out
+
+
+def luminance(mosaic, pattern, mode='bilinear', out=None):
+    """
+    (R + G + B) / 3 of the demosaiced image as an (H, W) array, without
+    building the color image; out may be float16.
+    """
+    _check(pattern, mode)
+    mosaic = np.asarray(mosaic, dtype=np.float32)
+    if out is None:
+        out = np.empty(output_shape(mosaic.shape, mode), dtype=np.float32)
+    if mode == 'superpixel':
+        # R and B count a third each, the two G a sixth each
+        total = None
+        for (row, col), site in _cells(mosaic, mode).items():
+            weight = np.float32(1 / 6 if pattern[2 * row + col] == 'G' else 1 / 3)
+            total = site * weight if total is None else np.add(total, site * weight, out=total)
+        out[...] = total
+        return out
+    at = _phases(mosaic)
+    for row in (0, 1):
+        for col in (0, 1):
+            around = at(row, col, 0, -1) + at(row, col, 0, 1)
+            around += at(row, col, -1, 0)
+            around += at(row, col, 1, 0)
+            if pattern[2 * row + col] == 'G':
+                # The other two colors are a pair each along the row and the column
+                around *= np.float32(0.5)
+            else:
+                # G are the four sides, the other color the four corners
+                around += at(row, col, -1, -1)
+                around += at(row, col, -1, 1)
+                around += at(row, col, 1, -1)
+                around += at(row, col, 1, 1)
+                around *= np.float32(0.25)
+            around += at(row, col)
+            around *= np.float32(1.0 / 3.0)
+            out[row::2, col::2] = around
+    return out
+
+
+def color_albedo(albedo, mosaic_sum, pattern, mode='bilinear'):
+    """
+    (H, W, 3) float32 RGB albedo from the (H, W) albedo solved on luminance
+    and the sum of the sequence's linear mosaics: each channel's share of
+    the summed color, times the luminance albedo.
+    """
+    rgb = demosaic(mosaic_sum, pattern, mode)
+    level = rgb.sum(axis=2)
+    level *= np.float32(1.0 / 3.0)
+    lit = level > 0
+    np.divide(rgb, level[..., None], out=rgb, where=lit[..., None])
+    rgb[~lit] = 0
+    rgb *= np.asarray(albedo, dtype=np.float32)[..., None]
+    return rgb
@@ -0,0 +1,208 @@
+"""
+Result Export
+
+Turns solved normals and albedo into image files without a display. Each
+map gets a fixed encoding rather than a per-image min/max stretch, so
+exports of different objects can be compared and normal maps can be
+loaded by renderers:
+
+    normals    the standard normal map encoding: each component mapped
+               from [-1, 1] to [0, 255] (or [0, 65535] for 16 bits) and
+               stored as R, G, B = x, y (up), z (towards the camera)
+    albedo     linear, with the 99.9th percentile (estimated on a strided
+               sample) at 255 unless a scale is given; (H, W, 3) RGB albedo
+               from color frames is saved in color, one scale for all three
+               channels so hues are kept
+    curvature  mean curvature, half the divergence of the normals' x and y
+               components per pixel, through tanh so flat is 128, convex
+               brighter and concave darker
+    slope      angle between the normal and the view axis, 0 to 90 degrees
+               from black to white
+
+Pixels outside the mask (zero normals) are black in every view. The views
+are rendered in one pass over the arrays: rows are taken in chunks of
+about CHUNK_BYTES of normals, so the inputs of a chunk are still in cache
+while each view is computed from them, with one row of halo above and
+below for the curvature derivatives. The encoded images are then written
+on a thread pool; PNG and TIFF encoders release the GIL.
+"""
+
+import concurrent.futures
+import os
+
+import numpy as np
+
+from cultural_heritage_imaging import instrument
+from cultural_heritage_imaging.processing import io
+
+VIEWS = ('normals', 'albedo', 'curvature', 'slope')
+# File each view is saved to
+VIEW_FILES = {'normals': 'normal_map.png', 'albedo': 'albedo.png', 'curvature': 'curvature.png',
+              'slope': 'slope.png'}
+# Normals per chunk of rows, in bytes of float32 input
+CHUNK_BYTES = 512 * 1024
+# Gain on curvature (1/pixels): 0.1 per pixel lands about 3/4 of the way to white
+CURVATURE_SCALE = 10.0
+# Images written at once
+WORKERS = 4
+
+
+def albedo_level(albedo, step=4):
+    """
+    Albedo mapped to full scale: the 99.9th percentile of the valid pixels
+    on every step-th row and column.
+    """
+    sample = np.asarray(albedo)[::step, ::step]
+    sample = sample[sample > 0]
+    if not sample.size:
+        return 1.0
+    level = float(np.percentile(sample, 99.9))
+    return level if level > 0 else 1.0
+
+
+def encode_normals(normals, bits=8):
+    """
+    Standard normal map of (H, W, 3) unit normals as a BGR image for OpenCV
+    (so files read as RGB = x, y, z), uint8 or with bits=16 uint16.
+    """
+    return render_views(normals, None, bits, views=('normals',))['normals']
+
+
+def _difference(values, axis, out):
+    # Central differences along axis, one-sided at the ends, like np.gradient
+    # but written into out without temporaries
+    size = values.shape[axis]
+    if size < 2:
+        out[...] = 0
+        return out
+
+    def take(start, stop):
+        return (slice(None),) * axis + (slice(start, stop),)
+
+    np.subtract(values[take(2, None)], values[take(None, -2)], out=out[take(1, -1)])
+    out[take(1, -1)] *= np.float32(0.5)
+    np.subtract(values[take(1, 2)], values[take(0, 1)], out=out[take(0, 1)])
+    np.subtract(values[take(size - 1, size)], values[take(size - 2, size - 1)], out=out[take(size - 1, size)])
+    return out
+
+
+def _inside(normals, albedo):
+    # Pixels with a solved normal; the solvers zero both maps outside the mask
+    if albedo is not None and albedo.ndim == 2:
+        return albedo > 0
+    return (normals[..., 0] != 0) | (normals[..., 1] != 0) | (normals[..., 2] != 0)
+
+
+def _chunk(normals, albedo, start, stop, out, top, albedo_gain, curvature_scale):
+    height = normals.shape[0]
+    n = normals[start:stop]
+    # 0 or 1 per pixel; multiplying by it is much cheaper than boolean indexing
+    valid = _inside(n, None if albedo is None else albedo[start:stop]).astype(np.float32)
+
+    target = out.get('normals')
+    if target is not None:
+        encoded = n + np.float32(1)
+        encoded *= np.float32(top / 2.0)
+        encoded += np.float32(0.5)
+        encoded *= valid[..., None]
+        # Reversed channels: OpenCV writes BGR
+        np.copyto(target[start:stop], encoded[..., ::-1], casting='unsafe')
+
+    target = out.get('albedo')
+    if target is not None:
+        level = albedo[start:stop] * np.float32(albedo_gain)
+        np.clip(level, 0, 255, out=level)
+        level += np.float32(0.5)
+        # Reversed channels for color: OpenCV writes BGR
+        np.copyto(target[start:stop], level[..., ::-1] if level.ndim == 3 else level, casting='unsafe')
+
+    target = out.get('slope')
+    if target is not None:
+        slope = np.clip(n[..., 2], -1, 1)
+        np.arccos(slope, out=slope)
+        slope *= np.float32(255.0 / (np.pi / 2))
+        np.clip(slope, 0, 255, out=slope)
+        slope += np.float32(0.5)
+        slope *= valid
+        np.copyto(target[start:stop], slope, casting='unsafe')
+
+    target = out.get('curvature')
+    if target is not None:
+        low, high = max(start - 1, 0), min(stop + 1, height)
+        rows = slice(start - low, stop - low)
+        block = normals[low:high]
+        # Image rows count down, normal y points up
+        down = _difference(block[..., 1], 0, np.empty(block.shape[:2], dtype=np.float32))[rows]
+        divergence = _difference(n[..., 0], 1, np.empty(n.shape[:2], dtype=np.float32))
+        divergence -= down
+        divergence *= np.float32(0.5 * curvature_scale)
+        np.tanh(divergence, out=divergence)
+        divergence *= np.float32(127.5)
+        divergence += np.float32(128.0)
+        np.clip(divergence, 0, 255, out=divergence)
+        # Differences across the mask edge are not curvature
+        inside = _inside(block, None if albedo is None else albedo[low:high])
+        keep = inside[rows].copy()
+        keep[:, 1:] &= inside[rows, :-1]
+        keep[:, :-1] &= inside[rows, 1:]
+        keep[1:] &= inside[rows.start:rows.stop - 1]
+        keep[:-1] &= inside[rows.start + 1:rows.stop]
+        if rows.start > 0:
+            keep[0] &= inside[rows.start - 1]
+        if rows.stop < len(inside):
+            keep[-1] &= inside[rows.stop]
+        divergence *= keep
+        np.copyto(target[start:stop], divergence, casting='unsafe')
+
+
+def render_views(normals, albedo, bits=8, albedo_scale=None, curvature_scale=CURVATURE_SCALE,
+                 views=VIEWS, chunk_bytes=CHUNK_BYTES):
+    """
+    Encode (H, W, 3) unit normals and an (H, W) or (H, W, 3) RGB albedo map
+    into 8-bit views (the normal map with bits=16 is uint16), in one chunked
+    pass. Returns a dict by view name (see VIEWS); color albedo is BGR like
+    the normal map. albedo_scale is the albedo shown as white (default:
+    albedo_level).
+    """
+    unknown = set(views) - set(VIEWS)
+    if unknown:
+        raise ValueError(f"Unknown views {sorted(unknown)}, expected some of {VIEWS}")
+    if bits not in (8, 16):
+        raise ValueError(f"Normal maps are 8 or 16 bits, got {bits}")
+    normals = np.asarray(normals, dtype=np.float32)
+    height, width = normals.shape[:2]
+    if 'albedo' in views:
+        albedo = np.asarray(albedo, dtype=np.float32)
+        if albedo_scale is None:
+            albedo_scale = albedo_level(albedo)
+    albedo_gain = 255.0 / albedo_scale if albedo_scale else 0.0
+    out = {}
+    for view in views:
+        if view == 'normals':
+            out[view] = np.empty((height, width, 3), dtype=np.uint8 if bits == 8 else np.uint16)
+        elif view == 'albedo':
+            out[view] = np.empty(albedo.shape, dtype=np.uint8)
+        else:
+            out[view] = np.empty((height, width), dtype=np.uint8)
+    rows = max(chunk_bytes // max(width * 3 * 4, 1), 1)
+    with instrument.span('export.render', views=len(views)):
+        for start in range(0, height, rows):
+            _chunk(normals, albedo, start, min(start + rows, height), out, 2 ** bits - 1,
+                   albedo_gain, curvature_scale)
+    return out
+
+
+def write_images(images, output_dir=".", workers=WORKERS):
+    """
+    Write {file name: image} into output_dir on a pool of threads. Returns
+    the paths in the order given.
+    """
+    paths = [os.path.join(output_dir, name) for name in images]
+    os.makedirs(output_dir, exist_ok=True)
+    with instrument.span('export.write', files=len(paths)):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(min(workers, len(paths)), 1)) as pool:
+            # Surface the first failure after every write has been attempted
+            for future in [pool.submit(io.write_image, path, image)
+                           for path, image in zip(paths, images.values())]:
+                future.result()
+    return paths
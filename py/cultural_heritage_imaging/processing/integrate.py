@@ -0,0 +1,65 @@
+"""
+Height From Normals
+
+Integrates a normal map into a relative height map with the Frankot-Chellappa
+method: the surface gradients p = dz/dx and q = dz/dy are projected onto the
+nearest integrable surface in the Fourier domain, which is one FFT forward
+and one back regardless of image size. Heights are in pixel units up to an
+unknown offset; the result is shifted so the lowest valid pixel is 0. The
+transforms stay in complex64 and the frequency grids are broadcast rather
+than expanded, so integration needs a few frames of memory, not a few
+frames of complex128.
+"""
+
+import numpy as np
+
+
+def gradients(normals, mask=None):
+    """
+    Surface gradients (p, q) as float32 from (H, W, 3) unit normals, in image
+    axes: p along columns (x), q along rows (down). Pixels outside the mask, or
+    with a normal facing away from the camera, have zero gradient.
+    """
+    normals = np.asarray(normals, dtype=np.float32)
+    nx, ny, nz = normals[..., 0], normals[..., 1], normals[..., 2]
+    valid = nz > 1e-3
+    if mask is not None:
+        valid &= np.asarray(mask) > 0
+    p = np.zeros(nz.shape, dtype=np.float32)
+    q = np.zeros(nz.shape, dtype=np.float32)
+    np.divide(-nx, nz, out=p, where=valid)
+    # Light directions have y pointing up, image rows count downwards
+    np.divide(ny, nz, out=q, where=valid)
+    return p, q
+
+
+def frankot_chellappa(normals, mask=None):
+    """
+    (H, W) float32 height map integrated from unit normals.
+    """
+    p, q = gradients(normals, mask)
+    height, width = p.shape
+    u = (np.fft.fftfreq(width) * (2 * np.pi)).astype(np.float32)[None, :]
+    v = (np.fft.fftfreq(height) * (2 * np.pi)).astype(np.float32)[:, None]
+    # NumPy 2 keeps float32 transforms in complex64
+    z_hat = np.fft.fft2(p)
+    del p
+    z_hat *= -1j * u
+    q_hat = np.fft.fft2(q)
+    del q
+    q_hat *= -1j * v
+    z_hat += q_hat
+    del q_hat
+    denominator = u * u + v * v
+    denominator[0, 0] = 1.0
+    z_hat /= denominator
+    z_hat[0, 0] = 0
+    z = np.fft.ifft2(z_hat).real.astype(np.float32)
+    if mask is not None:
+        valid = np.asarray(mask) > 0
+        if valid.any():
+            z -= z[valid].min()
+        z[~valid] = 0
+    else:
+        z -= z.min()
+    return z
@@ -0,0 +1,70 @@
+"""
+Image, Mask and Light Matrix I/O
+
+Reads the frames, masks and LightMatrix.yml files used by photometric stereo
+and writes the resulting maps. OpenCV and tifffile are loaded on first use.
+"""
+
+import os
+
+import numpy as np
+
+from cultural_heritage_imaging._optional import lazy_import
+
+cv = lazy_import('cv2', "opencv-python")
+tifffile = lazy_import('tifffile')
+
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+
+
+def read_image(path):
+    """
+    Read an image as a single-channel array, or None if it cannot be read.
+    TIFFs keep their bit depth; other formats are read as 8-bit grayscale.
+    """
+    if not os.path.exists(path):
+        return None
+    if os.path.splitext(path)[1].lower() in TIFF_EXTENSIONS:
+        image = tifffile.imread(path)
+        if image.ndim == 3:
+            image = cv.cvtColor(image, cv.COLOR_RGB2GRAY)
+        return image
+    return cv.imread(path, cv.IMREAD_GRAYSCALE)
+
+
+def load_light_matrix(path):
+    """
+    Load the 'Lights' matrix (one direction per row) from a LightMatrix.yml file.
+    """
+    fs = cv.FileStorage(path, cv.FILE_STORAGE_READ)
+    if not fs.isOpened():
+        raise ValueError(f"{path} cannot be opened.")
+    light_mat = fs.getNode("Lights").mat()
+    fs.release()
+    return np.asarray(light_mat)
+
+
+def load_mask(path, shape):
+    """
+    Load a mask image, falling back to an all-valid mask if it cannot be read.
+    """
+    mask = read_image(path)
+    if mask is None:
+        print(f"Warning: Mask {path} cannot be read, using the whole image.")
+        mask = np.ones(shape, dtype=np.uint8)
+    return np.asarray(mask, dtype=np.uint8)
+
+
+def write_image(path, image):
+    """
+    Write an image, creating the directory if needed. TIFFs are written with
+    tifffile and keep their dtype (e.g. float32); other formats use OpenCV.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if os.path.splitext(path)[1].lower() in TIFF_EXTENSIONS:
+        tifffile.imwrite(path, image)
+        return
+    if not cv.imwrite(path, image):
+        raise OSError(f"Failed to write {path}")
@@ -0,0 +1,187 @@
+"""
+Near-Field Photometric Stereo
+
+With the LEDs close to the object, each pixel sees every light from its own
+direction and distance, and a distant-light solve reads the difference as a
+low-frequency tilt across large flat objects. The near-field model places
+the pixels on the object plane (z = 0, scaled by the camera's mm per pixel)
+and the lights at their rig positions, and precomputes per pixel
+
+    A_k = (r_k(centre) / r_k)^2 * l_k
+
+the unit direction to light k weighted by its inverse-square falloff,
+normalized to 1 at the frame centre so albedo stays on the distant-light
+scale. The least-squares solve I_k = A_k . g is then the same for every
+stack taken with this rig and camera setup, so its per-pixel pseudo-inverse
+(3 x K) is computed once, cached, and applied to each stack in row bands.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+# Rows of pixels processed per band when building fields and solving
+CHUNK_ROWS = 256
+
+# In-memory cache of recently used models, keyed by their setup hash
+_MODEL_CACHE = collections.OrderedDict()
+_MODEL_CACHE_SIZE = 2
+
+
+class NearFieldModel:
+    def __init__(self, positions, shape, mm_per_pixel, center=None):
+        """
+        positions is a K x 3 array of light positions in mm, shape the (H, W)
+        frame shape, and center the optical centre (x, y) in pixels (default:
+        the frame centre).
+        """
+        self.positions = np.asarray(positions, dtype=np.float64)
+        if self.positions.ndim != 2 or self.positions.shape[1] != 3 or len(self.positions) < 3:
+            raise ValueError("Near-field processing needs at least 3 light positions (K x 3)")
+        if np.any(self.positions[:, 2] <= 0):
+            raise ValueError("Lights must be above the object plane (z > 0)")
+        self.shape = tuple(int(n) for n in shape)
+        self.mm_per_pixel = float(mm_per_pixel)
+        height, width = self.shape
+        if center is None:
+            center = ((width - 1) / 2.0, (height - 1) / 2.0)
+        self.center = (float(center[0]), float(center[1]))
+        self._pinv = None
+
+    @property
+    def key(self):
+        """
+        Hash of the setup: light positions, frame shape, scale and centre.
+        """
+        setup = {'positions': np.round(self.positions, 6).tolist(), 'shape': self.shape,
+                 'mm_per_pixel': self.mm_per_pixel, 'center': self.center}
+        return hashlib.sha1(json.dumps(setup, sort_keys=True).encode()).hexdigest()[:16]
+
+    def light_fields(self, rows=None):
+        """
+        (K, 3, h, W) float32 falloff-weighted light directions A_k for a band of
+        rows (default: the whole frame).
+        """
+        height, width = self.shape
+        rows = range(height)[rows] if isinstance(rows, slice) else range(height)
+        cx, cy = self.center
+        x = ((np.arange(width) - cx) * self.mm_per_pixel)[None, :]
+        y = ((cy - np.asarray(rows, dtype=np.float64)) * self.mm_per_pixel)[:, None]
+        fields = np.empty((len(self.positions), 3, len(rows), width), dtype=np.float32)
+        for k, (px, py, pz) in enumerate(self.positions):
+            dx = px - x
+            dy = py - y
+            r2 = dx * dx + dy * dy + pz * pz
+            # (r0 / r)^2 / r scales the offset to a unit vector with inverse-square falloff
+            weight = (px * px + py * py + pz * pz) / (r2 * np.sqrt(r2))
+            fields[k, 0] = dx * weight
+            fields[k, 1] = dy * weight
+            fields[k, 2] = pz * weight
+        return fields
+
+    def pseudo_inverse(self):
+        """
+        (H, W, 3, K) float32 per-pixel pseudo-inverse of the light fields, computed once.
+        """
+        if self._pinv is not None:
+            return self._pinv
+        height, width = self.shape
+        count = len(self.positions)
+        pinv = np.empty((height, width, 3, count), dtype=np.float32)
+        for start in range(0, height, CHUNK_ROWS):
+            band = slice(start, min(start + CHUNK_ROWS, height))
+            # (h, W, K, 3) per-pixel light matrices
+            a = np.moveaxis(self.light_fields(band), (0, 1), (2, 3)).astype(np.float64)
+            normal_matrix = np.einsum('hwki,hwkj->hwij', a, a)
+            pinv[band] = np.linalg.solve(normal_matrix, np.swapaxes(a, 2, 3))
+        self._pinv = pinv
+        return pinv
+
+    def solve(self, images, mask=None):
+        """
+        Solve for unit normals (H, W, 3) and albedo (H, W) from a (K, H, W)
+        stack, in row bands against the cached pseudo-inverse. Pixels outside
+        the mask are zero. Bands are converted to float32 as they are solved,
+        so a float16 or integer stack is not copied whole.
+        """
+        stack = np.asarray(images)
+        count = len(self.positions)
+        if stack.shape != (count,) + self.shape:
+            raise ValueError(f"Stack of shape {stack.shape} does not match the near-field model "
+                             f"({count} lights, frames of {self.shape})")
+        pinv = self.pseudo_inverse()
+        height, width = self.shape
+        normals = np.empty((height, width, 3), dtype=np.float32)
+        albedo = np.empty((height, width), dtype=np.float32)
+        for start in range(0, height, CHUNK_ROWS):
+            band = slice(start, min(start + CHUNK_ROWS, height))
+            scaled = np.einsum('hwjk,khw->hwj', pinv[band], stack[:, band].astype(np.float32, copy=False))
+            norm = np.linalg.norm(scaled, axis=2)
+            albedo[band] = norm
+            np.divide(scaled, norm[..., None], out=normals[band], where=norm[..., None] > 0)
+            normals[band][norm == 0] = 0
+        if mask is not None:
+            valid = np.asarray(mask) > 0
+            normals[~valid] = 0
+            albedo[~valid] = 0
+        return normals, albedo
+
+
+def _save_field(cache_dir, path, pinv):
+    # Batch workers on one rig may all miss the cache at once: each writes
+    # its own temporary file and renames it into place, so readers only ever
+    # see a whole file and the last rename wins with identical contents
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, pinv)
+        os.replace(tmp_path, path)
+    except OSError:
+        # Lost the race to a writer whose file is already in use (Windows
+        # cannot replace a mapped file); that file holds the same field
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if not os.path.exists(path):
+            raise
+
+
+def near_field_model(rig, indices, shape, center=None, cache_dir=None, pixel_size=1):
+    """
+    NearFieldModel for the given rig lights and frame shape, reused across
+    calls with the same setup. center is in sensor pixels from the frame's
+    first pixel (default: the rig camera's, or the frame centre), and frame
+    pixels are pixel_size sensor pixels wide (2 for superpixel color). With
+    cache_dir the pseudo-inverse is also kept on disk and memory-mapped by
+    later processes.
+    """
+    if 'mm_per_pixel' not in rig.camera:
+        raise ValueError(f"Rig {rig.name} has no camera mm_per_pixel for near-field processing")
+    if center is None:
+        center = rig.camera.get('center')
+    if center is not None and pixel_size != 1:
+        # Frame pixel i covers sensor pixels pixel_size * i and up
+        offset = (pixel_size - 1) / 2.0
+        center = ((center[0] - offset) / pixel_size, (center[1] - offset) / pixel_size)
+    model = NearFieldModel(rig.light_positions(indices), shape, rig.camera['mm_per_pixel'] * pixel_size,
+                           center)
+    key = model.key
+    if key in _MODEL_CACHE:
+        _MODEL_CACHE.move_to_end(key)
+        return _MODEL_CACHE[key]
+
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, f"nearfield_{key}.npy")
+        try:
+            model._pinv = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            _save_field(cache_dir, path, model.pseudo_inverse())
+
+    _MODEL_CACHE[key] = model
+    while len(_MODEL_CACHE) > _MODEL_CACHE_SIZE:
+        _MODEL_CACHE.popitem(last=False)
+    return model
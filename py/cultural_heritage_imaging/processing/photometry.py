@@ -0,0 +1,74 @@
+"""
+Lambertian Photometric Stereo
+
+Solves for per-pixel surface normals and albedo from a stack of images taken
+under known distant light directions, by least squares over all lights at
+once. Only NumPy is required. The solve runs in float32 over bands of rows,
+so frames of any dtype (uint8 from OpenCV, float16) cost no more than a
+band of float32 temporaries on top of the stack.
+"""
+
+import numpy as np
+
+# Pixels solved at once; bounds the float32 copies of a band of the stack
+CHUNK_PIXELS = 1 << 18
+
+
+def lights_from_tilt_slant(tilts, slants):
+    """
+    Build a light matrix from tilt and slant angles in degrees, one light per row.
+    """
+    tilts = np.radians(np.asarray(tilts, dtype=np.float64))
+    slants = np.radians(np.asarray(slants, dtype=np.float64))
+    return np.stack([np.sin(slants) * np.cos(tilts),
+                     np.sin(slants) * np.sin(tilts),
+                     np.cos(slants)], axis=1)
+
+
+def tilt_slant_from_lights(light_mat):
+    """
+    Recover tilt and slant angles in degrees from a light matrix.
+    """
+    light_mat = np.asarray(light_mat, dtype=np.float64)
+    unit = light_mat / np.linalg.norm(light_mat, axis=1, keepdims=True)
+    tilts = np.degrees(np.arctan2(unit[:, 1], unit[:, 0]))
+    slants = np.degrees(np.arccos(np.clip(unit[:, 2], -1.0, 1.0)))
+    return tilts, slants
+
+
+def solve_normals(images, light_mat, mask=None, chunk_pixels=CHUNK_PIXELS):
+    """
+    Solve for surface normals and albedo.
+
+    images is a sequence of K equally sized grayscale frames and light_mat a
+    K x 3 matrix of light directions. Returns an (H, W, 3) array of unit
+    normals and an (H, W) albedo map, both float32; pixels outside the mask
+    are zero.
+    """
+    stack = np.asarray(images)
+    light_mat = np.asarray(light_mat, dtype=np.float64)
+    if stack.ndim != 3:
+        raise ValueError("images must be a sequence of equally sized 2-D frames")
+    count, height, width = stack.shape
+    if light_mat.shape != (count, 3):
+        raise ValueError(f"Light matrix must be {count} x 3 for {count} images, got {light_mat.shape}")
+
+    # Scaled normals G = pinv(L) @ I. The 3 x K pseudo-inverse is computed in
+    # float64 and applied in float32, so the stack is never promoted
+    pinv = np.linalg.pinv(light_mat).astype(np.float32)
+    normals = np.empty((height, width, 3), dtype=np.float32)
+    albedo = np.empty((height, width), dtype=np.float32)
+    rows = max(chunk_pixels // max(width, 1), 1)
+    for start in range(0, height, rows):
+        band = slice(start, min(start + rows, height))
+        block = stack[:, band].reshape(count, -1).astype(np.float32, copy=False)
+        scaled = pinv @ block
+        norm = np.sqrt(np.einsum('ij,ij->j', scaled, scaled))
+        albedo[band] = norm.reshape(-1, width)
+        scaled *= np.divide(1, norm, out=np.zeros_like(norm), where=norm > 0)
+        normals[band] = scaled.T.reshape(-1, width, 3)
+    if mask is not None:
+        valid = np.asarray(mask) > 0
+        normals[~valid] = 0
+        albedo[~valid] = 0
+    return normals, albedo
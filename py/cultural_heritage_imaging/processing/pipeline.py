@@ -0,0 +1,485 @@
+"""
+Photometric Stereo Pipeline
+
+Loads a folder of frames named <obj_name><index><ext> with its
+LightMatrix.yml and mask.bmp, or a captured session through its manifest
+and light rig, solves for normals and albedo (with distant lights, or
+near-field when the rig gives light positions), optionally integrates a
+height map, and saves the results as PNGs. This is the processing that
+example.py used to run inline; it is also available as ``chi process``.
+
+The work runs as a chain of stages:
+
+    load       decode the frames and scale them to linear float32 (or
+               float16, see below); Bayer mosaics from color cameras are
+               reduced to luminance and summed (see processing.color)
+    correct    subtract the master dark, divide by the flat field and
+               normalize light intensities
+    register   align the frames to the first one (only when asked for)
+    mask       read the mask
+    solve      normals and albedo (per-channel albedo for color frames)
+    integrate  height from the normals (only when asked for)
+
+With a StageCache (see processing.cache) each stage's output is stored under
+a hash of its inputs and parameters, so rerunning after changing only the
+mask skips decoding and correction, and changing only the export reruns
+nothing but the export.
+
+Everything runs in float32: frames are converted as they are decoded, and
+the solvers and integration never promote to float64, so the memory of a
+sequence is its (K, H, W) stack plus a few frame-sized maps. With
+precision='float16' the stack is held in half precision between stages
+(half the memory, about 3 significant digits) and converted back to
+float32 band by band where it is used. Run with instrument.enable(memory=True)
+(``chi process --memory``) to see the peak memory of each stage.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+from cultural_heritage_imaging import instrument, pixels
+from cultural_heritage_imaging.calibration.dark import subtract_dark
+from cultural_heritage_imaging.calibration.flat import divide_flat
+from cultural_heritage_imaging.calibration.intensity import IntensityCalibration, normalize_intensity
+from cultural_heritage_imaging.processing import color, io
+from cultural_heritage_imaging.processing.export import VIEW_FILES, render_views, write_images
+from cultural_heritage_imaging.processing.cache import (array_fingerprint, cached_stage,
+                                                        file_fingerprint, stage_key)
+from cultural_heritage_imaging.processing.integrate import frankot_chellappa
+from cultural_heritage_imaging.processing.nearfield import near_field_model
+from cultural_heritage_imaging.processing.photometry import solve_normals
+from cultural_heritage_imaging.processing.register import register_stack
+from cultural_heritage_imaging.processing.store import write_store
+from cultural_heritage_imaging.rig import LightRig
+from cultural_heritage_imaging.session import load_manifest
+
+
+# Light models process_session can use; 'auto' is near-field when the rig allows it
+SOLVERS = ('auto', 'distant', 'near')
+
+# Element types the frame stack can be held in between stages
+PRECISIONS = pixels.STACK_DTYPES
+
+# Per-session record of the shifts removed by registration
+REGISTRATION_NAME = "registration.json"
+
+
+def process_folder(folder, obj_name, count, ext=".tiff", light_mat=None, mask_path=None,
+                   bit_depth=None, dark=None, intensity_scales=None, model=None, flat_name=None,
+                   cache=None, with_height=False, register=False, precision='float32', bayer=None,
+                   demosaic='bilinear'):
+    """
+    Run photometric stereo on a folder of frames. Returns (normals, albedo),
+    or (normals, albedo, height) with with_height.
+
+    The light matrix is read from LightMatrix.yml in the folder unless given,
+    and the mask from mask.bmp unless another path is given. Frames are scaled
+    to linear float32 using bit_depth significant bits (default: their dtype),
+    after subtracting the master dark if one is given (in raw frame units),
+    divided by the flat-field frames <flat_name><index><ext> if flat_name is
+    given, and multiplied by their intensity_scales if given (see
+    calibration.intensity). A NearFieldModel given as model replaces the light
+    matrix. Stage outputs are reused from cache (a StageCache) if given. With
+    register, frames are aligned to the first one before solving and the
+    shifts are recorded in the folder's registration.json. precision is the
+    element type of the frame stack between stages (see PRECISIONS). Frames
+    that are raw color mosaics need their bayer pattern ('RGGB', ...); the
+    albedo is then (H, W, 3) RGB, demosaiced as demosaic (see
+    color.DEMOSAIC_MODES).
+    """
+    if not os.path.isdir(folder):
+        raise ValueError(f"Directory {folder} does not exist.")
+    paths = _existing_frames(folder, obj_name, count, ext)
+    if not paths:
+        raise ValueError(f"No images named {obj_name}<index>{ext} found in {folder}")
+    flat_paths = None
+    if flat_name is not None:
+        flat_paths = _existing_frames(folder, flat_name, count, ext)
+        if len(flat_paths) != len(paths):
+            raise ValueError(f"Found {len(flat_paths)} flat frames named {flat_name}<index>{ext} "
+                             f"for {len(paths)} frames in {folder}")
+
+    if light_mat is None and model is None:
+        light_mat_path = os.path.join(folder, "LightMatrix.yml")
+        print(f"Loading light matrix: {light_mat_path}")
+        with instrument.span('process.lights'):
+            light_mat = io.load_light_matrix(light_mat_path)
+
+    if mask_path is None:
+        mask_path = os.path.join(folder, "mask.bmp")
+    info = {}
+    results = _run_stages(paths, light_mat, mask_path, bit_depth, dark, intensity_scales, model,
+                          flat_paths, cache, with_height, register, info, precision=precision,
+                          bayer=bayer, demosaic=demosaic)
+    if register:
+        record_shifts(folder, obj_name, [os.path.basename(path) for path in paths], info['shifts'])
+    return results
+
+
+def _existing_frames(folder, obj_name, count, ext):
+    paths = []
+    for index in range(count):
+        path = os.path.join(folder, f"{obj_name}{index}{ext}")
+        if os.path.exists(path):
+            paths.append(path)
+        else:
+            print(f"Warning: Image {path} not found or cannot be read.")
+    return paths
+
+
+def session_frames(manifest, image_type='target', exposure=None, repeat=0):
+    """
+    Manifest entries of one light sequence, ordered by light index.
+
+    exposure defaults to the first one captured for the image type.
+    """
+    rig = LightRig.from_dict(manifest['spec']['rig']) if 'rig' in manifest['spec'] else LightRig.default()
+    frames = [frame for frame in manifest['frames']
+              if frame['image_type'] == image_type and frame['repeat'] == repeat]
+    if exposure is None and frames:
+        exposure = frames[0]['exposure']
+    frames = [frame for frame in frames if frame['exposure'] == exposure]
+    for frame in frames:
+        if 'light_index' not in frame:
+            frame['light_index'] = rig.index(frame['light'])
+    return sorted(frames, key=lambda frame: frame['light_index']), rig
+
+
+def process_session(session_dir, image_type='target', exposure=None, repeat=0, mask_path=None,
+                    dark=None, intensity=None, solver='auto', field_cache=None, use_flat=True,
+                    cache=None, with_height=False, register=False, precision='float32',
+                    demosaic='bilinear'):
+    """
+    Run photometric stereo on one light sequence of a captured session.
+    Returns (normals, albedo), or (normals, albedo, height) with with_height.
+
+    Frames are found through manifest.json and matched to light directions by
+    their index in the session's rig, so any number of lights works without a
+    LightMatrix.yml. The session's cached master dark is subtracted unless
+    another dark is given or the frames were ambient-subtracted at capture.
+    If the session also has a 'flat' sequence with the same exposure and
+    lights, frames are flat-field corrected with it (unless use_flat is False).
+    Light intensities are normalized with the IntensityCalibration given or
+    stored in the manifest, at the PWM level each frame was taken with.
+    solver is one of SOLVERS; near-field light fields are cached per rig and
+    frame shape, on disk under field_cache if given. Stage outputs are reused
+    from cache (a StageCache) if given. With register, frames are aligned to
+    the first light's before solving and the shifts are recorded in the
+    session's registration.json. Sessions captured with an ROI have their
+    full-frame dark and mask cropped to it, and near-field light positions
+    kept relative to the full sensor. precision is the element type of the
+    frame stack between stages (see PRECISIONS). Sessions captured in a
+    Bayer pixel format are processed in color: one normal per pixel and an
+    (H, W, 3) RGB albedo, demosaiced as demosaic (see color.DEMOSAIC_MODES).
+    """
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown solver {solver!r}, expected one of {SOLVERS}")
+    manifest = load_manifest(session_dir)
+    frames, rig = session_frames(manifest, image_type, exposure, repeat)
+    if len(frames) < 3:
+        raise ValueError(f"Need at least 3 {image_type} frames in {session_dir}, found {len(frames)}")
+    paths = [os.path.join(session_dir, frame['path']) for frame in frames]
+    for frame, path in zip(frames, paths):
+        if not os.path.exists(path):
+            raise ValueError(f"Frame {frame['path']} in {session_dir} cannot be read")
+
+    frame_exposure = frames[0]['exposure']
+    dark_path = manifest.get('darks', {}).get(str(frame_exposure))
+    if dark is None and dark_path and frames[0].get('ambient', 'off') == 'off':
+        # Relative paths are inside the session (see processing.service)
+        dark = io.read_image(os.path.join(session_dir, dark_path))
+    roi = manifest.get('roi')
+    if dark is not None:
+        dark = _crop_to_roi(dark, roi)
+    # An ROI at an odd offset starts on another phase of the color filter
+    bayer = pixels.bayer_pattern(manifest['spec'].get('pixel_format', 'Mono8'),
+                                 *((roi['x'], roi['y']) if roi else (0, 0)))
+
+    indices = [frame['light_index'] for frame in frames]
+    flat_paths = None
+    if use_flat and image_type != 'flat':
+        flats, _ = session_frames(manifest, 'flat', frame_exposure)
+        if [flat['light_index'] for flat in flats] == indices:
+            print("Flat-field correcting with the session's flat frames")
+            flat_paths = [os.path.join(session_dir, flat['path']) for flat in flats]
+
+    if intensity is None and 'intensity' in manifest:
+        intensity = IntensityCalibration.from_dict(manifest['intensity'])
+    scales = None
+    if intensity is not None:
+        scales = intensity.scales(indices, [frame.get('pwm', intensity.levels[-1]) for frame in frames])
+
+    light_mat = model = None
+    if solver == 'near' or (solver == 'auto' and rig.near_field):
+        shape = io.read_image(paths[0]).shape
+        center = None
+        if roi is not None:
+            # The optical centre is a point on the sensor, not in the crop
+            sensor_width, sensor_height = roi['sensor']
+            full_center = rig.camera.get('center') or ((sensor_width - 1) / 2.0, (sensor_height - 1) / 2.0)
+            center = (full_center[0] - roi['x'], full_center[1] - roi['y'])
+        pixel_size = 1
+        if bayer is not None:
+            shape = color.output_shape(shape, demosaic)
+            pixel_size = 2 if demosaic == 'superpixel' else 1
+        with instrument.span('process.lights', solver='near'):
+            model = near_field_model(rig, indices, shape, center=center, cache_dir=field_cache,
+                                     pixel_size=pixel_size)
+    else:
+        light_mat = rig.light_matrix(indices)
+    if mask_path is None:
+        mask_path = os.path.join(session_dir, "mask.bmp")
+    info = {}
+    results = _run_stages(paths, light_mat, mask_path, manifest.get('bit_depth'), dark, scales, model,
+                          flat_paths, cache, with_height, register, info, roi, precision, bayer,
+                          demosaic)
+    if register:
+        sequence = f"{image_type}_exp{frame_exposure:g}s_r{repeat}"
+        record_shifts(session_dir, sequence, [frame['light'] for frame in frames], info['shifts'])
+    return results
+
+
+def record_shifts(directory, sequence, names, shifts):
+    """
+    Store the registration shifts of one light sequence, by frame or light
+    name, in <directory>/registration.json next to the other sequences'.
+    """
+    path = os.path.join(directory, REGISTRATION_NAME)
+    try:
+        with open(path, 'r') as f:
+            registration = json.load(f)
+    except (OSError, ValueError):
+        registration = {}
+    registration[sequence] = {
+        'reference': names[0],
+        'shifts': {name: [round(float(dx), 3), round(float(dy), 3)] for name, (dx, dy) in zip(names, shifts)},
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(registration, f, indent=2)
+    os.replace(tmp_path, path)
+    moved = sum(1 for dx, dy in shifts if dx or dy)
+    print(f"Registered {sequence}: {moved} of {len(names)} frames shifted, written to {path}")
+    return path
+
+
+def _crop_to_roi(image, roi):
+    """
+    The part of a full-sensor image (dark, mask) inside a manifest ROI record;
+    images already the size of the ROI, or without one, are returned as is.
+    """
+    if roi is None or image.shape[:2] != (roi['sensor'][1], roi['sensor'][0]):
+        return image
+    return image[roi['y']:roi['y'] + roi['height'], roi['x']:roi['x'] + roi['width']]
+
+
+def _read_stack(paths, bit_depth, dtype='float32', bayer=None, demosaic='bilinear'):
+    # Each frame is scaled into the stack as soon as it is decoded, so only
+    # one decoded frame is held besides the stack. Color mosaics go in as
+    # luminance, and their sum is kept for the per-channel albedo
+    stack = bits = mosaic = linear = None
+    with instrument.span('process.load', count=len(paths)):
+        for index, path in enumerate(paths):
+            print(f"Loading image: {path}")
+            image = io.read_image(path)
+            if image is None:
+                raise ValueError(f"Image {path} cannot be read")
+            if stack is None:
+                bits = bit_depth or pixels.default_bits(image.dtype)
+                shape = image.shape if bayer is None else color.output_shape(image.shape, demosaic)
+                stack = np.empty((len(paths),) + shape, dtype=dtype)
+                if bayer is not None:
+                    mosaic = np.zeros(image.shape, dtype=np.float32)
+                    linear = np.empty(image.shape, dtype=np.float32)
+                first_shape = image.shape
+            elif image.shape != first_shape:
+                raise ValueError(f"Image {path} is {image.shape}, expected {first_shape}")
+            if bayer is None:
+                pixels.to_linear_float32(image, bits, out=stack[index])
+                continue
+            pixels.to_linear_float32(image, bits, out=linear)
+            mosaic += linear
+            with instrument.span('process.demosaic'):
+                color.luminance(linear, bayer, demosaic, out=stack[index])
+    if bayer is None:
+        return {'stack': stack, 'bits': np.array(bits or 0)}
+    return {'stack': stack, 'bits': np.array(bits or 0), 'mosaic': mosaic}
+
+
+def _run_stages(paths, light_mat, mask_path, bit_depth, dark, intensity_scales, model,
+                flat_paths=None, cache=None, with_height=False, register=False, info=None, roi=None,
+                precision='float32', bayer=None, demosaic='bilinear'):
+    """
+    Run the stage chain on frame paths, pulling each stage from cache when its
+    key matches. Keys are only computed when there is a cache. With register,
+    the (K, 2) shifts removed from the frames are put in the info dict. A
+    full-sensor mask is cropped to roi (a manifest ROI record) if given. The
+    frame stack is held as precision (one of PRECISIONS). Frames are color
+    mosaics if a bayer pattern is given.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}, expected one of {PRECISIONS}")
+    if demosaic not in color.DEMOSAIC_MODES:
+        raise ValueError(f"Unknown demosaic mode {demosaic!r}, expected one of {color.DEMOSAIC_MODES}")
+    if bayer is not None and bayer not in color.PATTERNS:
+        raise ValueError(f"Unknown Bayer pattern {bayer!r}, expected one of {color.PATTERNS}")
+    # Mono frames ignore the demosaic mode
+    frames = None if bayer is None else [bayer, demosaic]
+    keys = {}
+    if cache is not None:
+        keys['load'] = stage_key('load', [file_fingerprint(path) for path in paths], bit_depth, precision,
+                                 frames)
+        keys['flat'] = None
+        if flat_paths is not None:
+            keys['flat'] = stage_key('load', [file_fingerprint(path) for path in flat_paths], bit_depth,
+                                     precision, frames)
+        keys['correct'] = stage_key('correct', keys['load'], keys['flat'], array_fingerprint(dark),
+                                    None if intensity_scales is None else np.asarray(intensity_scales).tolist())
+        keys['mask'] = stage_key('mask', keys['load'], file_fingerprint(mask_path), roi)
+        lights = model.key if model is not None else array_fingerprint(np.asarray(light_mat, np.float64))
+        keys['register'] = stage_key('register', keys['correct'])
+        keys['solve'] = stage_key('solve', keys['correct'], keys['mask'], lights, register)
+        keys['integrate'] = stage_key('integrate', keys['solve'], keys['mask'])
+    results = {}
+
+    def stage(name, compute):
+        if name not in results:
+            results[name] = cached_stage(cache, name, keys.get(name), compute)
+        return results[name]
+
+    def load():
+        return _read_stack(paths, bit_depth, precision, bayer, demosaic)
+
+    def correct():
+        loaded = stage('load', load)
+        stack = loaded['stack']
+        if not stack.flags.writeable:
+            stack = stack.copy()
+        bits = int(loaded['bits']) or None
+        dark_linear = dark_frame = None
+        if dark is not None:
+            dark_linear = dark_frame = pixels.to_linear_float32(dark, bits)
+            if bayer is not None:
+                dark_frame = color.luminance(dark_linear, bayer, demosaic)
+            with instrument.span('process.dark'):
+                subtract_dark(stack, dark_frame, out=stack)
+        if flat_paths is not None:
+            flats = _read_stack(flat_paths, bits, precision, bayer, demosaic)['stack']
+            if dark_frame is not None:
+                subtract_dark(flats, dark_frame, out=flats)
+            with instrument.span('process.flat'):
+                divide_flat(stack, flats, out=stack)
+            del flats
+        if intensity_scales is not None:
+            with instrument.span('process.intensity'):
+                normalize_intensity(stack, intensity_scales, out=stack)
+        if bayer is None:
+            return {'stack': stack}
+        # Flats and intensity scales change every channel alike, so only the
+        # dark matters to the color sums
+        mosaic = np.array(loaded['mosaic'])
+        if dark_linear is not None:
+            mosaic -= np.float32(len(stack)) * dark_linear
+            np.maximum(mosaic, 0, out=mosaic)
+        return {'stack': stack, 'mosaic': mosaic}
+
+    def corrected():
+        if dark is None and flat_paths is None and intensity_scales is None:
+            return stage('load', load)
+        return stage('correct', correct)
+
+    def registered():
+        stack = corrected()['stack']
+        if not stack.flags.writeable:
+            stack = stack.copy()
+        with instrument.span('process.register', count=len(stack)):
+            stack, shifts = register_stack(stack, out=stack)
+        return {'stack': stack, 'shifts': shifts}
+
+    def mask():
+        print(f"Loading mask: {mask_path}")
+        with instrument.span('process.mask'):
+            shape = corrected()['stack'].shape[1:]
+            valid = _crop_to_roi(io.load_mask(mask_path, shape), roi)
+            if valid.shape != shape and bayer is not None and demosaic == 'superpixel':
+                # A superpixel is inside the mask if its whole 2 x 2 cell is
+                valid = valid[:2 * shape[0], :2 * shape[1]].reshape(shape[0], 2, shape[1], 2).min(axis=(1, 3))
+            return {'mask': valid}
+
+    def solve():
+        if register:
+            aligned = stage('register', registered)
+            stack = aligned['stack']
+        else:
+            stack = corrected()['stack']
+        valid = stage('mask', mask)['mask']
+        tic = time.process_time()
+        with instrument.span('process.solve', count=len(stack)):
+            if model is not None:
+                normals, albedo = model.solve(stack, valid)
+            else:
+                normals, albedo = solve_normals(stack, light_mat, valid)
+        if bayer is not None:
+            with instrument.span('process.color'):
+                albedo = color.color_albedo(albedo, corrected()['mosaic'], bayer, demosaic)
+        toc = time.process_time()
+        print("Process duration: " + str(toc - tic))
+        if register:
+            # Kept with the solve so a cached solve still reports them
+            return {'normals': normals, 'albedo': albedo, 'shifts': aligned['shifts']}
+        return {'normals': normals, 'albedo': albedo}
+
+    def integrate():
+        normals = stage('solve', solve)['normals']
+        with instrument.span('process.integrate'):
+            return {'height': frankot_chellappa(normals, stage('mask', mask)['mask'])}
+
+    solved = stage('solve', solve)
+    if register and info is not None:
+        info['shifts'] = solved['shifts']
+    if not with_height:
+        return solved['normals'], solved['albedo']
+    return solved['normals'], solved['albedo'], stage('integrate', integrate)['height']
+
+
+def minmax_to_uint8(array):
+    """
+    Stretch an array to the full 0-255 range, like cv.normalize with NORM_MINMAX.
+    """
+    array = np.asarray(array, dtype=np.float32)
+    low, high = float(array.min()), float(array.max())
+    if high <= low:
+        return np.zeros(array.shape, dtype=np.uint8)
+    scaled = array - np.float32(low)
+    scaled *= np.float32(255.0 / (high - low))
+    return np.rint(scaled, out=scaled).astype(np.uint8)
+
+
+def save_results(normals, albedo, output_dir=".", height=None, store=False, normal_bits=8):
+    """
+    Save normal_map.png (8 or normal_bits=16 bits), albedo.png (in color for
+    an (H, W, 3) albedo), curvature.png and slope.png to output_dir (see
+    processing.export), and with a height map also height.tif (float32) and
+    a height.png preview. With store, the float maps are also written to
+    maps.chs, a tiled multi-resolution store (see processing.store). Returns
+    the paths.
+    """
+    with instrument.span('process.save'):
+        views = render_views(normals, albedo, normal_bits)
+        images = {VIEW_FILES[name]: image for name, image in views.items()}
+        if height is not None:
+            images['height.tif'] = np.asarray(height, dtype=np.float32)
+            images['height.png'] = minmax_to_uint8(height)
+        paths = write_images(images, output_dir)
+    if store:
+        maps = {'normals': normals, 'albedo': albedo}
+        if height is not None:
+            maps['height'] = height
+        with instrument.span('process.store'):
+            paths.append(write_store(os.path.join(output_dir, 'maps.chs'),
+                                     {name: np.asarray(array, dtype=np.float32)
+                                      for name, array in maps.items()}))
+    return tuple(paths)
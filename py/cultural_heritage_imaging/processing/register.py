@@ -0,0 +1,167 @@
+"""
+Frame Registration
+
+Light sequences paced by the Arduino take seconds, and the stand can
+vibrate or the object settle by a pixel or two between frames. Photometric
+stereo reads that as surface detail, so frames are aligned to a reference
+frame before solving.
+
+Shifts are estimated by phase correlation, which keeps only the phase of
+the cross-power spectrum and so matches texture rather than shading. It
+runs coarse to fine on a pyramid of 2 x 2 means: the coarsest level finds
+large shifts cheaply, and each finer level only refines the residual on a
+central crop, with a parabolic fit around the peak for sub-pixel precision.
+The frames are then resampled once, bilinearly, by their total shift.
+
+On a smooth object the shading changes between lights share no texture
+with the reference, the correlation peak stays low, and such frames are
+left unshifted rather than moved by a false estimate.
+"""
+
+import numpy as np
+
+# Phase correlation peak (1 for identical frames) below which a shift
+# estimate is not trusted
+MIN_MATCH = 0.3
+
+# Largest side of the coarsest pyramid level, and of the crop refined at finer levels
+COARSE_SIZE = 256
+REFINE_SIZE = 512
+
+
+def phase_correlate(reference, moved):
+    """
+    (dx, dy, peak): shift of moved relative to reference in pixels, from the
+    peak of their phase correlation refined to sub-pixel by a parabola through
+    its neighbours, and the peak height. Both frames are Hann-windowed to
+    suppress edge effects.
+    """
+    height, width = reference.shape
+    window = np.outer(np.hanning(height), np.hanning(width)).astype(np.float32)
+    spectrum = (np.fft.rfft2((reference - reference.mean()) * window).conj()
+                * np.fft.rfft2((moved - moved.mean()) * window))
+    spectrum /= np.maximum(np.abs(spectrum), 1e-12)
+    surface = np.fft.irfft2(spectrum, s=(height, width))
+    row, col = np.unravel_index(np.argmax(surface), surface.shape)
+
+    def refine(minus, centre, plus):
+        curvature = minus - 2 * centre + plus
+        return 0.0 if curvature == 0 else 0.5 * (minus - plus) / curvature
+
+    dy = row + refine(surface[row - 1, col], surface[row, col], surface[(row + 1) % height, col])
+    dx = col + refine(surface[row, col - 1], surface[row, col], surface[row, (col + 1) % width])
+    # Peaks past the middle are negative shifts
+    if dy > height / 2:
+        dy -= height
+    if dx > width / 2:
+        dx -= width
+    return float(dx), float(dy), float(surface[row, col])
+
+
+def pyramid(frame, coarse_size=COARSE_SIZE):
+    """
+    List of float32 levels from full resolution down to a largest side of at
+    most coarse_size, each a 2 x 2 mean of the one before.
+    """
+    levels = [np.asarray(frame, dtype=np.float32)]
+    while max(levels[-1].shape) > coarse_size and min(levels[-1].shape) >= 32:
+        level = levels[-1]
+        height, width = (level.shape[0] // 2) * 2, (level.shape[1] // 2) * 2
+        levels.append(level[:height, :width].reshape(height // 2, 2, width // 2, 2).mean(axis=(1, 3)))
+    return levels
+
+
+def _center(array, size):
+    height, width = array.shape
+    top, left = max((height - size) // 2, 0), max((width - size) // 2, 0)
+    return array[top:top + size, left:left + size]
+
+
+def estimate_shift(reference_levels, frame, refine_size=REFINE_SIZE):
+    """
+    (dx, dy, peak) of frame relative to the reference pyramid, coarse to fine.
+    """
+    levels = pyramid(frame, max(reference_levels[-1].shape))
+    dx = dy = 0.0
+    peak = 0.0
+    for depth in range(len(reference_levels) - 1, -1, -1):
+        scale = 2 ** depth
+        reference = reference_levels[depth]
+        # Undo the shift found so far to whole pixels of this level, then refine
+        shift_x, shift_y = int(round(dx / scale)), int(round(dy / scale))
+        moved = np.roll(levels[depth], (-shift_y, -shift_x), axis=(0, 1))
+        if depth < len(reference_levels) - 1:
+            reference, moved = _center(reference, refine_size), _center(moved, refine_size)
+        step_x, step_y, peak = phase_correlate(reference, moved)
+        if depth == len(reference_levels) - 1 and peak < MIN_MATCH:
+            return 0.0, 0.0, peak
+        dx = (shift_x + step_x) * scale
+        dy = (shift_y + step_y) * scale
+    return dx, dy, peak
+
+
+def estimate_shifts(stack, reference=0):
+    """
+    (K, 2) float32 (dx, dy) shifts of each frame of a (K, H, W) stack relative
+    to frame reference, and the (K,) correlation peaks. Frames whose match is
+    below MIN_MATCH get a zero shift.
+    """
+    reference_levels = pyramid(stack[reference])
+    shifts = np.zeros((len(stack), 2), dtype=np.float32)
+    peaks = np.ones(len(stack), dtype=np.float32)
+    for index, frame in enumerate(stack):
+        if index == reference:
+            continue
+        dx, dy, peak = estimate_shift(reference_levels, frame)
+        peaks[index] = peak
+        if peak >= MIN_MATCH:
+            shifts[index] = dx, dy
+    return shifts, peaks
+
+
+def shift_frame(frame, dx, dy, out=None):
+    """
+    Resample a frame so content at (x + dx, y + dy) moves to (x, y), with
+    bilinear interpolation and edge pixels repeated past the border.
+    """
+    height, width = frame.shape
+    if out is None:
+        out = np.empty((height, width), dtype=np.float32)
+    ix, iy = int(np.floor(dx)), int(np.floor(dy))
+    fx, fy = np.float32(dx - ix), np.float32(dy - iy)
+    cols = np.clip(np.arange(width) + ix, 0, width - 1)
+    cols1 = np.clip(cols + 1, 0, width - 1)
+    rows = np.clip(np.arange(height) + iy, 0, height - 1)
+    rows1 = np.clip(rows + 1, 0, height - 1)
+    top = frame[rows]
+    bottom = frame[rows1]
+    upper = (1 - fx) * top[:, cols] + fx * top[:, cols1]
+    lower = (1 - fx) * bottom[:, cols] + fx * bottom[:, cols1]
+    np.multiply(upper, 1 - fy, out=out)
+    out += fy * lower
+    return out
+
+
+def apply_shifts(stack, shifts, out=None):
+    """
+    Undo per-frame (dx, dy) shifts of a (K, H, W) float32 stack. Frames with
+    no shift are copied through. Pass out=stack to register in place.
+    """
+    if out is None:
+        out = np.empty_like(stack, dtype=np.float32)
+    for index, (dx, dy) in enumerate(np.asarray(shifts, dtype=np.float64)):
+        if dx == 0 and dy == 0:
+            if out is not stack:
+                out[index] = stack[index]
+            continue
+        out[index] = shift_frame(stack[index], dx, dy)
+    return out
+
+
+def register_stack(stack, reference=0, out=None):
+    """
+    Align every frame of a (K, H, W) stack to frame reference. Returns the
+    registered stack and the (K, 2) (dx, dy) shifts that were removed.
+    """
+    shifts, _ = estimate_shifts(stack, reference)
+    return apply_shifts(stack, shifts, out=out), shifts
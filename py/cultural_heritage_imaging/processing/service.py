@@ -0,0 +1,508 @@
+"""
+Processing Service
+
+Runs the photometric stereo pipeline for capture stations that should not
+do it themselves: a small HTTP server on the processing machine accepts
+sessions, processes them on a pool of worker processes and streams the
+results back. Everything is in the standard library, so a station only
+needs this package, and the whole round trip can be tried on localhost:
+
+    service = ProcessingService("/data/jobs", port=0).start()
+    ProcessingClient(service.url).process("images/vase", "results/vase")
+
+Endpoints (all responses but results are JSON):
+
+    POST   /sessions            body: tar of a session (see pack_session);
+                                query: options (JOB_OPTIONS) -> {"job": id}
+    GET    /jobs/<id>           the job's status record
+    GET    /jobs/<id>/results   ?wait=S waits up to S seconds; a tar of the
+                                result files when done, the status record
+                                with 202 while running and 500 if failed
+    DELETE /jobs/<id>           remove the job and its files
+    GET    /health              worker count and jobs by status
+
+Each job lives in <root>/<id>/ with the unpacked session under session/
+and its results and batch.json status record (as written by chi batch)
+under results/. Archives are streamed to disk and results from disk, so
+neither end holds a whole session in memory.
+"""
+
+import concurrent.futures
+import http.client
+import http.server
+import io as _io
+import json
+import math
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import traceback
+import urllib.parse
+import uuid
+
+from cultural_heritage_imaging import instrument
+from cultural_heritage_imaging.pixels import STACK_DTYPES
+from cultural_heritage_imaging.processing.batch import (RESULTS_DIR, _ignore_interrupt, process_one,
+                                                        write_status)
+from cultural_heritage_imaging.processing.color import DEMOSAIC_MODES
+from cultural_heritage_imaging.session import IMAGE_TYPES, MANIFEST_NAME
+
+PORT = 8753
+# Largest session archive accepted, in bytes
+MAX_UPLOAD = 16 * 1024 ** 3
+CHUNK = 1024 * 1024
+
+# Options a client may set per job, with their parsers
+JOB_OPTIONS = {
+    'image_type': str,
+    'exposure': float,
+    'repeat': int,
+    'solver': str,
+    'with_height': lambda value: value.lower() in ('1', 'true', 'yes'),
+    'register': lambda value: value.lower() in ('1', 'true', 'yes'),
+    'store': lambda value: value.lower() in ('1', 'true', 'yes'),
+    'normal_bits': int,
+    'precision': str,
+    'demosaic': str,
+}
+
+SESSION_DIR = "session"
+MASK_NAME = "mask.bmp"
+
+
+def pack_session(session_dir, fileobj):
+    """
+    Write a session's manifest, the frames it lists, its mask and its master
+    darks to fileobj as a tar stream. Darks are stored under darks/ and the
+    manifest copy points to them there instead of the station's paths.
+    """
+    with open(os.path.join(session_dir, MANIFEST_NAME), 'r') as f:
+        manifest = json.load(f)
+    with tarfile.open(fileobj=fileobj, mode='w|') as tar:
+        darks = {}
+        for exposure, path in manifest.get('darks', {}).items():
+            name = f"darks/{os.path.basename(path)}"
+            tar.add(path if os.path.isabs(path) else os.path.join(session_dir, path), name)
+            darks[exposure] = name
+        if darks:
+            manifest['darks'] = darks
+        data = json.dumps(manifest, indent=2).encode()
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size = len(data)
+        info.mtime = time.time()
+        tar.addfile(info, _io.BytesIO(data))
+        for frame in manifest['frames']:
+            tar.add(os.path.join(session_dir, frame['path']), frame['path'])
+        mask_path = os.path.join(session_dir, MASK_NAME)
+        if os.path.exists(mask_path):
+            tar.add(mask_path, MASK_NAME)
+
+
+def _extract(tar, directory):
+    # Only plain files and folders, and nothing outside directory; returns the files
+    root = os.path.realpath(directory)
+    extra = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+    paths = []
+    for member in tar:
+        path = os.path.realpath(os.path.join(root, member.name))
+        if not (member.isfile() or member.isdir()) or os.path.commonpath([root, path]) != root:
+            raise ValueError(f"Archive member {member.name!r} is not allowed")
+        tar.extract(member, root, set_attrs=False, **extra)
+        if member.isfile():
+            paths.append(path)
+    return paths
+
+
+def parse_options(query):
+    """
+    Job options from a URL query string. Raises ValueError for unknown or
+    invalid ones.
+    """
+    options = {}
+    for name, values in urllib.parse.parse_qs(query).items():
+        if name not in JOB_OPTIONS:
+            raise ValueError(f"Unknown option {name!r}, expected one of {sorted(JOB_OPTIONS)}")
+        options[name] = JOB_OPTIONS[name](values[-1])
+    if options.get('image_type', 'target') not in IMAGE_TYPES:
+        raise ValueError(f"Unknown image type {options['image_type']!r}")
+    if options.get('normal_bits', 8) not in (8, 16):
+        raise ValueError(f"Normal maps are 8 or 16 bits, got {options['normal_bits']}")
+    if options.get('precision', 'float32') not in STACK_DTYPES:
+        raise ValueError(f"Unknown precision {options['precision']!r}, expected one of {STACK_DTYPES}")
+    if options.get('demosaic', 'bilinear') not in DEMOSAIC_MODES:
+        raise ValueError(f"Unknown demosaic mode {options['demosaic']!r}, expected one of {DEMOSAIC_MODES}")
+    return options
+
+
+class ProcessingService:
+    def __init__(self, root, host='127.0.0.1', port=PORT, workers=2, max_upload=MAX_UPLOAD, **options):
+        """
+        Service keeping its jobs under root, listening on host:port (port 0
+        picks a free one) and processing at most workers sessions at once.
+        options apply to every job and are not settable by clients:
+        field_cache, and cache_dir and cache_bytes for a StageCache.
+        """
+        if workers < 1:
+            raise ValueError("Need at least one worker")
+        self.root = root
+        self.workers = int(workers)
+        self.max_upload = int(max_upload)
+        self.options = options
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._futures = {}
+        self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                                                            initializer=_ignore_interrupt)
+        self._server = http.server.ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.service = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def job_dir(self, job):
+        return os.path.join(self.root, job)
+
+    def submit(self, stream, length, options=None):
+        """
+        Unpack a session archive of length bytes read from stream and queue
+        it. Returns the job id. Raises ValueError for a bad archive.
+        """
+        options = dict(options or {})
+        job = uuid.uuid4().hex[:12]
+        job_dir = self.job_dir(job)
+        session_dir = os.path.join(job_dir, SESSION_DIR)
+        os.makedirs(session_dir)
+        try:
+            with instrument.span('service.receive', bytes=length):
+                with tempfile.TemporaryFile(dir=job_dir) as archive:
+                    remaining = length
+                    while remaining:
+                        chunk = stream.read(min(CHUNK, remaining))
+                        if not chunk:
+                            raise ValueError(f"Upload ended {remaining} bytes short")
+                        archive.write(chunk)
+                        remaining -= len(chunk)
+                    archive.seek(0)
+                    with tarfile.open(fileobj=archive, mode='r|') as tar:
+                        _extract(tar, session_dir)
+            if not os.path.isfile(os.path.join(session_dir, MANIFEST_NAME)):
+                raise ValueError(f"Archive has no {MANIFEST_NAME}")
+        except (ValueError, tarfile.TarError) as ex:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise ValueError(f"Invalid session archive: {ex}") from None
+
+        results_dir = os.path.join(job_dir, RESULTS_DIR)
+        record = {
+            'job': job,
+            'status': 'running',
+            'options': options,
+            'started_at': time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime()),
+        }
+        write_status(results_dir, record)
+        with self._lock:
+            self._jobs[job] = record
+            future = self._pool.submit(process_one, session_dir, results_dir, {**options, **self.options})
+            self._futures[job] = future
+        future.add_done_callback(lambda done: self._finish(job, done))
+        print(f"Job {job}: processing {length} byte session")
+        return job
+
+    def _finish(self, job, future):
+        with self._lock:
+            record = self._jobs.get(job)
+            if record is None or future.cancelled():
+                # Removed before it started
+                return
+            record['finished_at'] = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
+            try:
+                outputs = future.result()
+                record['outputs'] = [os.path.relpath(path, os.path.join(self.job_dir(job), RESULTS_DIR))
+                                     for path in outputs]
+                record['status'] = 'done'
+            except Exception as ex:
+                record['status'] = 'failed'
+                record['error'] = f"{type(ex).__name__}: {ex}"
+                record['traceback'] = ''.join(traceback.format_exception(type(ex), ex, ex.__traceback__))
+            write_status(os.path.join(self.job_dir(job), RESULTS_DIR), record)
+        print(f"Job {job}: {record['status']}")
+
+    def status(self, job):
+        """
+        Copy of a job's status record, or None for an unknown job.
+        """
+        with self._lock:
+            record = self._jobs.get(job)
+            return None if record is None else dict(record)
+
+    def wait(self, job, timeout=None):
+        """
+        Wait up to timeout seconds for a job to finish; returns its status.
+        """
+        with self._lock:
+            future = self._futures.get(job)
+        if future is not None:
+            concurrent.futures.wait([future], timeout=timeout)
+            # The done callback may still be recording the result
+            deadline = time.monotonic() + 1.0
+            while future.done() and self.status(job)['status'] == 'running' and time.monotonic() < deadline:
+                time.sleep(0.01)
+        return self.status(job)
+
+    def remove(self, job):
+        """
+        Forget a job and delete its files, cancelling it if it has not started.
+        Returns False for an unknown job; raises ValueError for a running one.
+        """
+        with self._lock:
+            if job not in self._jobs:
+                return False
+            future = self._futures[job]
+            if not future.done() and not future.cancel():
+                raise ValueError(f"Job {job} is running")
+            del self._jobs[job]
+            del self._futures[job]
+        shutil.rmtree(self.job_dir(job), ignore_errors=True)
+        return True
+
+    def health(self):
+        with self._lock:
+            counts = {}
+            for record in self._jobs.values():
+                counts[record['status']] = counts.get(record['status'], 0) + 1
+        return {'workers': self.workers, 'jobs': counts}
+
+    def start(self):
+        """
+        Serve requests on a background thread. Returns the service.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        print(f"Processing service on {self.url}, jobs in {self.root}, {self.workers} worker(s)")
+        self._server.serve_forever()
+
+    def close(self):
+        """
+        Stop serving, and wait for running jobs to finish.
+        """
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    server_version = "chi-service"
+
+    def log_message(self, format, *args):
+        # Job progress is printed by the service; skip the per-request log
+        pass
+
+    def _json(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self):
+        url = urllib.parse.urlsplit(self.path)
+        return [part for part in url.path.split('/') if part], url.query
+
+    def _discard(self, length):
+        while length > 0:
+            chunk = self.rfile.read(min(CHUNK, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+
+    def do_POST(self):
+        service = self.server.service
+        parts, query = self._route()
+        if parts != ['sessions']:
+            return self._json(404, {'error': f"No endpoint {self.path}"})
+        length = self.headers.get('Content-Length')
+        if length is None:
+            return self._json(411, {'error': "Content-Length required"})
+        try:
+            length = int(length)
+            if length < 0:
+                raise ValueError
+        except ValueError:
+            return self._json(400, {'error': f"Invalid Content-Length {self.headers['Content-Length']!r}"})
+        if length > service.max_upload:
+            return self._json(413, {'error': f"Session archive over {service.max_upload} bytes"})
+        try:
+            options = parse_options(query)
+        except ValueError as ex:
+            # Take the upload anyway: closing on a client still sending it
+            # would reach it as a broken pipe instead of this error
+            self._discard(length)
+            return self._json(400, {'error': str(ex)})
+        try:
+            job = service.submit(self.rfile, length, options)
+        except ValueError as ex:
+            return self._json(400, {'error': str(ex)})
+        self._json(202, {'job': job, 'status': 'running'})
+
+    def do_GET(self):
+        service = self.server.service
+        parts, query = self._route()
+        if parts == ['health']:
+            return self._json(200, service.health())
+        if len(parts) not in (2, 3) or parts[0] != 'jobs' or parts[2:] not in ([], ['results']):
+            return self._json(404, {'error': f"No endpoint {self.path}"})
+        text = urllib.parse.parse_qs(query).get('wait', ['0'])[-1]
+        try:
+            wait = float(text)
+            if not math.isfinite(wait):
+                raise ValueError
+        except ValueError:
+            return self._json(400, {'error': f"wait must be a number of seconds, got {text!r}"})
+        record = service.status(parts[1])
+        if record is None:
+            return self._json(404, {'error': f"No job {parts[1]}"})
+        if len(parts) == 2:
+            return self._json(200, record)
+
+        if record['status'] == 'running' and wait > 0:
+            record = service.wait(parts[1], wait)
+        if record['status'] == 'running':
+            return self._json(202, record)
+        if record['status'] == 'failed':
+            return self._json(500, record)
+        results_dir = os.path.join(service.job_dir(parts[1]), RESULTS_DIR)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-tar')
+        # No length: the archive is streamed as it is built and the connection closed after it
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        with instrument.span('service.send', job=parts[1]):
+            with tarfile.open(fileobj=self.wfile, mode='w|') as tar:
+                for name in sorted(os.listdir(results_dir)):
+                    tar.add(os.path.join(results_dir, name), name)
+
+    def do_DELETE(self):
+        service = self.server.service
+        parts, _ = self._route()
+        if len(parts) != 2 or parts[0] != 'jobs':
+            return self._json(404, {'error': f"No endpoint {self.path}"})
+        try:
+            if not service.remove(parts[1]):
+                return self._json(404, {'error': f"No job {parts[1]}"})
+        except ValueError as ex:
+            return self._json(409, {'error': str(ex)})
+        self._json(200, {'job': parts[1], 'status': 'removed'})
+
+
+class ProcessingClient:
+    def __init__(self, url=f"http://127.0.0.1:{PORT}", timeout=60.0):
+        """
+        Client for a ProcessingService at url; timeout is in seconds per
+        request (waiting for results is polled within it).
+        """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme != 'http' or not parts.hostname:
+            raise ValueError(f"Service URL must be http://host:port, got {url}")
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = float(timeout)
+
+    def _request(self, method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        connection.request(method, path, body=body, headers=headers or {})
+        return connection, connection.getresponse()
+
+    def _json(self, method, path, body=None, headers=None, expected=(200, 202)):
+        connection, response = self._request(method, path, body, headers)
+        try:
+            record = json.loads(response.read() or b'{}')
+        finally:
+            connection.close()
+        if response.status not in expected:
+            raise ValueError(f"{method} {path} failed ({response.status}): "
+                             f"{record.get('error', response.reason)}")
+        return record
+
+    def submit(self, session_dir, **options):
+        """
+        Upload a session (see pack_session) with job options (JOB_OPTIONS)
+        and return the job id.
+        """
+        query = urllib.parse.urlencode({name: str(value) for name, value in options.items()})
+        with tempfile.TemporaryFile() as archive:
+            with instrument.span('client.pack'):
+                pack_session(session_dir, archive)
+            length = archive.tell()
+            archive.seek(0)
+            with instrument.span('client.upload', bytes=length):
+                record = self._json('POST', f"/sessions?{query}", archive,
+                                    {'Content-Type': 'application/x-tar', 'Content-Length': str(length)})
+        return record['job']
+
+    def status(self, job):
+        return self._json('GET', f"/jobs/{job}")
+
+    def remove(self, job):
+        return self._json('DELETE', f"/jobs/{job}")
+
+    def fetch(self, job, output_dir, timeout=None):
+        """
+        Wait up to timeout seconds (default: forever) for a job and unpack its
+        results into output_dir. Returns the paths written. Raises ValueError
+        if the job failed and TimeoutError if it is still running.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.timeout / 2
+            if deadline is not None:
+                wait = max(min(wait, deadline - time.monotonic()), 0)
+            connection, response = self._request('GET', f"/jobs/{job}/results?wait={wait:.3f}")
+            try:
+                if response.status == 200:
+                    os.makedirs(output_dir, exist_ok=True)
+                    with instrument.span('client.download', job=job):
+                        with tarfile.open(fileobj=response, mode='r|') as tar:
+                            return _extract(tar, output_dir)
+                record = json.loads(response.read() or b'{}')
+            finally:
+                connection.close()
+            if response.status == 202:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"Job {job} still running")
+                continue
+            message = record.get('error', response.reason)
+            raise ValueError(f"Job {job} failed: {message}")
+
+    def process(self, session_dir, output_dir, keep=False, **options):
+        """
+        Submit a session, wait for it and unpack its results into output_dir;
+        the job is removed from the service afterwards unless keep is set.
+        Returns the paths written.
+        """
+        job = self.submit(session_dir, **options)
+        print(f"Submitted {session_dir} as job {job}")
+        try:
+            return self.fetch(job, output_dir)
+        finally:
+            if not keep:
+                self.remove(job)
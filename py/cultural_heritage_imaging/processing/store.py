@@ -0,0 +1,167 @@
+"""
+Chunked Map Store
+
+Float normal, albedo and height maps saved as a directory of compressed
+tiles, so a viewer or analysis script can read one region at one resolution
+without decoding the whole map. The layout is Zarr-like but needs only the
+standard library and NumPy:
+
+    maps.chs/
+        store.json                       arrays, shapes, dtypes, tile size
+        <array>/<level>/<row>.<col>      one zlib-compressed tile
+
+Level 0 is full resolution and each further level halves both axes (2 x 2
+means; normal vectors are renormalized) until the map fits in one tile.
+Before compression the bytes of each tile are shuffled so the same byte of
+every value is stored together, which lets zlib find the redundancy in the
+exponent bytes of float data.
+"""
+
+import json
+import os
+import zlib
+
+import numpy as np
+
+STORE_NAME = "store.json"
+FORMAT = 'chi-chunked'
+VERSION = 1
+
+
+def _shuffle(tile):
+    itemsize = tile.dtype.itemsize
+    return np.ascontiguousarray(tile).view(np.uint8).reshape(-1, itemsize).T.tobytes()
+
+
+def _unshuffle(data, dtype, shape):
+    dtype = np.dtype(dtype)
+    raw = np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, -1).T
+    return np.ascontiguousarray(raw).view(dtype).reshape(shape)
+
+
+def downsample(array, vectors=False):
+    """
+    Half-resolution copy of an (H, W) or (H, W, C) map by 2 x 2 means; odd
+    edges keep their last row or column. With vectors, the means are
+    renormalized to unit length.
+    """
+    array = np.asarray(array)
+    height, width = array.shape[:2]
+    if height % 2:
+        array = np.concatenate([array, array[-1:]], axis=0)
+    if width % 2:
+        array = np.concatenate([array, array[:, -1:]], axis=1)
+    blocks = array.reshape((array.shape[0] // 2, 2, array.shape[1] // 2, 2) + array.shape[2:])
+    half = blocks.mean(axis=(1, 3), dtype=np.float32).astype(array.dtype, copy=False)
+    if vectors:
+        norm = np.linalg.norm(half, axis=-1, keepdims=True)
+        np.divide(half, norm, out=half, where=norm > 0)
+    return half
+
+
+def write_store(path, arrays, tile=256, vectors=('normals',), compression=6):
+    """
+    Write named maps (a dict of (H, W) or (H, W, C) arrays) to a chunked store
+    at path with every resolution level. Maps named in vectors are treated as
+    unit vectors when downsampling. Returns path.
+    """
+    tile = int(tile)
+    if tile < 16:
+        raise ValueError("Tiles must be at least 16 pixels")
+    os.makedirs(path, exist_ok=True)
+    metadata = {'format': FORMAT, 'version': VERSION, 'tile': tile,
+                'compression': 'zlib', 'shuffle': True, 'arrays': {}}
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        if array.ndim not in (2, 3):
+            raise ValueError(f"Map {name} must be 2-D or 3-D, got shape {array.shape}")
+        levels = []
+        level = array
+        while True:
+            _write_level(os.path.join(path, name, str(len(levels))), level, tile, compression)
+            levels.append(list(level.shape[:2]))
+            if max(level.shape[:2]) <= tile:
+                break
+            level = downsample(level, vectors=name in vectors)
+        metadata['arrays'][name] = {'dtype': array.dtype.str, 'channels': array.shape[2:],
+                                    'levels': levels}
+    metadata_path = os.path.join(path, STORE_NAME)
+    with open(metadata_path + ".tmp", 'w') as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(metadata_path + ".tmp", metadata_path)
+    return path
+
+
+def _write_level(directory, array, tile, compression):
+    os.makedirs(directory, exist_ok=True)
+    height, width = array.shape[:2]
+    for row in range(0, height, tile):
+        for col in range(0, width, tile):
+            block = array[row:row + tile, col:col + tile]
+            with open(os.path.join(directory, f"{row // tile}.{col // tile}"), 'wb') as f:
+                f.write(zlib.compress(_shuffle(block), compression))
+
+
+class MapStore:
+    def __init__(self, path):
+        """
+        Open a store written by write_store for reading.
+        """
+        with open(os.path.join(path, STORE_NAME), 'r') as f:
+            metadata = json.load(f)
+        if metadata.get('format') != FORMAT:
+            raise ValueError(f"{path} is not a chunked map store")
+        if metadata.get('version', 0) > VERSION:
+            raise ValueError(f"{path} is a version {metadata['version']} store, "
+                             f"this reader supports up to version {VERSION}")
+        self.path = path
+        self.tile = metadata['tile']
+        self.arrays = metadata['arrays']
+
+    @property
+    def names(self):
+        return list(self.arrays)
+
+    def levels(self, name):
+        """
+        Number of resolution levels of a map.
+        """
+        return len(self._info(name)['levels'])
+
+    def shape(self, name, level=0):
+        info = self._info(name)
+        return tuple(info['levels'][level]) + tuple(info['channels'])
+
+    def _info(self, name):
+        try:
+            return self.arrays[name]
+        except KeyError:
+            raise ValueError(f"No map {name!r} in {self.path}, expected one of {self.names}") from None
+
+    def read(self, name, level=0, region=None):
+        """
+        Read a map at a resolution level, or just a region of it given as
+        (x, y, width, height) in that level's pixels. Only the tiles that
+        overlap the region are decompressed.
+        """
+        info = self._info(name)
+        height, width = info['levels'][level]
+        x, y, region_width, region_height = region if region is not None else (0, 0, width, height)
+        x0, y0 = max(int(x), 0), max(int(y), 0)
+        x1, y1 = min(int(x + region_width), width), min(int(y + region_height), height)
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError(f"Region {region} is outside the {width}x{height} level {level} of {name}")
+        channels = tuple(info['channels'])
+        out = np.empty((y1 - y0, x1 - x0) + channels, dtype=info['dtype'])
+        tile = self.tile
+        directory = os.path.join(self.path, name, str(level))
+        for row in range(y0 // tile, (y1 - 1) // tile + 1):
+            for col in range(x0 // tile, (x1 - 1) // tile + 1):
+                top, left = row * tile, col * tile
+                tile_shape = (min(tile, height - top), min(tile, width - left)) + channels
+                with open(os.path.join(directory, f"{row}.{col}"), 'rb') as f:
+                    block = _unshuffle(zlib.decompress(f.read()), info['dtype'], tile_shape)
+                sy0, sx0 = max(y0, top), max(x0, left)
+                sy1, sx1 = min(y1, top + tile_shape[0]), min(x1, left + tile_shape[1])
+                out[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = block[sy0 - top:sy1 - top, sx0 - left:sx1 - left]
+        return out
@@ -0,0 +1,230 @@
+"""
+Light Rigs
+
+A light rig describes the lights the Arduino can switch: their names, unit
+direction vectors (x right, y up, z toward the camera, as in
+LightMatrix.yml) and the output channel each one is wired to, plus how the
+firmware addresses its channels (direct enable pins, 74HC4067 multiplexers
+or a chain of 74HC595 shift registers, see main.ino). Capture, file naming
+and processing refer to lights by their index in the rig, so a larger dome
+only needs a rig file:
+
+    {
+        "name": "dome32",
+        "addressing": "shift_register",
+        "lights": [
+            {"name": "L00", "direction": [0.0, 0.707, 0.707], "channel": 0},
+            {"name": "L01", "direction": [0.5, 0.5, 0.707], "channel": 1}
+        ]
+    }
+
+Lights close to the object light each pixel from a different direction and
+distance. For near-field processing a rig also gives each light's position
+in millimetres (origin at the object plane under the frame centre, same
+axes as the directions) and the camera's scale on the object plane:
+
+    "camera": {"mm_per_pixel": 0.05},
+    "lights": [{"name": "N", "position": [0.0, 150.0, 150.0], "channel": 0}, ...]
+
+A light with a position needs no direction; it defaults to the direction
+seen from the frame centre.
+
+The default rig is the original four-light stand: N, E, S, W on EN1-EN4.
+"""
+
+import json
+import math
+
+from cultural_heritage_imaging._optional import lazy_import
+
+np = lazy_import('numpy')
+
+# Channel addressing schemes supported by the firmware
+ADDRESSING = ('direct', 'multiplexed', 'shift_register')
+
+# Channels and sequence lengths are sent to the Arduino as single bytes
+MAX_CHANNELS = 256
+
+
+def _vector(values, what):
+    if values is None or len(values) != 3:
+        raise ValueError(f"{what} must have 3 components")
+    return tuple(float(v) for v in values)
+
+
+class Light:
+    def __init__(self, name, direction, channel, position=None):
+        """
+        One light: a filename-safe name, a direction toward the light, its output
+        channel and optionally its position in mm (then direction may be None).
+        """
+        self.name = str(name).strip()
+        if not self.name or not all(c.isalnum() or c in '-_' for c in self.name):
+            raise ValueError(f"Light name {name!r} must be letters, digits, '-' or '_'")
+        self.position = None if position is None else _vector(position, f"Light {self.name} position")
+        if direction is None:
+            direction = self.position
+        direction = _vector(direction, f"Light {self.name} direction")
+        norm = math.sqrt(sum(v * v for v in direction))
+        if norm == 0:
+            raise ValueError(f"Light {self.name} direction cannot be zero")
+        self.direction = tuple(v / norm for v in direction)
+        self.channel = int(channel)
+        if not 0 <= self.channel < MAX_CHANNELS:
+            raise ValueError(f"Light {self.name} channel must be between 0 and {MAX_CHANNELS - 1}")
+
+    def to_dict(self):
+        data = {'name': self.name, 'direction': list(self.direction), 'channel': self.channel}
+        if self.position is not None:
+            data['position'] = list(self.position)
+        return data
+
+
+class LightRig:
+    def __init__(self, lights, addressing='direct', name='rig', camera=None):
+        """
+        Build a rig from Light objects, in index order. camera holds the
+        object-plane scale ('mm_per_pixel') and optional optical 'center'
+        (x, y in pixels) used by near-field processing.
+        """
+        self.lights = list(lights)
+        if not self.lights:
+            raise ValueError("A light rig needs at least one light")
+        if len(self.lights) > MAX_CHANNELS:
+            raise ValueError(f"A light rig can have at most {MAX_CHANNELS} lights")
+        if addressing not in ADDRESSING:
+            raise ValueError(f"Unknown addressing {addressing!r}, expected one of {ADDRESSING}")
+        self.addressing = addressing
+        self.name = str(name)
+        self.camera = dict(camera or {})
+        unknown = set(self.camera) - {'mm_per_pixel', 'center'}
+        if unknown:
+            raise ValueError(f"Unknown rig camera keys: {sorted(unknown)}")
+        if 'mm_per_pixel' in self.camera and float(self.camera['mm_per_pixel']) <= 0:
+            raise ValueError("Rig camera mm_per_pixel must be positive")
+
+        names = [light.name.upper() for light in self.lights]
+        if len(set(names)) != len(names):
+            raise ValueError("Light names must be unique")
+        channels = [light.channel for light in self.lights]
+        if len(set(channels)) != len(channels):
+            raise ValueError("Light channels must be unique")
+        self._by_name = {light_name: index for index, light_name in enumerate(names)}
+
+    @classmethod
+    def default(cls):
+        """
+        The original four-light stand: N, E, S, W at 45 degrees slant on EN1-EN4.
+        """
+        s = math.sqrt(0.5)
+        return cls([Light('N', (0.0, s, s), 0), Light('E', (s, 0.0, s), 1),
+                    Light('S', (0.0, -s, s), 2), Light('W', (-s, 0.0, s), 3)],
+                   name='nesw')
+
+    @classmethod
+    def ring(cls, count, slant=45.0, first_tilt=90.0, addressing='direct', name='ring',
+             distance=None, camera=None):
+        """
+        count lights evenly spaced in tilt at one slant (degrees), named L00, L01, ...
+        Tilt is measured counterclockwise from +x, so first_tilt=90 starts at N.
+        With distance (mm from the frame centre) the lights also get positions.
+        """
+        lights = []
+        for index in range(count):
+            tilt = math.radians(first_tilt + 360.0 * index / count)
+            s = math.radians(slant)
+            direction = (math.sin(s) * math.cos(tilt), math.sin(s) * math.sin(tilt), math.cos(s))
+            position = None if distance is None else tuple(distance * v for v in direction)
+            lights.append(Light(f"L{index:02d}", direction, index, position))
+        return cls(lights, addressing, name, camera)
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build a rig from a JSON object with 'lights' and optional 'addressing' and 'name'.
+        """
+        unknown = set(data) - {'name', 'addressing', 'lights', 'camera'}
+        if unknown:
+            raise ValueError(f"Unknown light rig keys: {sorted(unknown)}")
+        lights = []
+        for index, item in enumerate(data.get('lights') or ()):
+            lights.append(Light(item.get('name', f"L{index:02d}"), item.get('direction'),
+                                item.get('channel', index), item.get('position')))
+        return cls(lights, data.get('addressing', 'direct'), data.get('name', 'rig'),
+                   data.get('camera'))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a rig from a JSON file.
+        """
+        with open(path, 'r') as f:
+            return cls.from_dict(json.load(f))
+
+    def to_dict(self):
+        data = {'name': self.name, 'addressing': self.addressing,
+                'lights': [light.to_dict() for light in self.lights]}
+        if self.camera:
+            data['camera'] = dict(self.camera)
+        return data
+
+    def __len__(self):
+        return len(self.lights)
+
+    def __iter__(self):
+        return iter(self.lights)
+
+    def __getitem__(self, index):
+        return self.lights[index]
+
+    @property
+    def names(self):
+        return [light.name for light in self.lights]
+
+    def index(self, light):
+        """
+        Index of a light given by index, name or numeric string.
+        """
+        if isinstance(light, str):
+            key = light.strip().upper()
+            if key in self._by_name:
+                return self._by_name[key]
+            if not key.isdigit():
+                raise ValueError(f"Unknown light {light!r}, expected one of {self.names}")
+            light = int(key)
+        index = int(light)
+        if not 0 <= index < len(self.lights):
+            raise ValueError(f"Light index {index} out of range for a {len(self.lights)}-light rig")
+        return index
+
+    def resolve(self, lights=None):
+        """
+        Indices of the given lights (names or indices), or of every light if None.
+        """
+        if lights is None:
+            return list(range(len(self.lights)))
+        return [self.index(light) for light in lights]
+
+    @property
+    def near_field(self):
+        """
+        True if the rig has the light positions and camera scale near-field processing needs.
+        """
+        return 'mm_per_pixel' in self.camera and all(light.position is not None for light in self.lights)
+
+    def light_positions(self, indices=None):
+        """
+        K x 3 float array of light positions in mm, for all lights or the given indices.
+        """
+        indices = self.resolve(indices)
+        missing = [self.lights[i].name for i in indices if self.lights[i].position is None]
+        if missing:
+            raise ValueError(f"Lights {missing} have no position")
+        return np.array([self.lights[i].position for i in indices], dtype=np.float64)
+
+    def light_matrix(self, indices=None):
+        """
+        K x 3 float array of light directions, for all lights or the given indices.
+        """
+        indices = self.resolve(indices)
+        return np.array([self.lights[i].direction for i in indices], dtype=np.float64)
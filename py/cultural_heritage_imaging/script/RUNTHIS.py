@@ -8,6 +8,11 @@ import serial
 
 #Gain and exposure values: 12801 exposure, gain = 0, gamma = 1.
 
+# Camera pixel format. 'Mono16' keeps the sensor's full bit depth for photometric
+# stereo (saved as 16-bit TIFF); 'Mono8' gives the smaller 8-bit files. Color
+# cameras use 'BayerRG8' or 'BayerRG16': raw mosaics that chi process demosaics.
+PIXEL_FORMAT = 'Mono8'
+
 #Ensures that power supply is unplugged before opening serial interface. The power supply only
 #needs to be removed when the python script is re-run, there is an option for continued imaging.
 b = True
@@ -123,10 +128,10 @@ def capture_image(camera):
         
         # Get a list of nodes to use to set camera settings
         nodemap = camera.GetNodeMap()
-        # Set pixel format to Mono8
+        # Set pixel format (Mono8 by default, see PIXEL_FORMAT)
         pixel_format = PySpin.CEnumerationPtr(nodemap.GetNode('PixelFormat'))
-        mono8 = pixel_format.GetEntryByName('Mono8')  # Or 'RGB8' if using color camera
-        pixel_format.SetIntValue(mono8.GetValue())
+        pixel_format_entry = pixel_format.GetEntryByName(PIXEL_FORMAT)
+        pixel_format.SetIntValue(pixel_format_entry.GetValue())
         
         # Hardcode exposure, gain, and gamma values. Exposure is set to 12801 microseconds
         set_exposure(nodemap, 12801) #This integer sets the exposure value in microseconds
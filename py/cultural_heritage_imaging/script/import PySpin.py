@@ -1,7 +1,6 @@
 import PySpin
 import serial 
 import time
-import matplotlib.pyplot as plt
 import numpy as np
 
 def capture_image(cam, image_number):
@@ -75,13 +74,10 @@ def main():
         # End image acquisition
         cam.EndAcquisition()
 
-        # Display all images after the loop
-        fig, axs = plt.subplots(1, 4, figsize=(20, 5))
-        for i, (image_data, led_name) in enumerate(images):
-            axs[i].imshow(image_data, cmap='gray')
-            axs[i].set_title(f"{led_name} Light Image")
-            axs[i].axis('off')
-        plt.show()
+        # Display all images after the loop (matplotlib is only needed here)
+        from cultural_heritage_imaging.viz import show_light_images
+        if images:
+            show_light_images([image_data for image_data, _ in images], [name for _, name in images])
 
         # Deinitialize the camera
         cam.DeInit()
@@ -0,0 +1,298 @@
+"""
+Capture Session Specifications
+
+A session spec describes everything needed to image one object without an
+operator at the keyboard: the object id, which image types to take
+(flat-fielding, calibration, target object), the light rig and which of its
+lights to use, the exposures to bracket and how many repeats of each.
+Specs are read from JSON so a tray of objects can be queued and captured
+back-to-back by the ``chi capture`` command.
+
+A spec file holds either a single session object, a list of sessions, or an
+object with a ``sessions`` list and optional ``defaults`` applied to every
+session, e.g.::
+
+    {
+        "defaults": {"lights": ["N", "E", "S", "W"], "exposures": [0.7]},
+        "sessions": [
+            {"object_id": "clip", "image_types": ["flat", "target"]},
+            {"object_id": "coin", "repeats": 2}
+        ]
+    }
+
+The rig is a rig.LightRig JSON file path or object (default: the four-light
+N/E/S/W stand); lights are given by name or index and default to all of them.
+"""
+
+import json
+import os
+import time
+
+from cultural_heritage_imaging.pixels import PIXEL_FORMATS
+from cultural_heritage_imaging.rig import LightRig
+
+# Image types, matching the filename prefixes used by RUNTHIS.py
+IMAGE_TYPES = ('flat', 'calibration', 'target')
+
+# Lights-off reference modes, see capture.ambient
+AMBIENT_MODES = ('off', 'frame', 'sequence')
+
+MANIFEST_NAME = "manifest.json"
+
+# Default per-frame quality limits, see capture.qc
+QC_LIMITS = {
+    'max_saturated': 0.005,  # fraction of pixels at full scale
+    'min_mean': 0.01,        # mean linear level
+    'max_mean': 0.9,
+    'min_sharpness': 0.5,    # relative to the sequence's first frame
+    'max_drift': 2.0,        # pixels from the sequence's first frame
+}
+
+
+class SessionSpec:
+    def __init__(self, object_id, image_types=('target',), lights=None,
+                 exposures=(0.7,), repeats=1, pwm=None, output_dir=None, pixel_format='Mono8',
+                 frames_per_light=1, save_variance=False, dark_frames=0, ambient='off', rig=None,
+                 intensity_calibration=None, balance_lights=False, qc=None, retakes=2, roi=None):
+        """
+        Validate and store the settings for one capture session.
+
+        Exposures are given in seconds, like CameraController.ORIGINAL_EXPOSURE.
+        pixel_format is a camera format from pixels.PIXEL_FORMATS. With
+        frames_per_light > 1 each light's frame is the float32 mean of that many
+        consecutive frames, optionally saved with its per-pixel variance.
+        dark_frames > 0 makes sure a master dark of that many frames is cached
+        for every exposure before the lit frames are captured. ambient selects
+        lights-off reference frames subtracted at capture ('off', 'frame' or
+        'sequence', see capture.ambient). rig is a LightRig, a rig JSON object or
+        a path to one; lights are names or indices in it (default: every light).
+        intensity_calibration is a calibration.intensity JSON file stored with the
+        manifest for processing; balance_lights also uses it to give each light
+        its own PWM level so all lights match the dimmest one at pwm.
+        qc checks every frame at capture (True for the QC_LIMITS, or a dict
+        overriding some of them) and retakes a failing frame up to retakes
+        times before moving on. roi reads out only part of the sensor for the
+        whole session: [x, y, width, height] in pixels, 'auto' for the object's
+        bounding box in frames lit at the start, or the path of a mask image
+        whose bounding box to use (see capture.roi).
+        """
+        if not object_id or not str(object_id).strip():
+            raise ValueError("Session spec needs an object_id")
+        self.object_id = str(object_id).strip()
+
+        self.image_types = [str(t).lower() for t in image_types]
+        for image_type in self.image_types:
+            if image_type not in IMAGE_TYPES:
+                raise ValueError(f"Unknown image type {image_type!r}, expected one of {IMAGE_TYPES}")
+
+        if rig is None:
+            rig = LightRig.default()
+        elif isinstance(rig, str):
+            rig = LightRig.load(rig)
+        elif isinstance(rig, dict):
+            rig = LightRig.from_dict(rig)
+        self.rig = rig
+        # Light indices in the rig, in capture order
+        self.lights = rig.resolve(lights)
+        if not self.lights:
+            raise ValueError("Session spec needs at least one light")
+
+        self.intensity_calibration = intensity_calibration
+        self.balance_lights = bool(balance_lights)
+        if self.balance_lights and not intensity_calibration:
+            raise ValueError("balance_lights needs an intensity_calibration")
+
+        self.exposures = [float(e) for e in exposures]
+        if not self.exposures or any(e <= 0 for e in self.exposures):
+            raise ValueError("Exposures must be a non-empty list of positive times in seconds")
+
+        self.repeats = int(repeats)
+        if self.repeats < 1:
+            raise ValueError("Repeats must be at least 1")
+
+        if pwm is not None and not 0 <= int(pwm) <= 255:
+            raise ValueError("PWM value must be between 0 and 255")
+        self.pwm = None if pwm is None else int(pwm)
+        self.output_dir = output_dir
+
+        if pixel_format not in PIXEL_FORMATS:
+            raise ValueError(f"Unknown pixel format {pixel_format!r}, expected one of {sorted(PIXEL_FORMATS)}")
+        self.pixel_format = pixel_format
+
+        self.frames_per_light = int(frames_per_light)
+        if self.frames_per_light < 1:
+            raise ValueError("frames_per_light must be at least 1")
+        self.save_variance = bool(save_variance)
+
+        self.dark_frames = int(dark_frames)
+        if self.dark_frames < 0:
+            raise ValueError("dark_frames cannot be negative")
+
+        if ambient not in AMBIENT_MODES:
+            raise ValueError(f"Unknown ambient mode {ambient!r}, expected one of {AMBIENT_MODES}")
+        self.ambient = ambient
+
+        if qc is None or qc is False:
+            self.qc = None
+        else:
+            self.qc = dict(QC_LIMITS)
+            if isinstance(qc, dict):
+                unknown = set(qc) - set(QC_LIMITS)
+                if unknown:
+                    raise ValueError(f"Unknown QC limits: {sorted(unknown)}, expected {sorted(QC_LIMITS)}")
+                self.qc.update({key: float(value) for key, value in qc.items()})
+        self.retakes = int(retakes)
+        if self.retakes < 0:
+            raise ValueError("retakes cannot be negative")
+
+        if isinstance(roi, (list, tuple)):
+            if len(roi) != 4:
+                raise ValueError(f"roi must be [x, y, width, height], got {roi}")
+            roi = [int(value) for value in roi]
+            if roi[0] < 0 or roi[1] < 0 or roi[2] <= 0 or roi[3] <= 0:
+                raise ValueError(f"roi needs a non-negative offset and a positive size, got {roi}")
+        elif roi is not None and not isinstance(roi, str):
+            raise ValueError(f"roi must be [x, y, width, height], 'auto' or a mask path, got {roi!r}")
+        self.roi = roi
+
+    @classmethod
+    def from_dict(cls, data, defaults=None):
+        """
+        Build a spec from a JSON object, filling missing keys from defaults.
+        """
+        merged = dict(defaults or {})
+        merged.update(data)
+        unknown = set(merged) - {'object_id', 'image_types', 'lights', 'exposures',
+                                 'repeats', 'pwm', 'output_dir', 'pixel_format',
+                                 'frames_per_light', 'save_variance', 'dark_frames', 'ambient',
+                                 'rig', 'intensity_calibration', 'balance_lights', 'qc',
+                                 'retakes', 'roi'}
+        if unknown:
+            raise ValueError(f"Unknown session spec keys: {sorted(unknown)}")
+        return cls(**merged)
+
+    def to_dict(self):
+        """
+        Return the spec as a JSON-serializable dict.
+        """
+        return {
+            'object_id': self.object_id,
+            'image_types': list(self.image_types),
+            'lights': [self.rig[index].name for index in self.lights],
+            'exposures': list(self.exposures),
+            'repeats': self.repeats,
+            'pwm': self.pwm,
+            'output_dir': self.output_dir,
+            'pixel_format': self.pixel_format,
+            'frames_per_light': self.frames_per_light,
+            'save_variance': self.save_variance,
+            'dark_frames': self.dark_frames,
+            'ambient': self.ambient,
+            'rig': self.rig.to_dict(),
+            'intensity_calibration': self.intensity_calibration,
+            'balance_lights': self.balance_lights,
+            'qc': self.qc,
+            'retakes': self.retakes,
+            'roi': self.roi,
+        }
+
+    def sequences(self):
+        """
+        Yield (image_type, exposure, repeat) for every light sequence, in capture order.
+        """
+        for image_type in self.image_types:
+            for exposure in self.exposures:
+                for repeat in range(self.repeats):
+                    yield image_type, exposure, repeat
+
+    def captures(self):
+        """
+        Yield (image_type, exposure, repeat, light index) for every frame, in capture order.
+        """
+        for image_type, exposure, repeat in self.sequences():
+            for light in self.lights:
+                yield image_type, exposure, repeat, light
+
+    def frame_count(self):
+        """
+        Number of frames the session will capture.
+        """
+        return len(self.image_types) * len(self.exposures) * self.repeats * len(self.lights)
+
+    def session_dir(self, root=None):
+        """
+        Directory the session's frames and manifest are written to.
+        """
+        base = self.output_dir or root
+        if base is None:
+            base = os.path.abspath(os.path.join(os.getcwd(), "..", "images"))
+        return os.path.join(base, self.object_id)
+
+
+def load_session_specs(path):
+    """
+    Load one or more session specs from a JSON file.
+    """
+    with open(path, 'r') as f:
+        data = json.load(f)
+    return parse_session_specs(data, os.path.dirname(os.path.abspath(path)))
+
+
+def parse_session_specs(data, base_dir=None):
+    """
+    Turn parsed JSON (object, list, or {"defaults", "sessions"}) into SessionSpecs.
+    Relative rig, intensity calibration and ROI mask paths are resolved against
+    base_dir if given.
+    """
+    defaults = None
+    if isinstance(data, dict) and 'sessions' in data:
+        defaults = data.get('defaults')
+        data = data['sessions']
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list) or not data:
+        raise ValueError("Session spec must be an object, a list, or contain a 'sessions' list")
+    if base_dir is not None:
+        defaults = _with_paths(defaults, base_dir)
+        data = [_with_paths(item, base_dir) for item in data]
+    return [SessionSpec.from_dict(item, defaults) for item in data]
+
+
+def _with_paths(data, base_dir):
+    for key in ('rig', 'intensity_calibration', 'roi'):
+        if isinstance(data, dict) and isinstance(data.get(key), str) and data[key] != 'auto':
+            data = dict(data, **{key: os.path.join(base_dir, data[key])})
+    return data
+
+
+def load_manifest(session_dir):
+    """
+    Read a session's manifest.json.
+    """
+    with open(os.path.join(session_dir, MANIFEST_NAME), 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(session_dir, spec, frames, status, started_at, extra=None):
+    """
+    Write the session manifest listing every captured frame, plus any extra keys.
+
+    The manifest is written last and atomically, so its presence with status
+    'complete' marks a finished session for downstream processing.
+    """
+    manifest = {
+        'spec': spec.to_dict(),
+        'bit_depth': PIXEL_FORMATS[spec.pixel_format],
+        'status': status,
+        'started_at': started_at,
+        'finished_at': time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime()),
+        'frames': frames,
+    }
+    manifest.update(extra or {})
+    os.makedirs(session_dir, exist_ok=True)
+    path = os.path.join(session_dir, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,64 @@
+"""
+Display Helpers
+
+Interactive windows for inspecting captures and results. These are the only
+places matplotlib and the OpenCV GUI are used, and they are imported when a
+window is opened rather than by the capture or processing code.
+"""
+
+from cultural_heritage_imaging._optional import lazy_import
+
+cv = lazy_import('cv2', "opencv-python")
+plt = lazy_import('matplotlib.pyplot', "matplotlib (pip install cultural_heritage_imaging[viz])")
+
+
+def show_image(title, image):
+    """
+    Show an image in an OpenCV window and wait for a key press.
+    """
+    cv.imshow(title, image)
+    cv.waitKey(0)
+    cv.destroyAllWindows()
+
+
+def show_light_images(images, names):
+    """
+    Show one grayscale frame per light side by side.
+    """
+    fig, axs = plt.subplots(1, len(images), figsize=(5 * len(images), 5), squeeze=False)
+    for ax, image, name in zip(axs[0], images, names):
+        ax.imshow(image, cmap='gray')
+        ax.set_title(f"{name} Light Image")
+        ax.axis('off')
+    plt.show()
+
+
+def show_preview(path, title="Preview"):
+    """
+    Show the frames of a capture.preview.PreviewBuffer as they arrive, with
+    saturated pixels in red and the focus and exposure metrics drawn on top,
+    until the writer stops or q/Esc is pressed (which also stops the writer).
+    """
+    from cultural_heritage_imaging.capture.preview import PreviewBuffer
+
+    buffer = PreviewBuffer(path)
+    try:
+        while not buffer.closed:
+            frame, metrics = buffer.read()
+            if frame is not None:
+                image = cv.cvtColor(frame, cv.COLOR_GRAY2BGR)
+                image[frame == 255] = (0, 0, 255)
+                relative = metrics['focus'] / metrics['best_focus'] if metrics['best_focus'] else 0.0
+                lines = (f"focus {metrics['focus']:.3g} ({relative:.0%} of best)",
+                         f"mean {metrics['mean']:.0%}  saturated {metrics['saturated']:.2%}",
+                         f"{metrics['fps']:.1f} fps")
+                for row, text in enumerate(lines):
+                    cv.putText(image, text, (10, 25 + 25 * row), cv.FONT_HERSHEY_SIMPLEX, 0.6,
+                               (0, 255, 0), 1, cv.LINE_AA)
+                cv.imshow(title, image)
+            if cv.waitKey(5) & 0xFF in (ord('q'), 27):
+                buffer.request_stop()
+                break
+    finally:
+        cv.destroyAllWindows()
+        buffer.close()
@@ -7,12 +7,17 @@ setup(
     install_requires=[
         'numpy',
         'opencv-python',
-        'matplotlib',
-        'vtk'
+        'tifffile'
     ],
+    extras_require={
+        # PySpin comes from the Spinnaker SDK installer, not PyPI
+        'capture': ['pyserial'],
+        'viz': ['matplotlib', 'vtk'],
+        'test': ['pytest'],
+    },
     entry_points={
         'console_scripts': [
-            'mypackage=cultural_heritage_imaging.module:main',
+            'chi=cultural_heritage_imaging.cli:main',
         ],
     },
     author='Lilli Kelley, Chris Lenhard',
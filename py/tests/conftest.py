@@ -0,0 +1,42 @@
+"""
+Shared fixtures. The tests run against the simulated camera and Arduino in
+capture.simulated, so they need neither PySpin nor pyserial.
+"""
+
+import os
+import sys
+
+import pytest
+
+# Import the package and benchmarks from this checkout, wherever pytest is run from
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# Simulated sensor size: small enough that a session captures and solves in well under a second
+WIDTH, HEIGHT = 96, 72
+
+
+@pytest.fixture
+def capture(tmp_path):
+    """
+    Capture a session on a simulated rig: capture(object_id, rig=None,
+    seed=0, **spec) returns its session directory under tmp_path/captures.
+    """
+    from cultural_heritage_imaging.capture.controller import CameraController
+    from cultural_heritage_imaging.capture.simulated import SimulatedRig
+    from cultural_heritage_imaging.session import SessionSpec
+
+    def capture(object_id='vase', rig=None, seed=0, **spec):
+        simulated = SimulatedRig(WIDTH, HEIGHT, rig=rig, seed=seed)
+        controller = CameraController(arduino=simulated.arduino, spin=simulated.spin,
+                                      rig=simulated.rig)
+        session = SessionSpec(object_id, output_dir=str(tmp_path / 'captures'), rig=simulated.rig,
+                              **spec)
+        try:
+            assert controller.run_session(session)
+        finally:
+            controller.cleanup()
+        return session.session_dir()
+    return capture
@@ -0,0 +1,95 @@
+"""
+Stage and light-field caches, including several processes sharing one cache
+directory as batch workers and the processing service do.
+"""
+
+import concurrent.futures
+import multiprocessing
+import os
+
+import numpy as np
+
+from cultural_heritage_imaging.processing.batch import BatchProcessor, read_status
+from cultural_heritage_imaging.processing.cache import StageCache, cached_stage, stage_key
+from cultural_heritage_imaging.processing import nearfield
+from cultural_heritage_imaging.rig import LightRig
+
+# Processes racing on one cache directory
+WORKERS = 4
+
+
+def _pool():
+    return concurrent.futures.ProcessPoolExecutor(WORKERS, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _churn(root, worker):
+    # Store and read back more entries than fit, so every process evicts
+    # entries the others are reading or writing
+    cache = StageCache(root, max_bytes=3 * 400_000)
+    for step in range(40):
+        value = (step + worker) % 7
+        arrays = cached_stage(cache, 'load', f"entry{value}",
+                              lambda: {'frames': np.full(100_000, value, dtype=np.float32)})
+        assert arrays['frames'][0] == value
+    return cache.size()
+
+
+def _near_field_rig():
+    return LightRig.ring(8, distance=300.0, camera={'mm_per_pixel': 0.2})
+
+
+def _load_field(cache_dir):
+    model = nearfield.near_field_model(_near_field_rig(), list(range(8)), (60, 80), cache_dir=cache_dir)
+    return np.asarray(model.pseudo_inverse()).sum()
+
+
+def test_stage_cache_round_trip(tmp_path):
+    cache = StageCache(str(tmp_path))
+    key = stage_key('solve', 'upstream', {'mask': 1})
+    assert cache.get(key) is None
+    cache.put(key, normals=np.ones((4, 5, 3), dtype=np.float32))
+    assert cache.get(key)['normals'].shape == (4, 5, 3)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert stage_key('solve', 'upstream', {'mask': 2}) != key
+    # Only finished entries are left in the directory
+    assert os.listdir(tmp_path) == [key + ".npz"]
+
+
+def test_stage_cache_evicts_least_recently_used(tmp_path):
+    cache = StageCache(str(tmp_path), max_bytes=2 * 4_500)
+    for index, name in enumerate(('a', 'b')):
+        cache.put(name, values=np.zeros(1000, dtype=np.float32))
+        os.utime(cache.path(name), ns=(index * 10 ** 9, index * 10 ** 9))
+    cache.get('a')
+    cache.put('c', values=np.zeros(1000, dtype=np.float32))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+
+
+def test_stage_cache_shared_between_processes(tmp_path):
+    with _pool() as pool:
+        sizes = list(pool.map(_churn, [str(tmp_path)] * WORKERS, range(WORKERS)))
+    assert all(size <= 3 * 400_000 + 400_000 for size in sizes)
+    assert not [name for name in os.listdir(tmp_path) if not name.endswith(".npz")]
+
+
+def test_near_field_cache_shared_between_processes(tmp_path):
+    with _pool() as pool:
+        sums = list(pool.map(_load_field, [str(tmp_path)] * WORKERS))
+    assert np.allclose(sums, sums[0])
+    # One whole field file, no temporary files left behind
+    assert len(os.listdir(tmp_path)) == 1
+    assert np.isclose(np.load(tmp_path / os.listdir(tmp_path)[0]).sum(), sums[0])
+
+
+def test_batch_workers_share_caches(tmp_path, capture):
+    rig = _near_field_rig()
+    for index in range(3):
+        capture(f"object{index}", rig=rig, seed=index)
+    root = str(tmp_path / 'captures')
+    processor = BatchProcessor(root, workers=3, retries=0, solver='near',
+                               field_cache=str(tmp_path / 'fields'), cache_dir=str(tmp_path / 'stages'))
+    assert processor.run(once=True) == (3, 0)
+    for index in range(3):
+        record = read_status(os.path.join(root, f"object{index}", 'results'))
+        assert record['status'] == 'done', record.get('traceback')
@@ -0,0 +1,100 @@
+"""
+Unattended capture on the simulated rig: sessions, their journal and resume,
+and how chi capture reports failed sessions.
+"""
+
+import json
+import os
+from unittest import mock
+
+import pytest
+
+from cultural_heritage_imaging import cli
+from cultural_heritage_imaging.capture.controller import CameraController
+from cultural_heritage_imaging.capture.journal import JournalError, SessionJournal
+from cultural_heritage_imaging.capture.simulated import SimulatedRig
+from cultural_heritage_imaging.session import MANIFEST_NAME, SessionSpec
+
+
+class _SimulatedController(CameraController):
+    # What chi capture builds, on the simulated rig instead of a serial port
+    def __init__(self, **kwargs):
+        simulated = SimulatedRig(64, 48)
+        super().__init__(arduino=simulated.arduino, spin=simulated.spin)
+
+
+def _chi_capture(tmp_path, *args):
+    with mock.patch('cultural_heritage_imaging.capture.controller.CameraController', _SimulatedController):
+        return cli.main(['capture', '--output', str(tmp_path), '--yes'] + list(args))
+
+
+def test_session_writes_manifest(capture):
+    session_dir = capture('coin', exposures=[0.5], repeats=2)
+    with open(os.path.join(session_dir, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    assert manifest['status'] == 'complete'
+    assert len(manifest['frames']) == 8
+    for frame in manifest['frames']:
+        assert os.path.exists(os.path.join(session_dir, frame['path']))
+
+
+def test_frames_lit_at_recorded_pwm(capture, monkeypatch):
+    # The master dark sends 'C', which resets the firmware's PWM level
+    lit_at = []
+    render = SimulatedRig.render
+
+    def recording_render(self):
+        if self.lit is not None:
+            lit_at.append(self.pwm)
+        return render(self)
+    monkeypatch.setattr(SimulatedRig, 'render', recording_render)
+    session_dir = capture('coin', pwm=100, dark_frames=2)
+    with open(os.path.join(session_dir, MANIFEST_NAME)) as f:
+        recorded = [frame['pwm'] for frame in json.load(f)['frames']]
+    assert recorded == [100] * 4
+    assert lit_at == recorded
+
+
+def test_resume_captures_only_missing_frames(tmp_path):
+    simulated = SimulatedRig(64, 48)
+    controller = CameraController(arduino=simulated.arduino, spin=simulated.spin)
+    spec = SessionSpec('coin', output_dir=str(tmp_path))
+    assert controller.run_session(spec)
+    with open(os.path.join(spec.session_dir(), MANIFEST_NAME)) as f:
+        paths = [os.path.join(spec.session_dir(), frame['path']) for frame in json.load(f)['frames']]
+    os.remove(paths[1])
+    kept = {path: os.stat(path).st_mtime_ns for path in paths if path != paths[1]}
+    assert controller.run_session(spec, resume=True)
+    assert os.path.exists(paths[1])
+    assert {path: os.stat(path).st_mtime_ns for path in kept} == kept
+
+
+def test_journal_rejects_other_settings(tmp_path):
+    spec = SessionSpec('coin', output_dir=str(tmp_path))
+    SessionJournal.open(spec.session_dir(), spec)
+    other = SessionSpec('coin', output_dir=str(tmp_path), exposures=[0.3])
+    with pytest.raises(JournalError):
+        SessionJournal.open(other.session_dir(), other, resume=True)
+    # The same settings resume
+    assert SessionJournal.open(spec.session_dir(), spec, resume=True).frames == []
+
+
+def test_capture_reports_resume_mismatch(tmp_path, capsys):
+    assert _chi_capture(tmp_path, '--object-id', 'coin') == 0
+    assert _chi_capture(tmp_path, '--object-id', 'coin', '--resume', '--exposure', '0.3') == 1
+    assert "Cannot resume coin" in capsys.readouterr().out
+
+
+def test_capture_reports_other_errors_as_failures(tmp_path, capsys):
+    spec_path = tmp_path / 'tray.json'
+    spec_path.write_text(json.dumps({'sessions': [
+        {'object_id': 'coin', 'roi': str(tmp_path / 'missing.png')},
+        {'object_id': 'vase'},
+    ]}))
+    assert _chi_capture(tmp_path, str(spec_path)) == 1
+    out = capsys.readouterr().out
+    assert "Capture of coin failed: ValueError" in out
+    assert "Cannot resume" not in out
+    # The rest of the tray still runs
+    assert "Failed sessions: coin\n" in out
+    assert os.path.exists(tmp_path / 'vase' / MANIFEST_NAME)
@@ -0,0 +1,16 @@
+"""
+Import-time budget of the entry modules (see benchmarks/import_time.py).
+"""
+
+import pytest
+
+import import_time
+
+
+@pytest.mark.parametrize('module, budget, forbidden', import_time.BUDGETS,
+                         ids=[module for module, _, _ in import_time.BUDGETS])
+def test_import_budget(module, budget, forbidden):
+    seconds, loaded = import_time.measure(module)
+    heavy = sorted(name for name in forbidden if name in loaded)
+    assert not heavy, f"{module} loads {', '.join(heavy)} at import"
+    assert seconds <= budget, f"{module} imports in {seconds * 1000:.1f} ms, budget {budget * 1000:.0f} ms"
@@ -0,0 +1,96 @@
+"""
+Photometric stereo on simulated sessions: the solvers, stack precision,
+color captures and the exported views.
+"""
+
+import numpy as np
+import pytest
+
+from cultural_heritage_imaging.capture.simulated import PAINT
+from cultural_heritage_imaging.processing import color, export
+from cultural_heritage_imaging.processing.cache import StageCache
+from cultural_heritage_imaging.processing.pipeline import process_session
+from cultural_heritage_imaging.rig import LightRig
+
+from conftest import HEIGHT, WIDTH
+
+
+def _ring(**kwargs):
+    return LightRig.ring(8, slant=40.0, **kwargs)
+
+
+def _sample(normals):
+    # Normals at the centre of the sphere and halfway to its right and top edges
+    cy, cx = HEIGHT // 2, WIDTH // 2
+    return normals[cy, cx], normals[cy, cx + HEIGHT // 4], normals[cy - HEIGHT // 4, cx]
+
+
+@pytest.mark.parametrize('solver, rig', [
+    ('distant', _ring()),
+    ('near', _ring(distance=2000.0, camera={'mm_per_pixel': 0.05})),
+])
+def test_sphere_normals(capture, solver, rig):
+    normals, albedo = process_session(capture(rig=rig), solver=solver)
+    assert normals.shape == (HEIGHT, WIDTH, 3) and normals.dtype == np.float32
+    centre, right, top = _sample(normals)
+    assert centre[2] > 0.98
+    # Image x runs right and normal y up
+    assert right[0] > 0.3 and abs(right[1]) < 0.1
+    assert top[1] > 0.3 and abs(top[0]) < 0.1
+    assert albedo[HEIGHT // 2, WIDTH // 2] > 0
+
+
+def test_float16_stack_matches_float32(capture):
+    session_dir = capture(rig=_ring())
+    normals, albedo = process_session(session_dir)
+    half_normals, half_albedo = process_session(session_dir, precision='float16')
+    assert np.abs(half_normals - normals).max() < 5e-3
+    assert np.allclose(half_albedo, albedo, rtol=5e-3, atol=1e-3)
+
+
+def test_cache_reuses_stages(capture, tmp_path):
+    session_dir = capture(rig=_ring())
+    cache = StageCache(str(tmp_path / 'cache'))
+    first = process_session(session_dir, cache=cache)
+    misses = cache.misses
+    second = process_session(session_dir, cache=cache)
+    assert cache.misses == misses
+    assert np.array_equal(first[0], second[0])
+
+
+@pytest.mark.parametrize('pattern', color.PATTERNS)
+@pytest.mark.parametrize('mode', color.DEMOSAIC_MODES)
+def test_demosaic_constant_color(pattern, mode):
+    rgb = (0.2, 0.5, 0.8)
+    mosaic = np.empty((8, 10), dtype=np.float32)
+    for row in (0, 1):
+        for col in (0, 1):
+            mosaic[row::2, col::2] = rgb['RGB'.index(pattern[2 * row + col])]
+    image = color.demosaic(mosaic, pattern, mode)
+    assert image.shape == color.output_shape(mosaic.shape, mode) + (3,)
+    assert np.allclose(image, rgb)
+    assert np.allclose(color.luminance(mosaic, pattern, mode), image.mean(axis=2))
+
+
+@pytest.mark.parametrize('mode', color.DEMOSAIC_MODES)
+def test_color_albedo_follows_paint(capture, mode):
+    session_dir = capture(rig=_ring(), pixel_format='BayerRG12p')
+    normals, albedo = process_session(session_dir, demosaic=mode)
+    height, width = color.output_shape((HEIGHT, WIDTH), mode)
+    assert albedo.shape == (height, width, 3)
+    for side, column in ((0, width // 2 - width // 8), (1, width // 2 + width // 8)):
+        rgb = albedo[height // 2, column]
+        assert np.allclose(rgb / rgb.max(), np.divide(PAINT[side], max(PAINT[side])), atol=0.05)
+
+
+def test_normal_map_encoding():
+    normals = np.zeros((2, 3, 3), dtype=np.float32)
+    normals[0] = (0.0, 0.0, 1.0)
+    normals[1, 0] = (1.0, 0.0, 0.0)
+    image = export.encode_normals(normals)
+    # BGR for OpenCV, so files read as RGB = x, y, z
+    assert tuple(image[0, 0]) == (255, 128, 128)
+    assert tuple(image[1, 0]) == (128, 128, 255)
+    # Unsolved pixels are black
+    assert tuple(image[1, 1]) == (0, 0, 0)
+    assert export.encode_normals(normals, bits=16)[0, 0, 0] == 65535
@@ -0,0 +1,59 @@
+"""
+Processing service round trip on localhost, and its answers to malformed
+requests.
+"""
+
+import http.client
+import json
+import os
+
+import pytest
+
+from cultural_heritage_imaging.processing.service import ProcessingClient, ProcessingService
+
+
+@pytest.fixture
+def service(tmp_path):
+    with ProcessingService(str(tmp_path / 'jobs'), port=0, workers=1).start() as service:
+        yield service
+
+
+def _raw(service, method, path, headers):
+    # A request the client would never send
+    client = ProcessingClient(service.url)
+    connection = http.client.HTTPConnection(client.host, client.port, timeout=10)
+    try:
+        connection.putrequest(method, path)
+        for name, value in headers.items():
+            connection.putheader(name, value)
+        connection.endheaders()
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_round_trip(service, capture, tmp_path):
+    session_dir = capture('coin')
+    client = ProcessingClient(service.url)
+    paths = client.process(session_dir, str(tmp_path / 'results'), normal_bits=16)
+    names = {os.path.basename(path) for path in paths}
+    assert {'normal_map.png', 'albedo.png', 'batch.json'} <= names
+    assert service.health()['jobs'] == {}
+
+
+def test_unknown_option_is_rejected(service, capture):
+    with pytest.raises(ValueError, match="Unknown option"):
+        ProcessingClient(service.url).submit(capture('coin'), colour='red')
+
+
+@pytest.mark.parametrize('length', ['abc', '-5'])
+def test_bad_content_length(service, length):
+    status, body = _raw(service, 'POST', '/sessions', {'Content-Length': length})
+    assert status == 400 and 'Content-Length' in body['error']
+
+
+@pytest.mark.parametrize('wait', ['soon', 'inf', 'nan'])
+def test_bad_wait(service, wait):
+    status, body = _raw(service, 'GET', f"/jobs/unknown/results?wait={wait}", {})
+    assert status == 400 and 'wait' in body['error']